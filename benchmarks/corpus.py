@@ -0,0 +1,224 @@
+"""Generation of synthetic, reproducible, photo corpora to benchmark against.
+
+Files are minimal, but structurally valid, JPEG and TIFF files, carrying EXIF
+date tags and padded with incompressible data up to a chosen size.  Every
+choice is drawn from a seeded random number generator, so a CorpusSpec always
+produces byte-identical corpora, entirely offline.
+"""
+
+import json
+import os
+import random
+import struct
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+MANIFEST_NAME = "corpus.json"
+
+# Files placed in each directory of the camera layout, as cameras do in DCIM.
+CAMERA_DIR_SIZE = 200
+
+# Files placed in each album of the albums layout.
+ALBUM_SIZE = 50
+
+ALBUM_NAMES = ("Holiday", "Birthday", "Walk in the Hills", "Wedding", "Garden", "Beach Day")
+
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# TIFF tag type of NUL terminated ASCII strings, and of 32 bit offsets.
+ASCII = 2
+LONG = 4
+
+IfdEntry = Tuple[int, int, int, bytes]
+
+
+class Layout(str, Enum):
+    """Shapes of directory tree photos may arrive in."""
+
+    flat = "flat"
+    camera = "camera"
+    dated = "dated"
+    albums = "albums"
+
+
+@dataclass(frozen=True)
+class CorpusSpec:
+    """Everything controlling the content of a generated corpus."""
+
+    files: int = 1000
+    seed: int = 0
+    layout: Layout = Layout.camera
+    min_kb: int = 256
+    max_kb: int = 4096
+    duplicate_ratio: float = 0.05
+    tiff_ratio: float = 0.05
+    no_exif_ratio: float = 0.02
+    first_year: int = 2005
+    last_year: int = 2020
+
+    def to_dict(self) -> Dict[str, Union[int, float, str]]:
+        """Return the spec as a JSON serialisable dictionary."""
+        spec = asdict(self)
+        spec["layout"] = self.layout.value
+        return spec
+
+
+class CorpusSummary(NamedTuple):
+    """What was generated for a CorpusSpec."""
+
+    files: int
+    bytes: int
+    duplicates: int
+
+
+def _ifd(entries: List[IfdEntry], offset: int, next_ifd: int = 0) -> bytes:
+    """Lay out a little endian TIFF IFD at offset, with any out of line values following it."""
+    data_offset = offset + 2 + 12 * len(entries) + 4
+
+    table = struct.pack("<H", len(entries))
+    data = b""
+    for tag, tag_type, count, value in sorted(entries):
+        if len(value) <= 4:
+            table += struct.pack("<HHI", tag, tag_type, count) + value.ljust(4, b"\x00")
+            continue
+
+        table += struct.pack("<HHII", tag, tag_type, count, data_offset + len(data))
+        data += value + b"\x00" * (len(value) % 2)
+
+    return table + struct.pack("<I", next_ifd) + data
+
+
+def ascii_entry(tag: int, value: str) -> IfdEntry:
+    """Return an IFD entry holding value as a NUL terminated ASCII string."""
+    encoded = value.encode() + b"\x00"
+    return (tag, ASCII, len(encoded), encoded)
+
+
+def exif_tiff(taken: Optional[datetime], exif_tags: Iterable[IfdEntry] = ()) -> bytes:
+    """Build a little endian TIFF structure, holding the EXIF date tags for taken.
+
+    Any exif_tags are added to the EXIF IFD, replacing the date tags of the same tag.
+    """
+    ifd0: List[IfdEntry] = [(0x010F, ASCII, 10, b"Organiser\x00")]
+    if taken is None:
+        return b"II*\x00" + struct.pack("<I", 8) + _ifd(ifd0, 8)
+
+    date = ascii_entry(0x0132, taken.strftime(EXIF_DATE_FORMAT))
+    ifd0.append(date)
+
+    # The EXIF IFD follows IFD0, whose size doesn't depend on the pointer's value.
+    exif_offset = 8 + len(_ifd(ifd0 + [(0x8769, LONG, 1, b"\x00" * 4)], 8))
+    ifd0.append((0x8769, LONG, 1, struct.pack("<I", exif_offset)))
+
+    exif_ifd = {tag: (tag, *date[1:]) for tag in (0x9003, 0x9004)}
+    exif_ifd.update((entry[0], entry) for entry in exif_tags)
+
+    exif = _ifd(list(exif_ifd.values()), exif_offset)
+    return b"II*\x00" + struct.pack("<I", 8) + _ifd(ifd0, 8) + exif
+
+
+def jpeg(taken: Optional[datetime], payload: bytes, exif_tags: Iterable[IfdEntry] = ()) -> bytes:
+    """Build a JPEG with a JFIF header, an EXIF APP1 segment, and payload as scan data.
+
+    See exif_tiff for exif_tags.
+    """
+    jfif = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    app1 = b"Exif\x00\x00" + exif_tiff(taken, exif_tags)
+
+    return b"".join(
+        [
+            b"\xff\xd8",
+            b"\xff\xe0" + struct.pack(">H", len(jfif) + 2) + jfif,
+            b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1,
+            b"\xff\xda" + struct.pack(">H", 2),
+            payload,
+            b"\xff\xd9",
+        ],
+    )
+
+
+def tiff(taken: Optional[datetime], payload: bytes) -> bytes:
+    """Build a TIFF with the EXIF date tags for taken, followed by payload as image data."""
+    return exif_tiff(taken) + payload
+
+
+def _directory(spec: CorpusSpec, index: int, taken: datetime, rng: random.Random) -> str:
+    """Choose the directory, relative to the corpus root, of the index'th file."""
+    if spec.layout is Layout.flat:
+        return "dump"
+
+    if spec.layout is Layout.camera:
+        return os.path.join("DCIM", f"{100 + index // CAMERA_DIR_SIZE}CAMERA")
+
+    if spec.layout is Layout.dated:
+        return os.path.join(f"{taken:%Y}", f"{taken:%m}")
+
+    album = index // ALBUM_SIZE
+    name = ALBUM_NAMES[album % len(ALBUM_NAMES)]
+    return f"{taken:%Y.%m.%d} {name} {album}" if rng.random() > 0.2 else "Unsorted"
+
+
+def generate_corpus(spec: CorpusSpec, directory: Path) -> CorpusSummary:
+    """Write the corpus described by spec into directory, along with a manifest of spec."""
+    rng = random.Random(spec.seed)
+    first = datetime(spec.first_year, 1, 1)
+    span = datetime(spec.last_year + 1, 1, 1) - first
+
+    written: List[Tuple[datetime, bytes]] = []
+    total_bytes = 0
+    duplicates = 0
+
+    # Albums share a date, so they are drawn per album rather than per file.
+    album_date = first
+
+    for index in range(spec.files):
+        if index % ALBUM_SIZE == 0:
+            album_date = first + timedelta(seconds=rng.randrange(int(span.total_seconds())))
+
+        if written and rng.random() < spec.duplicate_ratio:
+            taken, contents = written[rng.randrange(len(written))]
+            duplicates += 1
+        else:
+            taken = first + timedelta(seconds=rng.randrange(int(span.total_seconds())))
+            if spec.layout is Layout.albums:
+                taken = album_date + timedelta(seconds=rng.randrange(3600))
+
+            size = rng.randint(spec.min_kb, spec.max_kb) * 1024
+            payload = rng.getrandbits(size * 8).to_bytes(size, "little")
+            has_exif = rng.random() >= spec.no_exif_ratio
+            build = tiff if rng.random() < spec.tiff_ratio else jpeg
+            contents = build(taken if has_exif else None, payload)
+            written.append((taken, contents))
+
+        extension = "TIF" if contents.startswith(b"II*") else "JPG"
+        file_path = directory / _directory(spec, index, taken, rng) / f"IMG_{index:06d}.{extension}"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(contents)
+
+        timestamp = taken.timestamp()
+        os.utime(file_path, (timestamp, timestamp))
+
+        total_bytes += len(contents)
+
+    summary = CorpusSummary(spec.files, total_bytes, duplicates)
+    (directory / MANIFEST_NAME).write_text(
+        json.dumps({"spec": spec.to_dict(), "summary": summary._asdict()}, indent=2),
+    )
+
+    return summary
+
+
+def load_corpus(spec: CorpusSpec, directory: Path) -> Optional[CorpusSummary]:
+    """Return the summary of the corpus in directory, if it was generated from spec."""
+    try:
+        manifest = json.loads((directory / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("spec") != spec.to_dict():
+        return None
+
+    return CorpusSummary(**manifest["summary"])
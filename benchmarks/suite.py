@@ -0,0 +1,401 @@
+"""Throughput benchmarks of each processing stage, and of whole runs, over a synthetic corpus.
+
+Every measurement runs in a freshly spawned process, so that the peak RSS
+reported for it covers that measurement alone.  Inputs a stage needs (e.g.
+the file headers parsed by get_file_meta) are prepared within that process,
+outside of the timed section, so count towards its peak RSS but not its
+time.  The corpus is generated just before measuring, so reads are usually
+served from the page cache, measuring the organiser rather than the disk.
+
+Results are written as JSON, which may be compared against the results of a
+previous commit, failing if any stage slowed beyond a threshold.
+"""
+
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import typer
+
+from benchmarks import corpus as cp
+from organiser import file_listing as fl
+from organiser import file_ops as fo
+from organiser import filename_calculations as fc
+from organiser import image_metadata as im
+from organiser.types import FileTarget
+
+# Files selected from the corpus, matching the organisers own default filter.
+FILE_FILTER = r".*(?:jpg|JPG|JPEG|jpeg|tif|TIF)$"
+
+# The per-file stages measured, in pipeline order, and the whole run.
+STAGES = (
+    "walk",
+    "load_file_contents",
+    "sha256_file",
+    "blake2b_file",
+    "xxh3_file",
+    "get_file_meta",
+    "identify_photo_move_path",
+    "migrate_file_target",
+    "end_to_end",
+)
+
+# Slow down in files per second, beyond which compare reports a regression.
+DEFAULT_THRESHOLD = 0.1
+
+Measurement = Tuple[int, int, float]
+
+
+class StageResult(NamedTuple):
+    """Throughput of a single stage."""
+
+    files: int
+    bytes: int
+    seconds: float
+    peak_rss_kb: int
+
+    @property
+    def files_per_second(self) -> float:
+        """Return the number of files processed per second."""
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        """Return the number of MB processed per second."""
+        return self.bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Union[int, float]]:
+        """Return the result, and the rates derived from it, as a JSON serialisable dict."""
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "files_per_second": round(self.files_per_second, 2),
+            "mb_per_second": round(self.mb_per_second, 2),
+            "peak_rss_kb": self.peak_rss_kb,
+        }
+
+
+def _targets(corpus_dir: Path) -> List[FileTarget]:
+    return list(fl.file_listing_iterator(corpus_dir, FILE_FILTER))
+
+
+def _total_size(targets: List[FileTarget]) -> int:
+    return sum(fl.stat_target(target).st_size for target in targets)
+
+
+def _walk(corpus_dir: Path, _: Path) -> Measurement:
+    start = time.perf_counter()
+    targets = _targets(corpus_dir)
+    elapsed = time.perf_counter() - start
+
+    return len(targets), 0, elapsed
+
+
+def _load_file_contents(corpus_dir: Path, _: Path) -> Measurement:
+    targets = _targets(corpus_dir)
+
+    start = time.perf_counter()
+    for target in targets:
+        fl.load_file_contents(target)
+    elapsed = time.perf_counter() - start
+
+    return len(targets), _total_size(targets), elapsed
+
+
+def _hash_file(corpus_dir: Path, _: Path, algorithm: fl.HashAlgorithm) -> Measurement:
+    targets = _targets(corpus_dir)
+
+    # Only the hashing is timed, each file is read into memory beforehand.
+    elapsed = 0.0
+    for target in targets:
+        contents = Path(target.file_path).read_bytes()
+
+        start = time.perf_counter()
+        digest = fl.new_hash(algorithm)
+        digest.update(contents)
+        target.file_hash = digest.digest()
+        elapsed += time.perf_counter() - start
+
+    return len(targets), _total_size(targets), elapsed
+
+
+def _get_file_meta(corpus_dir: Path, _: Path) -> Measurement:
+    headers = [
+        fl.load_file_header(target).file_contents or b""
+        for target in _targets(corpus_dir)
+    ]
+
+    start = time.perf_counter()
+    for header in headers:
+        im.get_file_meta(header)
+    elapsed = time.perf_counter() - start
+
+    return len(headers), sum(len(header) for header in headers), elapsed
+
+
+def _dated_targets(corpus_dir: Path) -> List[FileTarget]:
+    targets = [fl.load_file_header(target) for target in _targets(corpus_dir)]
+    return [
+        im.identify_image_datestamp(im.parse_image_meta_for_file_target(target))
+        .clear_contents_data()
+        for target in targets
+    ]
+
+
+def _identify_photo_move_path(corpus_dir: Path, storage_dir: Path) -> Measurement:
+    targets = _dated_targets(corpus_dir)
+
+    # Resolve every directory afresh, as the first run over a tree would.
+    fc.resolve_directory.cache_clear()
+
+    start = time.perf_counter()
+    for target in targets:
+        fc.identify_photo_move_path(str(storage_dir), target)
+    elapsed = time.perf_counter() - start
+
+    return len(targets), 0, elapsed
+
+
+def _migrate_file_target(corpus_dir: Path, storage_dir: Path) -> Measurement:
+    targets = [
+        fc.identify_photo_move_path(str(storage_dir), target)
+        for target in _dated_targets(corpus_dir)
+    ]
+    planner = fo.NamePlanner()
+
+    # Copy, so the corpus is left intact for the following stages.
+    start = time.perf_counter()
+    for target in targets:
+        fo.migrate_file_target(target, copy=True, planner=planner)
+    elapsed = time.perf_counter() - start
+
+    return len(targets), _total_size(targets), elapsed
+
+
+def _end_to_end(corpus_dir: Path, storage_dir: Path) -> Measurement:
+    targets = _targets(corpus_dir)
+
+    command = [
+        sys.executable,
+        "-m",
+        "organiser.main",
+        "--base-dir",
+        str(corpus_dir),
+        "--storage-dir",
+        str(storage_dir),
+        "--filter-regex",
+        FILE_FILTER,
+        "--copy-only",
+        "--no-cache",
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+
+    return len(targets), _total_size(targets), elapsed
+
+
+STAGE_FUNCTIONS: Dict[str, Callable[[Path, Path], Measurement]] = {
+    "walk": _walk,
+    "load_file_contents": _load_file_contents,
+    "sha256_file": partial(_hash_file, algorithm=fl.HashAlgorithm.sha256),
+    "blake2b_file": partial(_hash_file, algorithm=fl.HashAlgorithm.blake2b),
+    "xxh3_file": partial(_hash_file, algorithm=fl.HashAlgorithm.xxh3),
+    "get_file_meta": _get_file_meta,
+    "identify_photo_move_path": _identify_photo_move_path,
+    "migrate_file_target": _migrate_file_target,
+    "end_to_end": _end_to_end,
+}
+
+
+def _measure(stage: str, corpus_dir: Path, storage_dir: Path) -> StageResult:
+    """Measure stage, within a process of its own."""
+    files, size, seconds = STAGE_FUNCTIONS[stage](corpus_dir, storage_dir)
+
+    # The whole run happens in a child process of this one.
+    who = resource.RUSAGE_CHILDREN if stage == "end_to_end" else resource.RUSAGE_SELF
+    return StageResult(files, size, seconds, resource.getrusage(who).ru_maxrss)
+
+
+def run_stage(stage: str, corpus_dir: Path, scratch_dir: Path) -> StageResult:
+    """Measure stage in a freshly spawned process, with an empty storage directory."""
+    storage_dir = Path(tempfile.mkdtemp(prefix="storage-", dir=scratch_dir))
+    try:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            return pool.submit(_measure, stage, corpus_dir, storage_dir).result()
+
+    finally:
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+
+def _commit() -> Optional[str]:
+    """Return the commit being benchmarked, if this is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+        baseline: Dict[str, Dict[str, float]],
+        results: Dict[str, Dict[str, float]],
+        threshold: float = DEFAULT_THRESHOLD,
+) -> List[str]:
+    """Return the stages whose files per second dropped by more than threshold against baseline."""
+    regressions = []
+    for stage, result in results.items():
+        before = baseline.get(stage, {}).get("files_per_second")
+        if not before:
+            continue
+
+        change = result["files_per_second"] / before - 1
+        typer.echo(
+            f"{stage:>26}: {before:>10.1f} -> {result['files_per_second']:>10.1f} files/s"
+            f" ({change:+.1%})",
+        )
+        if change < -threshold:
+            regressions.append(stage)
+
+    return regressions
+
+
+def main(
+        output: Path = Path("benchmark.json"),
+        files: int = cp.CorpusSpec.files,
+        seed: int = cp.CorpusSpec.seed,
+        layout: cp.Layout = cp.CorpusSpec.layout,
+        min_kb: int = cp.CorpusSpec.min_kb,
+        max_kb: int = cp.CorpusSpec.max_kb,
+        duplicate_ratio: float = cp.CorpusSpec.duplicate_ratio,
+        tiff_ratio: float = cp.CorpusSpec.tiff_ratio,
+        no_exif_ratio: float = cp.CorpusSpec.no_exif_ratio,
+        corpus_dir: Optional[Path] = None,
+        stage: Optional[List[str]] = None,
+        repeat: int = 3,
+        baseline: Optional[Path] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+) -> None:
+    """Benchmark the organiser against a synthetic photo corpus, writing the results as JSON.
+
+    Arguments:
+        output: Where to write the results.
+
+        files: The number of files in the corpus.
+
+        seed: Seed of the corpus generator, the same seed and options always
+            generate the same corpus.
+
+        layout: The directory structure of the corpus.
+
+        min_kb: The minimum size of each file.
+
+        max_kb: The maximum size of each file.
+
+        duplicate_ratio: The fraction of files which are copies of another.
+
+        tiff_ratio: The fraction of files which are TIFFs, rather than JPEGs.
+
+        no_exif_ratio: The fraction of files without any EXIF date tags.
+
+        corpus_dir: Where to generate the corpus, which is kept for reuse by
+            later runs with the same options.  Defaults to a temporary
+            directory, removed afterwards.
+
+        stage: Stages to measure, defaults to all of them.  May be repeated.
+
+        repeat: The number of times each stage is measured, the fastest
+            being reported.
+
+        baseline: Results of an earlier run to compare against, exiting with
+            an error if any stage slowed by more than threshold.
+
+        threshold: The fraction by which a stage may slow before being
+            reported as a regression.
+
+    """
+    spec = cp.CorpusSpec(
+        files=files,
+        seed=seed,
+        layout=layout,
+        min_kb=min_kb,
+        max_kb=max_kb,
+        duplicate_ratio=duplicate_ratio,
+        tiff_ratio=tiff_ratio,
+        no_exif_ratio=no_exif_ratio,
+    )
+    # xxh3 is only measured where the optional xxhash package is installed.
+    stages = stage or [
+        name for name in STAGES
+        if name != "xxh3_file" or fl.hash_algorithm_available(fl.HashAlgorithm.xxh3)
+    ]
+    for name in stages:
+        if name not in STAGE_FUNCTIONS:
+            raise typer.BadParameter(f"Unknown stage {name}, choose from {', '.join(STAGES)}.")
+
+    scratch_dir = Path(tempfile.mkdtemp(prefix="organiser-benchmark-"))
+    try:
+        if corpus_dir is None:
+            corpus_dir = scratch_dir / "corpus"
+
+        summary = cp.load_corpus(spec, corpus_dir)
+        if summary is None:
+            typer.echo(f"Generating {files} files in {corpus_dir}.", err=True)
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+            summary = cp.generate_corpus(spec, corpus_dir)
+
+        results: Dict[str, Dict[str, float]] = {}
+        for name in stages:
+            best = min(
+                (run_stage(name, corpus_dir, scratch_dir) for _ in range(repeat)),
+                key=lambda result: result.seconds,
+            )
+            results[name] = best.to_dict()
+            typer.echo(
+                f"{name:>26}: {best.files_per_second:>10.1f} files/s"
+                f" {best.mb_per_second:>8.1f} MB/s {best.peak_rss_kb / 1024:>8.1f} MB peak RSS",
+            )
+
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    document = {
+        "commit": _commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": {**spec.to_dict(), **summary._asdict()},
+        "results": results,
+    }
+    output.write_text(json.dumps(document, indent=2) + "\n")
+    typer.echo(f"Results written to {output}.", err=True)
+
+    if baseline is not None:
+        regressions = compare(json.loads(baseline.read_text())["results"], results, threshold)
+        if regressions:
+            typer.secho(f"Regressed: {', '.join(regressions)}", fg=typer.colors.RED, err=True)
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,138 @@
+"""A budget of the bytes the readers of a pipeline may hold in memory at once.
+
+Readers stream each file through a fixed size buffer, keeping only its
+metadata header, so a reader is charged what it holds whilst reading: the
+size of the file, up to that of its header and one buffer.  Readers are
+admitted in the order they ask, so a reader needing more is never starved by
+a stream of smaller ones.  A reader charged more than the whole budget is
+admitted alone, once every other reader has been released.
+
+Waiting readers give up their place, raising Cancelled, once the event
+cancelling their pipeline is set.
+"""
+
+import logging
+import re
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Event
+from typing import Deque, Iterator, Optional, TypedDict
+
+LOG = logging.getLogger(__name__)
+
+SIZE_PATTERN = re.compile(r"(?P<count>\d+)\s*(?P<unit>[KMGT]?)i?B?", re.IGNORECASE)
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+# How often waiting readers wake up to check whether their pipeline was cancelled.
+POLL_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    """Raised from ByteBudget.acquire when the pipeline waiting on it was cancelled."""
+
+
+def parse_size(size: str) -> int:
+    """Parse a number of bytes, optionally suffixed with a binary unit, e.g. 512M or 2GiB.
+
+    Raises ValueError if size can't be parsed.
+    """
+    size_match = SIZE_PATTERN.fullmatch(size.strip())
+    if not size_match:
+        raise ValueError(f"Unable to parse {size!r} as a size, e.g. 512M or 2G.")
+
+    return int(size_match.group("count")) * SIZE_UNITS[size_match.group("unit").upper()]
+
+
+class BudgetSnapshot(TypedDict):
+    """The usage of a ByteBudget, see ByteBudget.snapshot."""
+
+    current: int
+    peak: int
+    limit: int
+    waiting: int
+    oversized: int
+
+
+class ByteBudget:
+    """Admission control of readers by the size of the files they read.
+
+    Safe to share between the workers of a stage.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+
+        self.current = 0
+        self.peak = 0
+        self.oversized = 0
+
+        self._condition = Condition()
+        # Tickets of the readers waiting to be admitted, in the order they asked.
+        self._waiting: Deque[int] = deque()
+        self._next_ticket = 0
+
+    @property
+    def waiting(self) -> int:
+        """The number of readers waiting to be admitted."""
+        return len(self._waiting)
+
+    def _fits(self, size: int) -> bool:
+        """Check whether size can be admitted now.  Callers must hold the condition."""
+        return not self.current or self.current + size <= self.max_bytes
+
+    def acquire(self, size: int, cancelled: Optional[Event] = None) -> None:
+        """Block until size bytes are admitted, after every reader which asked before.
+
+        Raises Cancelled, giving up the reader's place, should cancelled be set whilst waiting.
+        """
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._waiting.append(ticket)
+
+            timeout = POLL_INTERVAL if cancelled is not None else None
+            while not self._condition.wait_for(
+                    lambda: self._waiting[0] == ticket and self._fits(size),
+                    timeout,
+            ):
+                if cancelled is not None and cancelled.is_set():
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+                    raise Cancelled(f"Cancelled whilst waiting for {size} bytes.")
+
+            self._waiting.popleft()
+            self.current += size
+            self.peak = max(self.peak, self.current)
+            if size > self.max_bytes:
+                self.oversized += 1
+                LOG.debug("Admitted %d bytes alone, beyond the budget of %d.", size, self.max_bytes)
+
+            # The next in line may fit alongside this one.
+            self._condition.notify_all()
+
+    def release(self, size: int) -> None:
+        """Return size bytes, previously acquired, to the budget."""
+        with self._condition:
+            self.current -= size
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self, size: int, cancelled: Optional[Event] = None) -> Iterator[None]:
+        """Hold size bytes of the budget for the duration of the block, see acquire."""
+        self.acquire(size, cancelled)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def snapshot(self) -> BudgetSnapshot:
+        """Return the bytes currently admitted, the most ever admitted at once, and the limit."""
+        with self._condition:
+            return {
+                "current": self.current,
+                "peak": self.peak,
+                "limit": self.max_bytes,
+                "waiting": len(self._waiting),
+                "oversized": self.oversized,
+            }
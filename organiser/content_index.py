@@ -0,0 +1,263 @@
+"""Persistent index of the content already held in the storage directory.
+
+The index maps the hash of every file in storage_dir to where it is stored,
+so that files which are already archived can be skipped, rather than being
+copied in again alongside a numbered suffix.  It lives within storage_dir, is
+refreshed incrementally at the start of each run, and is updated as files are
+placed.  Each hash is stored along with its algorithm, and files indexed with
+another algorithm than the run's are hashed again when refreshing.
+
+When the files being organised live within storage_dir, they are left out of
+refreshes, as they have not been placed yet.  Should storage_dir lie within
+the directory being organised, the index only learns of the files placed
+into it.
+"""
+
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple, Union
+
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+# Directory within storage_dir holding the organisers own state, it is always
+# excluded from walks.
+STATE_DIR_NAME = ".organiser"
+
+INDEX_FILE_NAME = "content_index.sqlite3"
+
+# Number of writes buffered before they are committed to disk.
+COMMIT_INTERVAL = 500
+
+
+def default_index_path(storage_dir: Path) -> Path:
+    """Return the location of the content index for storage_dir."""
+    return Path(storage_dir) / STATE_DIR_NAME / INDEX_FILE_NAME
+
+
+def _within(path: Union[str, Path], directory: Union[str, Path]) -> bool:
+    """Return whether path is directory, or lies beneath it."""
+    path = os.path.abspath(path)
+    directory = os.path.abspath(directory)
+
+    return os.path.commonpath([path, directory]) == directory
+
+
+class ContentIndex:
+    """SQLite backed mapping of file hash to stored path.
+
+    Instances are safe to share between the worker threads of a pipeline, all
+    access to the underlying connection is serialised through a lock.
+    """
+
+    def __init__(
+            self,
+            index_path: Path,
+            hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+    ) -> None:
+        self.index_path = index_path
+        self.hash_algorithm = hash_algorithm
+
+        self._lock = Lock()
+        self._pending_writes = 0
+
+        # Hashes of files currently being placed, and where they are headed.
+        self._claimed: Dict[bytes, str] = {}
+
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            LOG.info("Rebuilding content index at %s.", index_path)
+            self._connection.execute("DROP TABLE IF EXISTS stored_files")
+
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stored_files (
+                path TEXT PRIMARY KEY,
+                digest BLOB NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+            """,
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS stored_files_digest ON stored_files (digest)",
+        )
+        self._connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._connection.commit()
+
+    def __enter__(self) -> "ContentIndex":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            count: int = self._connection.execute(
+                "SELECT COUNT(*) FROM stored_files",
+            ).fetchone()[0]
+
+        return count
+
+    def _add(self, path: str, digest: bytes, stat: os.stat_result) -> None:
+        """Record path as holding digest.  Callers must hold the lock."""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO stored_files (path, digest, algorithm, size, mtime_ns)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(path),
+                digest,
+                self.hash_algorithm.value,
+                stat.st_size,
+                stat.st_mtime_ns,
+            ),
+        )
+
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def _lookup(self, digest: bytes) -> Optional[str]:
+        """Return a stored path holding digest, dropping entries whose file has gone.
+
+        Callers must hold the lock.
+        """
+        rows = self._connection.execute(
+            "SELECT path FROM stored_files WHERE digest = ? AND algorithm = ?",
+            (digest, self.hash_algorithm.value),
+        ).fetchall()
+
+        for (path,) in rows:
+            if os.path.isfile(path):
+                return str(path)
+
+            LOG.debug("Dropping %s from the content index, it no longer exists.", path)
+            self._connection.execute("DELETE FROM stored_files WHERE path = ?", (path,))
+
+        return None
+
+    def lookup(self, digest: bytes) -> Optional[str]:
+        """Return where a file with the given hash is stored, if anywhere."""
+        with self._lock:
+            return self._lookup(digest)
+
+    def _indexed_stat(self, path: str) -> Optional[Tuple[int, int]]:
+        """Return the size and mtime_ns path was indexed with, if indexed with our algorithm."""
+        with self._lock:
+            row: Optional[Tuple[int, int]] = self._connection.execute(
+                "SELECT size, mtime_ns FROM stored_files WHERE path = ? AND algorithm = ?",
+                (path, self.hash_algorithm.value),
+            ).fetchone()
+
+        return row
+
+    def refresh(
+            self,
+            storage_dir: Path,
+            filename_filter: Optional[str] = None,
+            extensions: Optional[FrozenSet[str]] = None,
+            excludes: Iterable[str] = fl.DEFAULT_EXCLUDES,
+            source_dir: Optional[Path] = None,
+    ) -> int:
+        """Bring the index up to date with storage_dir, returning the number of files hashed.
+
+        Only files which are new, or whose size or modification time changed
+        since they were indexed, are read.  Entries are checked one at a time,
+        so that the index never needs to be held in memory.  Files within
+        source_dir, the directory being organised, are not indexed.
+        """
+        if source_dir is not None and _within(storage_dir, source_dir):
+            LOG.info("Not refreshing the content index, %s is being organised.", storage_dir)
+            return 0
+
+        hashed = 0
+        for target in fl.file_listing_iterator(storage_dir, filename_filter, extensions, excludes):
+            stat = fl.stat_target(target)
+            path = os.path.abspath(target.file_path)
+            if source_dir is not None and _within(path, source_dir):
+                continue
+
+            if self._indexed_stat(path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            try:
+                _, digest = fl.stream_file(
+                    target.file_path,
+                    header_size=0,
+                    algorithm=self.hash_algorithm,
+                )
+            except OSError as err:
+                LOG.warning("Unable to index %s: %s", target.file_path, err)
+                continue
+
+            with self._lock:
+                self._add(path, digest, stat)
+
+            hashed += 1
+
+        with self._lock:
+            self._connection.commit()
+            self._pending_writes = 0
+
+        LOG.info("Content index refreshed, %d files hashed.", hashed)
+
+        return hashed
+
+    def claim(self, target: FileTarget) -> Optional[str]:
+        """Reserve the content of target for placement into storage.
+
+        Returns the path already holding (or about to hold) identical content,
+        in which case target should not be placed.  Otherwise returns None, and
+        the caller must follow up with either complete or release.  Targets
+        which are themselves the stored copy are claimed like any other.
+        """
+        if target.file_hash is None:
+            raise ValueError(f"Cannot check {target.file_path} against the index without a hash.")
+
+        with self._lock:
+            existing = self._claimed.get(target.file_hash) or self._lookup(target.file_hash)
+            if existing == os.path.abspath(target.file_path):
+                existing = None
+
+            if existing is None:
+                self._claimed[target.file_hash] = target.target_move_path
+
+        return existing
+
+    def complete(self, target: FileTarget) -> None:
+        """Record target as placed at its target_move_path, following a successful claim."""
+        if target.file_hash is None:
+            return
+
+        stat = os.stat(target.target_move_path)
+        with self._lock:
+            self._claimed.pop(target.file_hash, None)
+            self._add(target.target_move_path, target.file_hash, stat)
+
+    def release(self, target: FileTarget) -> None:
+        """Give up a claim made by target, e.g. as placing it failed."""
+        if target.file_hash is None:
+            return
+
+        with self._lock:
+            self._claimed.pop(target.file_hash, None)
+
+    def close(self) -> None:
+        """Flush pending writes and close the index."""
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
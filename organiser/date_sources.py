@@ -0,0 +1,257 @@
+"""The chain of sources a run takes each file's datestamp from.
+
+Reading a file's EXIF data needs its header read from disk, but many files
+carry their date in their path already: phones name photos such as
+IMG_20190203_142501.jpg or VID-20200505-WA0001.mp4, and albums are often
+named for the date they start on.  Each run tries its configured sources in
+order, taking the first datestamp found:
+
+* filename: a date, and optionally a time, within the file's name.
+* directory: the date of the album or dated directory holding the file, as
+  identify_photo_move_path recognises it.
+* exif: the date tags of the file's EXIF data.
+* mtime: the time the file was last modified, from the walk's stat.
+
+Sources preceding exif are tried before anything is read, so files they date
+are never read unless they need hashing.  Those following it are only tried
+when the EXIF data has no date.
+
+Dates in names are only as good as whatever named the file, so a fraction of
+the files dated before reading can be sampled, and cross-checked against
+their EXIF data.  Sampled files take their EXIF date where they have one.
+"""
+
+import logging
+import os
+import re
+import zlib
+from enum import Enum
+from threading import Lock
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import typer
+
+from organiser import filename_calculations as fc
+from organiser.types import FileTarget
+
+if TYPE_CHECKING:
+    from pendulum import DateTime
+
+LOG = logging.getLogger(__name__)
+
+# A date, e.g. 20190203 or 2019-02-03, optionally followed by a time, e.g.
+# _142501 or 14.25.01, anywhere within a file name.  Digits following the
+# time, such as the milliseconds of Pixel file names, are ignored.
+FILENAME_DATE_PATTERN = re.compile(
+    r"(?<!\d)"
+    r"(?P<year>(?:19|20)\d{2})[-_.]?"
+    r"(?P<month>0[1-9]|1[0-2])[-_.]?"
+    r"(?P<day>0[1-9]|[12]\d|3[01])"
+    r"(?:"
+    r"[-_. T]?(?P<hour>[01]\d|2[0-3])[-_.:]?(?P<minute>[0-5]\d)[-_.:]?(?P<second>[0-5]\d)"
+    r"|(?!\d)"
+    r")",
+)
+
+
+class DateSource(str, Enum):
+    """The places a file's datestamp may be taken from."""
+
+    filename = "filename"
+    directory = "directory"
+    exif = "exif"
+    mtime = "mtime"
+
+
+DEFAULT_DATE_SOURCES = (DateSource.exif, DateSource.mtime)
+
+# Sources which date a file by its name alone, rather than by anything about the file itself.
+NAME_SOURCES = frozenset((DateSource.filename.value, DateSource.directory.value))
+
+
+def parse_date_sources(sources: str) -> Tuple[DateSource, ...]:
+    """Parse a comma separated list of date sources, e.g. 'filename,exif,mtime'."""
+    parsed = []
+    for source in sources.split(","):
+        try:
+            parsed.append(DateSource(source.strip().lower()))
+        except ValueError as err:
+            choices = ", ".join(choice.value for choice in DateSource)
+            raise typer.BadParameter(
+                f"Unknown date source {source.strip()!r}, choose from {choices}.",
+            ) from err
+
+    return tuple(dict.fromkeys(parsed))
+
+
+def _datestamp(
+        year: int,
+        month: int,
+        day: int,
+        hour: int = 0,
+        minute: int = 0,
+        second: int = 0,
+) -> Optional["DateTime"]:
+    """Build a UTC DateTime from its fields, if they make a valid date."""
+    import pendulum  # pylint: disable=import-outside-toplevel
+
+    try:
+        return pendulum.DateTime(  # type: ignore[no-untyped-call]
+            year,
+            month,
+            day,
+            hour,
+            minute,
+            second,
+            tzinfo=pendulum.UTC,
+        )
+    except ValueError:
+        return None
+
+
+def date_from_filename(target: FileTarget) -> Optional["DateTime"]:
+    """Return the date and time within the name of target's file, if there is one."""
+    date_match = FILENAME_DATE_PATTERN.search(os.path.basename(target.file_path))
+    if not date_match:
+        return None
+
+    year, month, day, hour, minute, second = (int(field or 0) for field in date_match.groups())
+    return _datestamp(year, month, day, hour, minute, second)
+
+
+def date_from_directory(target: FileTarget) -> Optional["DateTime"]:
+    """Return the date of the directory holding target's file, if it is dated."""
+    placement = fc.resolve_directory(os.path.dirname(target.file_path))
+    if placement.year is None or placement.month is None:
+        return None
+
+    return _datestamp(int(placement.year), int(placement.month), int(placement.day or 1))
+
+
+def date_from_mtime(target: FileTarget) -> Optional["DateTime"]:
+    """Return the time target's file was last modified, using the stat from the walk if held."""
+    import pendulum  # pylint: disable=import-outside-toplevel
+
+    if target.file_stat is not None:
+        mod_time = target.file_stat.st_mtime
+    else:
+        try:
+            mod_time = os.path.getmtime(target.file_path)
+        except OSError as err:
+            LOG.info("Unable to resolve modified time of %s: %s", target.file_path, err)
+            return None
+
+    return pendulum.from_timestamp(mod_time)
+
+
+# The sources able to date a target without reading it.
+UNREAD_SOURCES = {
+    DateSource.filename: date_from_filename,
+    DateSource.directory: date_from_directory,
+    DateSource.mtime: date_from_mtime,
+}
+
+
+def _agrees(source: DateSource, datestamp: "DateTime", exif_datestamp: "DateTime") -> bool:
+    """Check two datestamps agree, to the precision source gives dates to.
+
+    Directories are only trusted to the month, and file names to the day.
+    """
+    fields = 2 if source is DateSource.directory else 3
+    return datestamp.timetuple()[:fields] == exif_datestamp.timetuple()[:fields]
+
+
+class DateSources:
+    """A run's chain of date sources, and the results of cross-checking them against EXIF.
+
+    Safe to share between the workers of a stage.
+    """
+
+    def __init__(
+            self,
+            sources: Tuple[DateSource, ...] = DEFAULT_DATE_SOURCES,
+            verify_ratio: float = 0.0,
+    ) -> None:
+        self.sources = sources
+        self.verify_ratio = verify_ratio
+
+        exif_at = sources.index(DateSource.exif) if DateSource.exif in sources else len(sources)
+        self.before_read = sources[:exif_at]
+        self.after_read = sources[exif_at + 1:]
+        self.reads_exif = DateSource.exif in sources
+
+        self.checked = 0
+        self.disagreed = 0
+
+        self._lock = Lock()
+
+    def _try(self, target: FileTarget, sources: Tuple[DateSource, ...]) -> FileTarget:
+        """Date target from the first of sources to give a datestamp."""
+        for source in sources:
+            datestamp = UNREAD_SOURCES[source](target)
+            if datestamp is not None:
+                target.datestamp = datestamp
+                target.date_source = source.value
+                break
+
+        return target
+
+    def date_before_read(self, target: FileTarget) -> FileTarget:
+        """Date target from the sources preceding exif, if any of them can."""
+        return self._try(target, self.before_read)
+
+    def date_after_read(self, target: FileTarget) -> FileTarget:
+        """Date target from the sources following exif, if it still has no datestamp."""
+        if target.datestamp is not None:
+            return target
+
+        return self._try(target, self.after_read)
+
+    def sampled(self, target: FileTarget) -> bool:
+        """Check whether target, once dated before reading, is to be cross-checked against EXIF.
+
+        Sampling is on a hash of the path, so the same files are checked on every run.
+        """
+        if not self.verify_ratio or target.date_source not in self.before_read:
+            return False
+
+        return zlib.crc32(target.file_path.encode("utf-8", "surrogateescape")) < (
+            self.verify_ratio * 2 ** 32
+        )
+
+    def needs_exif(self, target: FileTarget) -> bool:
+        """Check whether target's EXIF data needs reading to date it, or to cross-check it."""
+        if target.datestamp is None:
+            return self.reads_exif
+
+        return self.sampled(target)
+
+    def cross_check(self, target: FileTarget, datestamp: "DateTime", source: DateSource) -> None:
+        """Compare the datestamp source gave target with its EXIF date, which target now holds.
+
+        Targets whose EXIF data had no date keep the datestamp source gave them.
+        """
+        if target.date_source != DateSource.exif or target.datestamp is None:
+            target.datestamp = datestamp
+            target.date_source = source.value
+            return
+
+        agrees = _agrees(source, datestamp, target.datestamp)
+        with self._lock:
+            self.checked += 1
+            if not agrees:
+                self.disagreed += 1
+
+        if not agrees:
+            LOG.warning(
+                "%s is dated %s by its %s, but %s by its EXIF data.",
+                target.file_path,
+                datestamp,
+                source.value,
+                target.datestamp,
+            )
+
+
+def dated_from_contents(target: FileTarget) -> bool:
+    """Check whether target's datestamp came from the file itself, rather than its name."""
+    return target.date_source not in NAME_SOURCES
@@ -0,0 +1,110 @@
+"""Parsing of EXIF datestamps into DateTimes.
+
+EXIF dates are almost always written in the fixed "YYYY:MM:DD HH:MM:SS"
+format, so they are sliced apart directly, rather than passing through a
+general purpose date parser.  Fractions of a second, and the offset from UTC,
+are held in separate SubSecTime and OffsetTime tags, which are applied when
+present.  Only values in any other format fall back to pendulum's parser.
+
+Burst shots and bulk imports repeat the same datestamps many times over, so
+results are memoised.  pendulum is only imported once a date is first parsed.
+"""
+
+import logging
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pendulum
+    from pendulum.tz.timezone import Timezone
+
+LOG = logging.getLogger(__name__)
+
+# Number of distinct datestamps whose parsed value is remembered.
+MEMO_SIZE = 4096
+
+EXIF_DATE_LENGTH = len("YYYY:MM:DD HH:MM:SS")
+
+# Every third character from the first colon, the separators of the date fields.
+EXIF_DATE_SEPARATORS = (":: ::", "::T::")
+
+
+def _split_exif_date(value: str) -> Optional[Tuple[int, int, int, int, int, int]]:
+    """Split a date in the EXIF format into its fields, or return None for any other format."""
+    if len(value) != EXIF_DATE_LENGTH or value[4::3] not in EXIF_DATE_SEPARATORS:
+        return None
+
+    try:
+        return (
+            int(value[0:4]),
+            int(value[5:7]),
+            int(value[8:10]),
+            int(value[11:13]),
+            int(value[14:16]),
+            int(value[17:19]),
+        )
+    except ValueError:
+        return None
+
+
+def _microseconds(subsec: Optional[str]) -> int:
+    """Convert a SubSecTime value, the digits following the decimal point, to microseconds."""
+    digits = (subsec or "").strip()
+    if not digits.isdigit():
+        return 0
+
+    return int(digits[:6].ljust(6, "0"))
+
+
+def _timezone(offset: Optional[str]) -> "Timezone":
+    """Convert an OffsetTime value, e.g. "+01:00", to a timezone, defaulting to UTC."""
+    import pendulum  # pylint: disable=import-outside-toplevel
+    from pendulum.tz import fixed_timezone  # pylint: disable=import-outside-toplevel
+
+    value = (offset or "").strip()
+    if len(value) != 6 or value[0] not in "+-" or value[3] != ":":
+        return pendulum.UTC
+
+    try:
+        seconds = int(value[1:3]) * 3600 + int(value[4:6]) * 60
+    except ValueError:
+        return pendulum.UTC
+
+    return fixed_timezone(-seconds if value[0] == "-" else seconds)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_exif_datestamp(
+        value: str,
+        subsec: Optional[str] = None,
+        offset: Optional[str] = None,
+) -> Optional["pendulum.DateTime"]:
+    """Parse an EXIF date, applying its SubSecTime and OffsetTime values, if provided.
+
+    Returns None if value isn't a valid date, e.g. the blank "    :  :     :  :  "
+    some cameras write when their clock was never set.
+    """
+    import pendulum  # pylint: disable=import-outside-toplevel
+
+    value = value.strip()
+    fields = _split_exif_date(value)
+
+    if fields is None:
+        try:
+            parsed = pendulum.parse(value)
+        except (pendulum.exceptions.PendulumException, ValueError):
+            LOG.debug("Unable to parse %s into a native DateTime.", value)
+            return None
+
+        return parsed if isinstance(parsed, pendulum.DateTime) else None
+
+    try:
+        # The constructor is several times faster than pendulum.datetime.
+        return pendulum.DateTime(  # type: ignore[no-untyped-call]
+            *fields,
+            microsecond=_microseconds(subsec),
+            tzinfo=_timezone(offset),
+        )
+    except ValueError:
+        LOG.debug("%s is not a valid date.", value)
+        return None
@@ -0,0 +1,148 @@
+"""Tiered duplicate detection, reading as little of each file as possible.
+
+Candidates are compared in three tiers, each only applied to files which still
+collide after the previous one:
+
+1. File size, taken from the stat gathered whilst walking the file system.
+2. A hash of the first and last PARTIAL_HASH_SIZE bytes of the file.  These
+   are never stored, so use the fastest algorithm available.
+3. A full hash of the file, with the run's algorithm, as used by
+   FileTarget.__eq__.
+
+Files with a unique size are therefore never read at all.  Files which can't
+be read (e.g. removed since they were listed) are treated as unique, and left
+for the stages after deduplication to fail on their own.
+"""
+
+import logging
+import os
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, TypeVar
+
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+PARTIAL_HASH_SIZE = 64 * 1024
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+
+
+def _collisions(
+        targets: Iterable[FileTarget],
+        key: Callable[[FileTarget], KeyType],
+) -> List[List[FileTarget]]:
+    """Group targets by key, returning only the groups with more than one member.
+
+    Targets whose key can't be read are left out of every group.
+    """
+    groups: Dict[KeyType, List[FileTarget]] = defaultdict(list)
+    for target in targets:
+        try:
+            groups[key(target)].append(target)
+        except OSError as err:
+            LOG.warning("Unable to compare %s with other files: %s", target.file_path, err)
+
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def file_size(target: FileTarget) -> int:
+    """Return the size of target, from its walk stat where available."""
+    return fl.stat_target(target).st_size
+
+
+def partial_hash(
+        target: FileTarget,
+        edge_size: int = PARTIAL_HASH_SIZE,
+        algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> bytes:
+    """Hash the first and last edge_size bytes of target.
+
+    Files no larger than twice edge_size are read in full, in which case the
+    result is also their full hash with algorithm, which is recorded on the
+    target so that it needn't be read again.  Files of the same size are
+    always hashed the same way, so the edges of larger files may be hashed
+    with the fastest algorithm available.
+    """
+    size = file_size(target)
+
+    with open(target.file_path, "rb") as file_handle:
+        if size <= 2 * edge_size:
+            digest = fl.new_hash(algorithm)
+            digest.update(file_handle.read())
+            file_hash = digest.digest()
+            target.file_hash = file_hash
+
+            return file_hash
+
+        digest = fl.new_hash(fl.fastest_hash_algorithm())
+        digest.update(file_handle.read(edge_size))
+        file_handle.seek(-edge_size, os.SEEK_END)
+        digest.update(file_handle.read(edge_size))
+
+    return digest.digest()
+
+
+def full_hash(
+        target: FileTarget,
+        algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> bytes:
+    """Return the hash of target, streaming it from disk if it isn't already known."""
+    if target.file_hash is not None:
+        return target.file_hash
+
+    _, file_hash = fl.stream_file(target.file_path, header_size=0, algorithm=algorithm)
+    target.file_hash = file_hash
+
+    return file_hash
+
+
+def find_duplicates(
+        targets: Iterable[FileTarget],
+        edge_size: int = PARTIAL_HASH_SIZE,
+        algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> List[List[FileTarget]]:
+    """Return groups of byte-identical files found amongst targets.
+
+    Any hashes targets already hold must be of algorithm.
+    """
+    duplicate_groups: List[List[FileTarget]] = []
+
+    def full(target: FileTarget) -> bytes:
+        return full_hash(target, algorithm)
+
+    def edges(target: FileTarget) -> bytes:
+        return partial_hash(target, edge_size, algorithm)
+
+    for same_size in _collisions(targets, file_size):
+        if all(target.file_hash is not None for target in same_size):
+            # Hashes are already known (e.g. from the scan cache), no need to read anything.
+            duplicate_groups.extend(_collisions(same_size, full))
+            continue
+
+        for same_edges in _collisions(same_size, edges):
+            duplicate_groups.extend(_collisions(same_edges, full))
+
+    return duplicate_groups
+
+
+def mark_duplicates(
+        targets: Iterable[FileTarget],
+        edge_size: int = PARTIAL_HASH_SIZE,
+        algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> List[FileTarget]:
+    """Set FileTarget.duplicate_of on every duplicate amongst targets.
+
+    Within each group of identical files, the first by path is treated as the
+    original, and is left unmarked.
+    """
+    targets = list(targets)
+
+    for group in find_duplicates(targets, edge_size, algorithm):
+        original, *copies = sorted(group, key=lambda target: target.file_path)
+        for copy in copies:
+            LOG.debug("%s is a duplicate of %s.", copy.file_path, original.file_path)
+            copy.duplicate_of = original.file_path
+
+    return targets
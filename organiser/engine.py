@@ -0,0 +1,265 @@
+"""Stage separated execution engine, connecting per-stage worker threads with bounded queues.
+
+Each stage pulls FileTargets from its own bounded input queue, and pushes its
+results onto the input queue of the next stage.  A full queue blocks the
+stage feeding it, so a fast producer (e.g. the file system walk) can never
+run unboundedly ahead of slower consumers (e.g. readers and movers), and the
+number of items held in memory is bounded by the sum of the queue sizes.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable, List, Optional, Sequence, Union
+
+from organiser import metrics as mt
+from organiser.budget import ByteBudget, Cancelled
+from organiser.types import FailedTarget, FileTarget
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+
+# How often blocked workers wake up to check whether the pipeline was cancelled.
+POLL_INTERVAL = 0.1
+
+# A stage may return a FailedTarget to report a failure, or None to drop the item.
+StageResult = Union[FileTarget, FailedTarget, None]
+
+
+class _Marker:
+    """Sentinel values passed along the queues alongside FileTargets."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"<{self.name}>"
+
+
+# Signals that the previous stage has finished producing items.
+_DONE = _Marker("done")
+
+# Returned from queue reads and writes once the pipeline is cancelled.
+_CANCELLED = _Marker("cancelled")
+
+QueueItem = Union[FileTarget, _Marker]
+
+
+@dataclass
+class Stage:
+    """A step of the pipeline, applying function to each item using its own worker threads."""
+
+    name: str
+    function: Callable[[FileTarget], StageResult]
+    workers: int = 1
+    queue_size: int = DEFAULT_QUEUE_SIZE
+
+
+@dataclass
+class BarrierStage:
+    """A step of the pipeline which needs every item at once, e.g. duplicate detection.
+
+    Items are collected until the previous stage finishes, then function is
+    called once, with everything it returns passed to the next stage.
+    """
+
+    name: str
+    function: Callable[[List[FileTarget]], Iterable[FileTarget]]
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    workers: int = field(init=False, default=1)
+
+
+class Pipeline:
+    """Run FileTargets through a sequence of stages.
+
+    Failures, whether raised by a stage or returned as a FailedTarget, are
+    passed to on_failure and the item goes no further.  The progress of each
+    stage is recorded in metrics as the pipeline runs, along with the usage of
+    budget, the bytes the stages reading files may hold at once, if given.
+
+    Setting cancelled, or calling cancel, stops the pipeline.  Share the
+    event with any stage function that may block, e.g. on budget, so that it
+    can give up, raising budget.Cancelled, and its item is dropped.
+    """
+
+    def __init__(
+            self,
+            stages: Sequence[Union[Stage, BarrierStage]],
+            on_failure: Callable[[FailedTarget], None],
+            output_queue_size: int = DEFAULT_QUEUE_SIZE,
+            budget: Optional[ByteBudget] = None,
+            cancelled: Optional[Event] = None,
+    ) -> None:
+        self.stages = stages
+        self.on_failure = on_failure
+
+        self.cancelled = cancelled if cancelled is not None else Event()
+        self.metrics = mt.PipelineMetrics([stage.name for stage in stages], budget)
+
+        # Queue n feeds stage n, the final queue feeds the sink.
+        queue_sizes = [stage.queue_size for stage in stages] + [output_queue_size]
+        self._queues: List["Queue[QueueItem]"] = [Queue(size) for size in queue_sizes]
+
+        self._lock = Lock()
+        self._running_workers = [stage.workers for stage in stages]
+
+    def queue_depths(self) -> List[int]:
+        """Return the number of items currently waiting on each stage, and the sink."""
+        return [queue.qsize() for queue in self._queues]
+
+    def cancel(self) -> None:
+        """Stop every stage once it finishes its current item."""
+        self.cancelled.set()
+
+    def _put(self, index: int, item: QueueItem) -> bool:
+        """Put item on queue index, blocking whilst it is full.  Returns False if cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                self._queues[index].put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+
+        return False
+
+    def _get(self, index: int) -> QueueItem:
+        """Get the next item from queue index, blocking whilst it is empty."""
+        while not self.cancelled.is_set():
+            try:
+                return self._queues[index].get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+
+        return _CANCELLED
+
+    def _finish(self, index: int) -> None:
+        """Tell the consumers of queue index that no more items will arrive."""
+        consumers = self.stages[index].workers if index < len(self.stages) else 1
+        for _ in range(consumers):
+            self._put(index, _DONE)
+
+    def _worker_finished(self, index: int) -> None:
+        """Record that a worker of stage index is done, finishing the stage with its last worker."""
+        with self._lock:
+            self._running_workers[index] -= 1
+            last_worker = not self._running_workers[index]
+
+        if last_worker:
+            LOG.debug("Stage %s finished.", self.stages[index].name)
+            self._finish(index + 1)
+
+    def _emit(self, index: int, result: StageResult) -> bool:
+        """Pass the result of stage index on.  Returns False if the pipeline was cancelled."""
+        if result is None:
+            return True
+
+        if isinstance(result, FailedTarget):
+            self.on_failure(result)
+            return True
+
+        return self._put(index + 1, result)
+
+    def _feed(self, source: Iterable[FileTarget]) -> None:
+        """Push every item of source onto the first queue."""
+        try:
+            for item in source:
+                if not self._put(0, item):
+                    return
+
+                self.metrics.walked += 1
+
+        except Exception:  # noqa: B902 pylint: disable=broad-except
+            LOG.exception("Listing files failed, cancelling.")
+            self.cancel()
+            return
+
+        self.metrics.walk_finished = True
+        self._finish(0)
+
+    def _work(self, index: int) -> None:
+        """Worker loop for stage index."""
+        stage = self.stages[index]
+        stage_metrics = self.metrics.stages[index]
+        collected: List[FileTarget] = []
+
+        while True:
+            item = self._get(index)
+            if item is _CANCELLED:
+                return
+
+            if not isinstance(item, FileTarget):
+                break
+
+            started = stage_metrics.started(item)
+
+            if isinstance(stage, BarrierStage):
+                collected.append(item)
+                continue
+
+            try:
+                result = stage.function(item)
+            except Cancelled:
+                result = None
+            except Exception as err:  # noqa: B902 pylint: disable=broad-except
+                result = FailedTarget(item, err)
+
+            stage_metrics.finished(started, result)
+            if not self._emit(index, result):
+                return
+
+        if isinstance(stage, BarrierStage):
+            started = time.perf_counter()
+            try:
+                results: List[StageResult] = list(stage.function(collected))
+            except Exception as err:  # noqa: B902 pylint: disable=broad-except
+                # A last resort, barrier functions should fail their own targets.
+                LOG.exception("Stage %s failed, failing everything it collected.", stage.name)
+                results = [FailedTarget(item, err) for item in collected]
+
+            # Anything collected but not returned was dropped.
+            for result in results + [None] * (len(collected) - len(results)):
+                stage_metrics.finished(started, result)
+
+            for result in results:
+                if not self._emit(index, result):
+                    return
+
+        self._worker_finished(index)
+
+    def run(self, source: Iterable[FileTarget], sink: Callable[[FileTarget], None]) -> None:
+        """Run every item of source through the stages, passing results to sink.
+
+        The sink is called on the calling thread.  Interrupting the run (e.g.
+        with Ctrl-C) cancels the pipeline, letting each worker finish the item
+        it is currently working on before returning.
+        """
+        threads = [Thread(target=self._feed, args=(source,), name="walk", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                Thread(target=self._work, args=(index,), name=f"{stage.name}-{worker}", daemon=True)
+                for worker in range(stage.workers)
+            )
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(len(self.stages))
+                if not isinstance(item, FileTarget):
+                    break
+
+                sink(item)
+                self.metrics.completed += 1
+
+        except BaseException:
+            LOG.warning("Pipeline interrupted, waiting for in-flight items to finish.")
+            self.cancel()
+            raise
+
+        finally:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,99 @@
+"""Execution of the CPU bound per-file analysis in thread or process pools.
+
+With the process executor, only the file path is sent to the worker, and only
+the compact FileAnalysis result is sent back, FileTargets and file contents
+never cross the process boundary.
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional
+
+from organiser import file_listing as fl
+from organiser import image_metadata as im
+from organiser.types import FileTarget
+
+if TYPE_CHECKING:
+    from pendulum import DateTime
+
+LOG = logging.getLogger(__name__)
+
+
+class ExecutorKind(str, Enum):
+    """The kinds of worker pool available to run file analysis in."""
+
+    thread = "thread"
+    process = "process"
+
+
+class FileAnalysis(NamedTuple):
+    """The results of analysing a single file, as returned from a worker."""
+
+    file_hash: Optional[bytes]
+    date_tags: Dict[str, str]
+    datestamp: Optional["DateTime"]
+    date_source: Optional[str] = None
+
+
+def make_executor(kind: ExecutorKind, workers: Optional[int] = None) -> Executor:
+    """Return an executor of the requested kind.
+
+    Leaving workers unset uses the executors default, which scales with the
+    number of CPUs available.
+    """
+    if kind is ExecutorKind.process:
+        # Spawn rather than fork, the parent already has pipeline threads running.
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    return ThreadPoolExecutor(workers, thread_name_prefix="organiser-analysis")
+
+
+def analyse_file(
+        file_path: str,
+        hash_file: bool,
+        header_size: int,
+        file_stat: Optional[os.stat_result] = None,
+        identify_date: bool = True,
+        fallback_to_mtime: bool = True,
+        hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> FileAnalysis:
+    """Read, hash and parse the metadata of file_path.
+
+    This runs within the worker pool, so must only take and return values
+    which are cheap to pickle.  Passing the stat from the walk saves the
+    worker from needing to stat the file again.  Files already dated by
+    other means only need hashing, so leave identify_date unset for them.
+    """
+    target = FileTarget(file_path, file_stat=file_stat)
+
+    if hash_file:
+        target = fl.load_file_contents(target, header_size, algorithm=hash_algorithm)
+    elif identify_date:
+        target = fl.load_file_header(target, header_size)
+
+    if identify_date:
+        target = im.identify_image_datestamp(
+            im.parse_image_meta_for_file_target(target),
+            fallback_to_mtime,
+        )
+
+    return FileAnalysis(target.file_hash, target.date_tags, target.datestamp, target.date_source)
+
+
+def apply_analysis(target: FileTarget, analysis: FileAnalysis) -> FileTarget:
+    """Update target with the results of analyse_file."""
+    if analysis.file_hash is not None:
+        target.file_hash = analysis.file_hash
+
+    if analysis.date_tags:
+        target.date_tags = analysis.date_tags
+
+    # Leave any datestamp target already held, if the file didn't give one.
+    if analysis.datestamp is not None:
+        target.datestamp = analysis.datestamp
+        target.date_source = analysis.date_source
+
+    return target
@@ -1,62 +1,269 @@
 """Module responsible for functions that iterate through the file system."""
 
 import base64
+import fnmatch
+import hashlib
+import importlib.util
 import logging
 import os
 import re
+from enum import Enum
+from functools import lru_cache
 from os.path import relpath
 from pathlib import Path
-from typing import Iterable, Optional
-
-import rx
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from rx import operators
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Protocol,
+    Tuple,
+    Union,
+)
 
 from organiser.types import FileTarget
 
+if TYPE_CHECKING:
+    from rx import Observable
+
 LOG = logging.getLogger(__file__)
 
+# Size of the reads used when streaming files from disk for hashing.
+CHUNK_SIZE = 1024 * 1024
+
+# Number of leading bytes retained in memory for metadata parsing, EXIF data
+# lives in the first APP1 segment of a JPEG which is capped at 64KB.
+HEADER_SIZE = 128 * 1024
+
+# Directory names which never contain photos worth organising, such as NAS
+# thumbnail caches, version control metadata and the organisers own state.
+DEFAULT_EXCLUDES = ("@eaDir", ".thumbnails", ".git", ".organiser")
+
+
+class HashAlgorithm(str, Enum):
+    """Algorithms files may be hashed with.
+
+    sha256 and blake2b come from hashlib, which releases the GIL whilst hashing
+    each chunk, so every worker hashes in parallel.  xxh3 isn't cryptographic,
+    but is several times faster again, and needs the optional xxhash package.
+    Digests of different algorithms are never compared, so the algorithm is
+    recorded alongside every digest stored.
+    """
+
+    sha256 = "sha256"
+    blake2b = "blake2b"
+    xxh3 = "xxh3"
+
+
+DEFAULT_HASH_ALGORITHM = HashAlgorithm.sha256
+
+
+class Hash(Protocol):
+    """The incremental interface shared by hashlib and xxhash objects."""
+
+    def update(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        """Feed data to the hash."""
+
+    def digest(self) -> bytes:
+        """Return the digest of the data fed so far."""
+
+
+@lru_cache(maxsize=None)
+def hash_algorithm_available(algorithm: HashAlgorithm) -> bool:
+    """Check whether the package providing algorithm is installed."""
+    if algorithm is HashAlgorithm.xxh3:
+        return importlib.util.find_spec("xxhash") is not None
+
+    return True
+
+
+def fastest_hash_algorithm() -> HashAlgorithm:
+    """Return the fastest algorithm available, for digests which are never stored.
+
+    hashlib's SHA256 uses the SHA extensions of recent CPUs, which makes it
+    faster than BLAKE2b wherever they are present.
+    """
+    if hash_algorithm_available(HashAlgorithm.xxh3):
+        return HashAlgorithm.xxh3
+
+    return HashAlgorithm.sha256
+
+
+def new_hash(algorithm: HashAlgorithm = DEFAULT_HASH_ALGORITHM) -> Hash:
+    """Return a new, empty, hash of algorithm."""
+    if algorithm is HashAlgorithm.xxh3:
+        # Optional, and only needed once hashing starts.
+        import xxhash  # pylint: disable=import-outside-toplevel
+
+        return xxhash.xxh3_128()
+
+    if algorithm is HashAlgorithm.blake2b:
+        return hashlib.blake2b(digest_size=32)
+
+    return hashlib.sha256()
+
+
+def compile_filename_filter(filename_filter: Optional[str]) -> Optional[Pattern[str]]:
+    """Compile filename_filter once, for use across a whole walk.
+
+    An invalid filter is logged, and results in a pattern which matches nothing.
+    """
+    if not filename_filter:
+        return None
+
+    try:
+        return re.compile(filename_filter)
+
+    except re.error as err:
+        LOG.warning("Invalid file filter provided: %s. Error: %s", filename_filter, err)
+        return re.compile(r"(?!)")
+
+
+def compile_excludes(excludes: Iterable[str]) -> Optional[Pattern[str]]:
+    """Combine glob patterns for directory names into a single compiled pattern."""
+    patterns = [fnmatch.translate(exclude) for exclude in excludes]
+    if not patterns:
+        return None
+
+    return re.compile("|".join(patterns))
+
+
+def parse_extensions(extensions: Optional[str]) -> Optional[FrozenSet[str]]:
+    """Parse a comma separated list of file extensions, e.g. 'jpg,.JPEG,heic'."""
+    if not extensions:
+        return None
+
+    return frozenset(
+        extension.strip().lstrip(".").lower()
+        for extension in extensions.split(",")
+        if extension.strip()
+    )
+
+
+def matches_file_name(
+        name: str,
+        name_pattern: Optional[Pattern[str]],
+        extensions: Optional[FrozenSet[str]],
+) -> bool:
+    """Check a file name against compiled filters, the extensions being checked first."""
+    if extensions is not None:
+        _, dot, extension = name.rpartition(".")
+        if not dot or extension.lower() not in extensions:
+            return False
+
+    return not name_pattern or bool(name_pattern.search(name))
+
+
+def list_directory(
+        directory: str,
+        name_pattern: Optional[Pattern[str]] = None,
+        extensions: Optional[FrozenSet[str]] = None,
+        exclude_pattern: Optional[Pattern[str]] = None,
+) -> Tuple[List[str], List[Tuple[str, os.stat_result]]]:
+    """List a single directory with os.scandir, applying compiled filters.
+
+    Returns the paths of the subdirectories which aren't excluded, and the
+    paths and stats of the files which match.  Raises OSError if directory
+    can't be listed.
+    """
+    sub_dirs: List[str] = []
+    files: List[Tuple[str, os.stat_result]] = []
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if exclude_pattern and exclude_pattern.match(entry.name):
+                    LOG.debug("Skipping excluded directory %s", entry.path)
+                    continue
+
+                sub_dirs.append(entry.path)
+                continue
+
+            if not entry.is_file():
+                continue
+
+            if not matches_file_name(entry.name, name_pattern, extensions):
+                continue
+
+            files.append((entry.path, entry.stat()))
+
+    return sub_dirs, files
+
 
 def file_listing_iterator(
-        base_dir: Optional[Path] = None,
+        base_dir: Optional[Union[str, Path]] = None,
         filename_filter: Optional[str] = None,
+        extensions: Optional[FrozenSet[str]] = None,
+        excludes: Iterable[str] = DEFAULT_EXCLUDES,
 ) -> Iterable[FileTarget]:
-    """Yield FileTargets for files in the provided bsae directory, matching filename_filter."""
+    """Yield FileTargets for files in the provided base directory, matching filename_filter.
+
+    The tree is walked with os.scandir, and each FileTarget carries the stat
+    gathered during the walk, so later stages never need to stat it again.
+
+    Args:
+        base_dir: The directory to walk, defaults to the directory of this module.
+
+        filename_filter: Regular expression file names must match.
+
+        extensions: Lower case file extensions (without the dot) file names
+            must end with.  This is cheaper than filename_filter, and checked
+            first.
+
+        excludes: Glob patterns of directory names to skip, along with
+            everything beneath them.
+    """
     if base_dir is None:
         base_dir = Path(os.path.dirname(__file__))
 
-    for directory, _, filenames in os.walk(relpath(base_dir.absolute(), os.path.curdir)):
-        for filename in filenames:
-            if filename_filter:
-                try:
-                    matches_filter = re.search(filename_filter, filename)
-                    if matches_filter:
-                        target = FileTarget(os.path.join(directory, filename))
-                        yield target
-
-                except re.error as err:
-                    LOG.warning(
-                        "Invalid file filter provided: %s. Error: %s",
-                        filename_filter,
-                        err,
-                    )
-                    continue
+    name_pattern = compile_filename_filter(filename_filter)
+    exclude_pattern = compile_excludes(excludes)
+
+    pending_dirs = [relpath(os.path.abspath(base_dir), os.path.curdir)]
+    while pending_dirs:
+        directory = pending_dirs.pop()
 
-            else:
-                yield FileTarget(os.path.join(directory, filename))
+        try:
+            sub_dirs, files = list_directory(directory, name_pattern, extensions, exclude_pattern)
+        except OSError as err:
+            LOG.warning("Unable to list %s: %s", directory, err)
+            continue
 
+        # Directory handles are closed before yielding, as consumers may be slow.
+        for file_path, file_stat in files:
+            yield FileTarget(file_path, file_stat=file_stat)
 
-def observable_file_list(base_dir: Optional[str] = None, filter_: str = "") -> rx.Observable:
+        pending_dirs.extend(reversed(sub_dirs))
+
+
+def observable_file_list(base_dir: Optional[str] = None, filter_: str = "") -> "Observable":
     """Return an Observable from file listing, whilst handling directory and filter arguments."""
+    import rx  # pylint: disable=import-outside-toplevel
+
     return rx.from_iterable(file_listing_iterator(base_dir, filter_))
 
 
+def stat_target(file_target: FileTarget) -> os.stat_result:
+    """Return the stat for FileTarget, populating FileTarget.file_stat if it is not yet known."""
+    if file_target.file_stat is None:
+        file_target.file_stat = os.stat(file_target.file_path)
+
+    return file_target.file_stat
+
+
 def sha256_file(file_target: FileTarget) -> FileTarget:
-    """Return the SHA256 hash of the provided FileTarget."""
-    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-    digest.update(file_target.file_contents)
-    file_target.file_hash = digest.finalize()
+    """Return the SHA256 hash of the provided FileTarget.
+
+    Targets already hashed whilst being streamed from disk are returned
+    unchanged, otherwise the in-memory file_contents are hashed.
+    """
+    if file_target.from_cache or file_target.file_hash is not None:
+        return file_target
+
+    file_target.file_hash = hashlib.sha256(file_target.file_contents or b"").digest()
 
     return file_target
 
@@ -68,33 +275,134 @@ def b64_encode(byte_string: bytes) -> str:
     return b64_bytes.decode("utf-8")
 
 
-def encode_shasum(target: FileTarget) -> FileTarget:
-    """Store sha256 hash as b64 encodedstring."""
-    if target.file_hash:
-        target.encoded_hash = b64_encode(target.file_hash)
+def stream_file(
+        file_path: str,
+        header_size: int = HEADER_SIZE,
+        chunk_size: int = CHUNK_SIZE,
+        algorithm: HashAlgorithm = DEFAULT_HASH_ALGORITHM,
+) -> Tuple[bytes, bytes]:
+    """Read file_path once in chunk_size pieces, returning its leading bytes and digest.
+
+    Only the leading header_size bytes are kept in memory, so memory use is
+    bounded by the chunk size rather than the size of the file.
+    """
+    digest = new_hash(algorithm)
+    header = bytearray()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    try:
+        with open(file_path, "rb", buffering=0) as file_handle:
+            while True:
+                read_count = file_handle.readinto(buffer)
+                if not read_count:
+                    break
+
+                digest.update(view[:read_count])
+                if len(header) < header_size:
+                    header += view[:min(read_count, header_size - len(header))]
+
+    finally:
+        view.release()
+
+    return bytes(header), digest.digest()
+
 
-    return target
+def load_file_contents(
+        file_target: FileTarget,
+        header_size: int = HEADER_SIZE,
+        chunk_size: int = CHUNK_SIZE,
+        algorithm: HashAlgorithm = DEFAULT_HASH_ALGORITHM,
+) -> FileTarget:
+    """Stream the contents of FileTarget from disk, hashing it and retaining only its header.
 
+    The file is read exactly once, each chunk being fed to the digest of
+    algorithm.  Only the leading header_size bytes are kept on
+    FileTarget.file_contents for metadata parsing.
+    """
+    if file_target.from_cache:
+        LOG.debug("Skipping read of %s, scan results are cached.", file_target.file_path)
+        return file_target
 
-def load_file_contents(file_target: FileTarget) -> FileTarget:
-    """Reads the contents of FileTarget and returns updated FileTarget containing the files data."""
     try:
-        with open(file_target.file_path, "rb") as file_handle:
-            file_target.file_contents = file_handle.read()
-            return file_target
+        file_target.file_contents, file_target.file_hash = stream_file(
+            file_target.file_path,
+            header_size,
+            chunk_size,
+            algorithm,
+        )
 
     except OSError as err:
         LOG.warning("Failed to read content from %s", file_target.file_path)
         raise err
 
+    return file_target
+
+
+def _exif_region_size(file_handle: BinaryIO, budget: int) -> int:
+    """Return how many leading bytes of an open file hold its EXIF data, capped at budget.
+
+    For JPEG files the application segments are walked, and the region ends
+    with the APP1 Exif segment.  Other formats (TIFF based RAW files, HEIC etc.)
+    may store their IFDs anywhere, so the whole budget is used for those.
+    """
+    if file_handle.read(2) != b"\xff\xd8":
+        return budget
+
+    offset = 2
+    while offset + 4 <= budget:
+        file_handle.seek(offset)
+        segment = file_handle.read(10)
+        if len(segment) < 4 or segment[0] != 0xFF:
+            break
+
+        marker = segment[1]
+        segment_end = offset + 2 + int.from_bytes(segment[2:4], "big")
+
+        if marker == 0xE1 and segment[4:10] == b"Exif\x00\x00":
+            return min(segment_end, budget)
+
+        if not 0xE0 <= marker <= 0xEF:
+            # Past the application segments, this file has no EXIF data.
+            break
+
+        offset = segment_end
+
+    return min(offset, budget)
+
+
+def load_file_header(file_target: FileTarget, header_size: int = HEADER_SIZE) -> FileTarget:
+    """Read only the leading metadata region of FileTarget, without hashing it.
+
+    This is used when the file hash isn't needed (e.g. dry runs), so that each
+    file costs a single small read of at most header_size bytes.
+    """
+    if file_target.from_cache:
+        LOG.debug("Skipping read of %s, scan results are cached.", file_target.file_path)
+        return file_target
+
+    try:
+        with open(file_target.file_path, "rb") as file_handle:
+            region_size = _exif_region_size(file_handle, header_size)
+            file_handle.seek(0)
+            file_target.file_contents = file_handle.read(region_size)
+
+    except OSError as err:
+        LOG.warning("Failed to read header from %s", file_target.file_path)
+        raise err
+
+    return file_target
+
 
 if __name__ == "__main__":
+    import rx
+    from rx import operators
+
     file_listing = rx.from_iterable(file_listing_iterator())
 
     hashed_files = file_listing.pipe(
         operators.map(load_file_contents),
         operators.map(sha256_file),
-        operators.map(encode_shasum),
         operators.map(lambda target: target.clear_contents_data()),
         #  operators.map(lambda file_path, file_hash: (file_path, b64_encode(file_hash))),
     )
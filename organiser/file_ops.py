@@ -1,55 +1,101 @@
 """Contains methods used to move/copy a FileTarget from its old to new location."""
 
+import errno
 import logging
-import os.path
+import os
 import pathlib
 import re
 import shutil
-from typing import Union
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import typer
 
-from organiser.types import FailedTarget, FileTarget
+from organiser import transfer
+from organiser.types import FileTarget
 
 LOG = logging.getLogger(__name__)
 
 
-def _check_existing_target_file(target: FileTarget) -> FileTarget:
-    """Checks for the existence of a target_move_path, increments target_move_path if so."""
-    existing_file_check_regex = (
-        r"(?P<base>^.*/)?(?P<file_name>[\w\d.]+)(?:\((?P<rep>\d+)\))?\.(?P<ext>.+)$"
-    )
+# Splits a file name into its stem, any "(n)" suffix added to avoid a name
+# collision, and its extension.  e.g. "IMG_0001(2).JPG" -> IMG_0001, 2, JPG.
+NAME_SUFFIX_REGEX = re.compile(r"^(?P<stem>.+?)(?:\((?P<rep>\d+)\))?\.(?P<ext>[^.]+)$")
 
-    if target.file_path == target.target_move_path:
-        LOG.debug("Target file appears to already be in the correct place.")
-        return target
 
-    if os.path.isfile(target.target_move_path):
-        current_file_match = re.search(existing_file_check_regex, target.target_move_path)
-        if not current_file_match:
-            raise ValueError("Failed to match on move target. Something bad happened!")
+def _split_name(file_name: str) -> Tuple[str, str, int]:
+    """Split file_name into its stem, extension and collision suffix (0 if it has none)."""
+    match = NAME_SUFFIX_REGEX.match(file_name)
+    if not match:
+        return file_name, "", 0
 
-        match_groups = current_file_match.groupdict()
+    rep = match.group("rep")
+    return match.group("stem"), match.group("ext"), int(rep) if rep else 0
 
-        rep = match_groups.get("rep")
-        rep_count = int(rep) if rep else 0
 
-        new_file_name = (
-            "{f_name}({rep}).{ext}".format(
-                f_name=match_groups.get('file_name'),
-                rep=str(rep_count + 1),  # This is to ensure we always increment.
-                ext=match_groups.get('ext'),
-            )
-        )
-        target.target_move_path = os.path.join(
-            match_groups.get('base', ''),
-            new_file_name,
-        )
+class NamePlanner:
+    """Assigns unique names to files placed into destination directories.
 
-        # Check that the updated target doesn't also exist
-        return _check_existing_target_file(target)
+    Each destination directory is listed once, the first time a file is
+    placed into it.  From then on, the names taken within it and the highest
+    "(n)" suffix used for each stem are tracked in memory, so that finding a
+    free name costs O(1) rather than a stat per candidate.  All access is
+    serialised through a lock, so that concurrent movers never pick the same
+    name.
 
-    return target
+    Unset list_existing to plan names against each other alone, without
+    looking at what is already on disk, e.g. when merging plans on a host
+    without the storage directory mounted.
+    """
+
+    def __init__(self, list_existing: bool = True) -> None:
+        self.list_existing = list_existing
+
+        self._lock = Lock()
+        self._taken: Dict[str, Set[str]] = {}
+        self._highest_suffix: Dict[str, Dict[Tuple[str, str], int]] = {}
+
+    def _take(self, directory: str, file_name: str) -> None:
+        """Record file_name as taken within directory.  Callers must hold the lock."""
+        self._taken[directory].add(file_name)
+
+        stem, ext, rep = _split_name(file_name)
+        suffixes = self._highest_suffix[directory]
+        suffixes[(stem, ext)] = max(rep, suffixes.get((stem, ext), 0))
+
+    def _load(self, directory: str) -> None:
+        """List directory the first time it is used.  Callers must hold the lock."""
+        if directory in self._taken:
+            return
+
+        self._taken[directory] = set()
+        self._highest_suffix[directory] = {}
+
+        if not self.list_existing:
+            return
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    self._take(directory, entry.name)
+
+        except FileNotFoundError:
+            LOG.debug("%s doesn't exist yet, all names within it are free.", directory)
+
+    def reserve(self, target_move_path: str) -> str:
+        """Return a path based on target_move_path which no other file has, or been given."""
+        directory, file_name = os.path.split(os.path.abspath(target_move_path))
+
+        with self._lock:
+            self._load(directory)
+
+            if file_name in self._taken[directory]:
+                stem, ext, _ = _split_name(file_name)
+                rep = self._highest_suffix[directory].get((stem, ext), 0) + 1
+                file_name = f"{stem}({rep}).{ext}" if ext else f"{stem}({rep})"
+
+            self._take(directory, file_name)
+
+        return os.path.join(os.path.dirname(target_move_path), file_name)
 
 
 def _ensure_target_directory(target_move_path: str) -> None:
@@ -59,45 +105,172 @@ def _ensure_target_directory(target_move_path: str) -> None:
         target_dir.mkdir(parents=True, exist_ok=True)
 
 
-def migrate_file_target(target: FileTarget, copy: bool = False) -> FileTarget:
-    """Apply a move, or copy of the FileTarget from source to new destination."""
-    _ensure_target_directory(target.target_move_path)
-    target = _check_existing_target_file(target)
+def _create_exclusive(
+        target: FileTarget,
+        planner: NamePlanner,
+        on_planned: Optional[Callable[[FileTarget], None]] = None,
+) -> int:
+    """Reserve a unique target_move_path, creating it on disk with O_EXCL.
+
+    Returns an open file descriptor for the newly created, empty, file.  Should
+    the reserved name have been created by something outside of this process
+    in the meantime, the next free name is reserved instead, so an existing
+    file is never overwritten.  on_planned is called once the file is created,
+    so that only files created here are ever recorded as being placed.
+    """
+    while True:
+        target.target_move_path = planner.reserve(target.target_move_path)
+
+        try:
+            file_descriptor = os.open(
+                target.target_move_path,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                0o644,
+            )
+
+        except FileExistsError:
+            LOG.debug(
+                "%s appeared whilst placing a file, trying the next name.",
+                target.target_move_path,
+            )
+            continue
+
+        if on_planned is not None:
+            try:
+                on_planned(target)
+            except BaseException:
+                os.close(file_descriptor)
+                os.unlink(target.target_move_path)
+                raise
+
+        return file_descriptor
+
 
-    if target.file_path == target.target_move_path:
+def migrate_file_target(
+        target: FileTarget,
+        copy: bool = False,
+        planner: Optional[NamePlanner] = None,
+        on_planned: Optional[Callable[[FileTarget], None]] = None,
+) -> FileTarget:
+    """Apply a move, or copy of the FileTarget from source to new destination.
+
+    Share a NamePlanner between calls (and threads) for the same run, so that
+    each destination directory is only listed once.  Should a file already
+    exist at target_move_path, a "(n)" suffix is added to the file name.
+
+    The primitive used to place the file is recorded as transfer_method, see
+    organiser.transfer.  on_planned is called once the destination is created,
+    but before anything is written into it, e.g. to journal the operation.
+    """
+    if planner is None:
+        planner = NamePlanner()
+
+    if os.path.abspath(target.file_path) == os.path.abspath(target.target_move_path):
+        LOG.debug("Target file appears to already be in the correct place.")
         typer.secho("File already correctly located.", fg=typer.colors.BLUE, err=True)
         return target
 
-    if copy:
-        shutil.copy(target.file_path, target.target_move_path)
+    _ensure_target_directory(target.target_move_path)
+    file_descriptor = _create_exclusive(target, planner, on_planned)
+
+    try:
+        if copy:
+            method = transfer.copy_into(target.file_path, file_descriptor)
+            shutil.copymode(target.file_path, target.target_move_path)
+
+        else:
+            # Atomically replaces the placeholder we created, which nobody else can take.
+            method = transfer.move_into(target.file_path, target.target_move_path, file_descriptor)
 
-    else:
-        shutil.move(target.file_path, target.target_move_path)
+    except OSError:
+        # The source is still in place, don't leave a placeholder or partial copy behind.
+        os.unlink(target.target_move_path)
+        raise
 
+    finally:
+        os.close(file_descriptor)
+
+    target.transfer_method = method.value
     target.operation_complete = True
 
     return target
 
 
-def clear_empty_directories(item: FileTarget) -> Union[FileTarget, FailedTarget]:
-    """Recurse up the directory tree, remove any empty directories we find."""
-    location = (pathlib.Path(item.file_path).resolve() / "..").absolute().resolve()
+class VacatedDirectories:
+    """Collects the directories files were moved out of, to remove any left empty.
 
-    while location.absolute() != pathlib.Path("/"):
-        try:
-            location.rmdir()
-            typer.secho(f"Removed {location} as it was empty.", fg=typer.colors.BLUE)
-        except OSError as err:
-            if err.errno == 39:  # Directory not empty error.
-                # Found a directory with stuff in it...
-                LOG.info(
-                    "Not deleting %s as it wasn't empty: %s.",
-                    location,
-                    os.listdir(location),
-                )
-                return item
-
-        location = (location / "..").resolve().absolute()
-
-    # Somehow found the top of the tree..?
-    return item
+    Movers record the source directory of each file they move, and once the
+    run is over, sweep removes those left empty, along with any of their
+    ancestors that become empty as a result.  Nothing at or above root is ever
+    removed.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path]) -> None:
+        self.root = os.path.abspath(root)
+        self._lock = Lock()
+        self._directories: Set[str] = set()
+
+    def record(self, target: FileTarget) -> FileTarget:
+        """Note the directory target was moved out of."""
+        directory = os.path.dirname(os.path.abspath(target.file_path))
+
+        with self._lock:
+            self._directories.add(directory)
+
+        return target
+
+    def _candidates(self) -> Set[str]:
+        """Return the recorded directories and their ancestors, below root."""
+        candidates: Set[str] = set()
+
+        with self._lock:
+            directories = list(self._directories)
+
+        for directory in directories:
+            while directory not in candidates:
+                if os.path.commonpath((directory, self.root)) != self.root:
+                    break
+                if directory == self.root:
+                    break
+
+                candidates.add(directory)
+                directory = os.path.dirname(directory)
+
+        return candidates
+
+    def sweep(self) -> List[str]:
+        """Remove every empty directory found, deepest first, returning those removed.
+
+        Each directory is tried at most once, and a directory is skipped
+        outright when one of its subdirectories could not be removed.
+        """
+        removed: List[str] = []
+        occupied: Set[str] = set()
+
+        candidates = self._candidates()
+        deepest_first = sorted(candidates, key=lambda path: path.count(os.sep), reverse=True)
+        for directory in deepest_first:
+            parent = os.path.dirname(directory)
+            if directory in occupied:
+                occupied.add(parent)
+                continue
+
+            try:
+                os.rmdir(directory)
+
+            except FileNotFoundError:
+                continue
+
+            except OSError as err:
+                occupied.add(parent)
+                if err.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    LOG.warning("Unable to remove %s: %s", directory, err)
+                continue
+
+            typer.secho(f"Removed {directory} as it was empty.", fg=typer.colors.BLUE)
+            removed.append(directory)
+
+        with self._lock:
+            self._directories.clear()
+
+        return removed
@@ -1,11 +1,64 @@
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional
-
-import pendulum
+from typing import NamedTuple, Optional
 
 from organiser.types import FileTarget
 
+# Number of distinct source, and storage, directories whose resolution is remembered.
+DIRECTORY_MEMO_SIZE = 4096
+
+# A date within a directory path, followed by the name of an album, if any.
+ALBUM_PATTERN = re.compile(
+    r"(?P<year>\d{4})"
+    r"[._-]"
+    r"(?P<month>\d{1,2})"
+    r"(?:[.-_](?P<day>\d{1,2}))"
+    r"?\s*(?P<album>.*)$",
+)
+
+
+class DirectoryPlacement(NamedTuple):
+    """Where files from one source directory are stored, as far as the directory determines it.
+
+    year and month are set when the directory path contains a date, along with
+    day if the date has one, and album when that date is followed by any
+    other text.
+    """
+
+    year: Optional[str] = None
+    month: Optional[str] = None
+    album: Optional[str] = None
+    day: Optional[str] = None
+
+
+@lru_cache(maxsize=DIRECTORY_MEMO_SIZE)
+def resolve_directory(directory: str) -> DirectoryPlacement:
+    """Identify the year, month, album and day files within directory belong to.
+
+    Every file in a directory resolves the same way, so results are memoised
+    on the directory, and only each file's datestamp is left to consider per
+    file.
+    """
+    album_match = ALBUM_PATTERN.search(str(Path(directory)))
+    if not album_match:
+        return DirectoryPlacement()
+
+    return DirectoryPlacement(
+        album_match.group("year"),
+        album_match.group("month"),
+        album_match.group("album") or None,
+        album_match.group("day"),
+    )
+
+
+@lru_cache(maxsize=DIRECTORY_MEMO_SIZE)
+def _storage_root(output_dir: str) -> str:
+    """Normalise output_dir as Path would, with the current directory becoming a bare prefix."""
+    root = str(Path(output_dir))
+    return "" if root == "." else root
+
 
 def identify_photo_move_path(
         output_dir: str,
@@ -31,6 +84,8 @@ def identify_photo_move_path(
       return an output_dir of /output_dir/2019/01/2019.01.02 something
       interesting/ .
 
+    The directory is resolved by resolve_directory, once per source directory.
+
     Args:
         output_dir: The absolute path to the base directory to which we
             should be storing processed files.
@@ -40,47 +95,32 @@ def identify_photo_move_path(
     Returns: Updated FileTarget containing a target_file_path attribute
         provided the calculated value here.
     """
-    if not file_target.datestamp:
+    working_file_datestamp = file_target.datestamp
+    if not working_file_datestamp:
         raise ValueError(
             f"Cannot determine appropriate storage location for {file_target.file_path}"
             f" without a datestamp.",
         )
 
-    working_file_path = Path(file_target.file_path)
-
-    working_file_datestamp = file_target.datestamp
-
-    album_match_regex = (
-        r"(?P<year>\d{4})"
-        r"[._-]"
-        r"(?P<month>\d{1,2})"
-        r"(?:[.-_](?P<day>\d{1,2}))"
-        r"?\s*(?P<album>.*)/.+$"
-    )
-    album_match = re.search(album_match_regex, str(working_file_path))
-
-    regex_results: Optional[Dict[str, str]] = None
-    if album_match and album_match.groups():
-        regex_results = album_match.groupdict()
+    directory, final_file_name = os.path.split(file_target.file_path)
+    placement = resolve_directory(directory)
 
     # Year & Month file prefix.
-    if regex_results and all((regex_results.get("year"), regex_results.get("month"))):
-        target_path = Path(output_dir) / regex_results["year"] / regex_results["month"]
-    else:
-        target_path = Path(output_dir) / working_file_datestamp.format(
-            "YYYY",
-        ) / working_file_datestamp.format("MM")
+    year = placement.year or f"{working_file_datestamp.year:04d}"
+    month = placement.month or f"{working_file_datestamp.month:02d}"
+    target_path = os.path.join(_storage_root(output_dir), year, month)
 
     # Handle Album name, if we have one
-    if regex_results and regex_results.get("album"):
-        target_path = (
-            target_path / f"{working_file_datestamp.format('YYYY.MM')} {regex_results['album']}"
+    if placement.album:
+        album_dir = (
+            f"{working_file_datestamp.year:04d}.{working_file_datestamp.month:02d}"
+            f" {placement.album}"
         )
+        target_path = os.path.join(target_path, album_dir)
 
     #  final_file_name = f"{working_file_datestamp.format('YYYY.MM.DD')}_{working_file_path.name}"
     #  final_file_name = final_file_name.replace("__", "_")
-    final_file_name = working_file_path.name
 
-    file_target.target_move_path = str(target_path / final_file_name)
+    file_target.target_move_path = os.path.join(target_path, final_file_name)
 
     return file_target
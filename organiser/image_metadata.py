@@ -1,23 +1,67 @@
 """Module collecting functions related to image metadata."""
 
-import exifread
-from typing import Dict, List
 import io
 import logging
-import pendulum
-from os.path import getmtime
+import struct
+from typing import TYPE_CHECKING, Dict, List
 
+from organiser import date_sources as dsrc
+from organiser import datestamps as ds
 from organiser.types import FileTarget
+from organiser.types.file_target import DATE_TAGS, NO_TAGS
 
+# exifread and pendulum are imported where used, only runs which read files need them.
+if TYPE_CHECKING:
+    from exifread.classes import IfdTag
+    from pendulum import DateTime
 
 LOG = logging.getLogger(__name__)
 
+KNOWN_DATE_FIELDS = DATE_TAGS
+
+# The tags holding the fractions of a second, and offset from UTC, of each date field.
+DATE_DETAIL_FIELDS = {
+    "EXIF DateTimeDigitized": ("EXIF SubSecTimeDigitized", "EXIF OffsetTimeDigitized"),
+    "EXIF DateTimeOriginal": ("EXIF SubSecTimeOriginal", "EXIF OffsetTimeOriginal"),
+    "Image DateTime": ("EXIF SubSecTime", "EXIF OffsetTime"),
+}
+
+# Every tag the pipeline uses, only these are retained on FileTargets.
+USED_FIELDS = frozenset(
+    KNOWN_DATE_FIELDS + tuple(field for fields in DATE_DETAIL_FIELDS.values() for field in fields),
+)
+
+# Name of the last EXIF tag we need.  The SubSecTime tags follow the OffsetTime
+# tags, which follow DateTimeOriginal and DateTimeDigitized, in the EXIF IFD,
+# and Image DateTime lives in IFD0 which is always read first.
+DATE_STOP_TAG = "SubSecTimeDigitized"
+
+
+def get_file_meta(
+        file_content: bytes,
+        stop_tag: str = DATE_STOP_TAG,
+        details: bool = False,
+) -> Dict[str, "IfdTag"]:
+    """Retrieve metadata for the provided file data.
+
+    By default, parsing of the EXIF IFD stops once the date tags have been
+    read, and maker notes and thumbnails are skipped entirely.  The provided
+    data may be a truncated header of the file, tags beyond its end are lost.
+    """
+    import exifread  # pylint: disable=import-outside-toplevel
 
-def get_file_meta(file_content: bytes) -> Dict[str, exifread.classes.IfdTag]:
-    """Retrieve metadata for the provided file data."""
     file_stream = io.BytesIO(file_content)
 
-    file_exif_data = exifread.process_file(file_stream)
+    try:
+        file_exif_data = exifread.process_file(
+            file_stream,
+            stop_tag=stop_tag,
+            details=details,
+        )
+    except (IndexError, KeyError, TypeError, ValueError, struct.error) as err:
+        LOG.debug("Unable to parse EXIF data from file header: %s", err)
+        file_exif_data = {}
+
     file_exif_data = {
         tag: file_exif_data[tag]
         for tag in file_exif_data
@@ -34,42 +78,65 @@ def get_file_meta(file_content: bytes) -> Dict[str, exifread.classes.IfdTag]:
 
 
 def parse_image_meta_for_file_target(target: FileTarget) -> FileTarget:
-    """Wrap get_file_meta for use within RX pipelines."""
+    """Wrap get_file_meta for use within RX pipelines.
+
+    Only the printable values of the tags the pipeline uses are kept.
+    """
     if target.file_contents:
-        target.image_metadata = get_file_meta(target.file_contents)
+        target.image_metadata = {
+            tag: value.printable
+            for tag, value in get_file_meta(target.file_contents).items()
+            if tag in USED_FIELDS
+        }
 
     return target
 
 
-def identify_image_datestamp(target: FileTarget) -> FileTarget:
-    """Attempt to process image metadata for FileTarget, setting FileTarget.datestamp on success."""
-    known_date_fields = ("EXIF DateTimeDigitized", "EXIF DateTimeOriginal", "Image DateTime")
+def identify_image_datestamp(target: FileTarget, fallback_to_mtime: bool = True) -> FileTarget:
+    """Attempt to process image metadata for FileTarget, setting FileTarget.datestamp on success.
+
+    Without any date in the metadata, the file's modification time is used,
+    unless fallback_to_mtime is unset, in which case the datestamp is left unset.
+    """
+    if target.from_cache:
+        LOG.debug("Datestamp for %s restored from scan cache.", target.file_path)
+        return target
+
+    # The metadata has no further use once the datestamp is known.
+    metadata, target.image_metadata = target.image_metadata, NO_TAGS
 
-    possible_datestamps: List[str] = []
-    for field in known_date_fields:
-        target_date = target.image_metadata.get(field, None)
-        if target_date:
-            possible_datestamps.append(target_date.printable)
+    date_tags: Dict[str, str] = {}
+    parsed_datestamps: List["DateTime"] = []
+    for field in KNOWN_DATE_FIELDS:
+        target_date = metadata.get(field, None)
+        if not target_date:
+            continue
 
-    parsed_datestamps: List[pendulum.DateTime] = []
-    for datestamp in possible_datestamps:
-        try:
-            parsed_datestamps.append(pendulum.parse(datestamp))
-        except pendulum.exceptions.PendulumException:
-            LOG.debug("Unable to parse %s into a native DateTime.", datestamp)
-            pass
+        date_tags[field] = target_date
+
+        subsec, offset = (metadata.get(detail, None) for detail in DATE_DETAIL_FIELDS[field])
+        datestamp = ds.parse_exif_datestamp(target_date, subsec, offset)
+        if datestamp is not None:
+            parsed_datestamps.append(datestamp)
+
+    if date_tags:
+        target.date_tags = date_tags
 
     if not parsed_datestamps:
+        if not fallback_to_mtime:
+            return target
+
         LOG.info("Unable to identify image datestamp from metadata, attempting by file.")
-        mod_time = getmtime(target.file_path)
-        mod_datestamp = pendulum.from_timestamp(mod_time)
+        mod_datestamp = dsrc.date_from_mtime(target)
         if mod_datestamp:
             target.datestamp = mod_datestamp
+            target.date_source = dsrc.DateSource.mtime.value
         else:
             LOG.info("Unable to resolve modified time of file either.")
 
         return target
 
+    target.date_source = dsrc.DateSource.exif.value
 
     if len(parsed_datestamps) == 1:
         LOG.debug("Date fields seem to agree with one another")
@@ -0,0 +1,317 @@
+"""Write-ahead journal of the files placed into storage, allowing interrupted runs to resume.
+
+Once a destination file has been created, empty, and before anything is
+written into it, a "planned" record is appended to the journal, and once the
+file is in place a "completed" record follows.  After a crash, any planned
+operation without a matching completion may have left a partial destination
+behind.  Recovery checks each of these against the size and hash recorded
+when it was planned, or the hash of its source when none was, finishing those
+whose destination is intact, and removing the destination of the rest so they
+are placed again.
+
+Only one run may use a journal at a time, it is locked whilst open, so that
+one run never recovers the operations another is in the middle of.
+
+Every record is written through to the operating system immediately, so it
+survives the process being killed, but records are only fsync'ed to disk in
+groups, so that the journal never becomes the bottleneck of a run.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import IO, Dict, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Not available on Windows.
+    fcntl = None  # type: ignore
+
+from organiser import content_index as ci
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+# Number of records written between each fsync of the journal.
+SYNC_INTERVAL = 64
+
+PLANNED = "planned"
+COMPLETED = "completed"
+ABORTED = "aborted"
+
+
+def default_journal_path(storage_dir: Path) -> Path:
+    """Return the location of the journal for runs placing files into storage_dir."""
+    return Path(storage_dir) / ci.STATE_DIR_NAME / JOURNAL_FILE_NAME
+
+
+class JournalInUse(Exception):
+    """Raised when the journal is already open, by another run."""
+
+
+class Operation(NamedTuple):
+    """A single placement of a file into storage, as recorded in the journal."""
+
+    source: str
+    destination: str
+    copy: bool
+    size: int
+    mtime_ns: int
+    encoded_hash: Optional[str]
+    # Records written before the algorithm was recorded are all SHA256.
+    hash_algorithm: str = fl.HashAlgorithm.sha256.value
+
+
+class RecoveryReport(NamedTuple):
+    """The outcome of recovering the unfinished operations of an interrupted run."""
+
+    finished: int
+    rolled_back: int
+
+
+def _content_matches(operation: Operation) -> bool:
+    """Check the content of the destination of operation against the hash recorded for it.
+
+    Operations recorded without a hash (e.g. by watch, or runs which don't
+    hash their files) are checked against the hash of their source instead,
+    provided it is unchanged since.  Should the source have gone, the size of
+    the destination, already checked, has to suffice.
+    """
+    algorithm = fl.HashAlgorithm(operation.hash_algorithm)
+    encoded_hash = operation.encoded_hash
+
+    if encoded_hash is None:
+        try:
+            stat = os.stat(operation.source)
+        except FileNotFoundError:
+            return True
+
+        if (stat.st_size, stat.st_mtime_ns) != (operation.size, operation.mtime_ns):
+            # Modified since, so the destination is out of date, even if intact.
+            return False
+
+        _, digest = fl.stream_file(operation.source, header_size=0, algorithm=algorithm)
+        encoded_hash = fl.b64_encode(digest)
+
+    _, digest = fl.stream_file(operation.destination, header_size=0, algorithm=algorithm)
+    return fl.b64_encode(digest) == encoded_hash
+
+
+def _recover(operation: Operation) -> bool:
+    """Bring an unfinished operation to a consistent state.
+
+    Returns True if the operation turned out to be complete, or could be
+    completed, and False if it needs placing again.
+    """
+    if not os.path.exists(operation.destination):
+        return False
+
+    source_exists = os.path.exists(operation.source)
+    if not operation.copy and not source_exists:
+        # Moves replace the destination in one step, and only remove the
+        # source once copied across devices, so the destination is intact.
+        return True
+
+    intact = os.path.getsize(operation.destination) == operation.size
+    if not intact or not _content_matches(operation):
+        LOG.info("Removing partially placed %s.", operation.destination)
+        os.unlink(operation.destination)
+        return False
+
+    if not operation.copy:
+        # The copy across devices finished, but the source wasn't yet removed.
+        os.unlink(operation.source)
+
+    return True
+
+
+class Journal:
+    """Append only log of planned and completed placements.
+
+    Instances are safe to share between the worker threads of a pipeline,
+    but not between processes, raising JournalInUse if another holds it.
+    """
+
+    def __init__(
+            self,
+            journal_path: Path,
+            sync_interval: int = SYNC_INTERVAL,
+            hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+    ) -> None:
+        self.journal_path = journal_path
+        self.sync_interval = sync_interval
+        self.hash_algorithm = hash_algorithm
+
+        self._lock = Lock()
+        self._unsynced = 0
+
+        # Source path -> size and mtime_ns of each completed operation, when resuming.
+        self._completed: Dict[str, Tuple[int, int]] = {}
+
+        journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file: IO[str] = open(journal_path, "a+", encoding="utf-8")
+        self._lock_file()
+
+        # Terminate any record torn by a crash, so it doesn't swallow the next.
+        if self._file.tell():
+            with open(journal_path, "rb") as journal:
+                journal.seek(-1, os.SEEK_END)
+                if journal.read(1) != b"\n":
+                    self._file.write("\n")
+                    self._file.flush()
+
+    def _lock_file(self) -> None:
+        """Take an exclusive lock of the journal, held until it is closed."""
+        if fcntl is None:
+            return
+
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as err:
+            self._file.close()
+            raise JournalInUse(
+                f"{self.journal_path} is in use by another run, placing files into the same"
+                f" storage directory.",
+            ) from err
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _read(self) -> Tuple[Dict[str, Operation], Dict[str, Tuple[int, int]]]:
+        """Return the unfinished and completed operations recorded, keyed on source path."""
+        unfinished: Dict[str, Operation] = {}
+        completed: Dict[str, Tuple[int, int]] = {}
+
+        self._file.seek(0)
+        for line_number, line in enumerate(self._file, start=1):
+            try:
+                record = json.loads(line)
+                op = record["op"]
+                operation = Operation(*record["operation"])
+            except (ValueError, KeyError, TypeError) as err:
+                # Most likely the final record, torn by the crash.
+                LOG.warning("Ignoring unreadable journal record %d: %s", line_number, err)
+                continue
+
+            if op == PLANNED:
+                unfinished[operation.source] = operation
+            elif op == COMPLETED:
+                unfinished.pop(operation.source, None)
+                completed[operation.source] = (operation.size, operation.mtime_ns)
+            else:
+                unfinished.pop(operation.source, None)
+
+        return unfinished, completed
+
+    def recover(self, resume: bool = False) -> RecoveryReport:
+        """Finish, or roll back, any operation left unfinished by an interrupted run.
+
+        When resuming, the operations which completed are remembered, so that
+        is_completed can skip them.  Otherwise the journal is cleared, ready
+        for a new run.
+        """
+        with self._lock:
+            unfinished, completed = self._read()
+
+        finished = rolled_back = 0
+        for operation in unfinished.values():
+            try:
+                recovered = _recover(operation)
+            except OSError as err:
+                LOG.warning("Unable to recover %s: %s", operation.destination, err)
+                continue
+
+            if recovered:
+                self._append(COMPLETED, operation)
+                completed[operation.source] = (operation.size, operation.mtime_ns)
+                finished += 1
+            else:
+                self._append(ABORTED, operation)
+                rolled_back += 1
+
+        if resume:
+            self._completed = completed
+        else:
+            with self._lock:
+                self._file.seek(0)
+                self._file.truncate()
+                self._sync()
+
+        if finished or rolled_back:
+            LOG.info(
+                "Recovered interrupted run: %d operations finished, %d rolled back.",
+                finished,
+                rolled_back,
+            )
+
+        return RecoveryReport(finished, rolled_back)
+
+    def is_completed(self, target: FileTarget) -> bool:
+        """Check whether a resumed run already placed target, as it is now."""
+        recorded = self._completed.get(os.path.abspath(target.file_path))
+        if recorded is None:
+            return False
+
+        try:
+            stat = fl.stat_target(target)
+        except FileNotFoundError:
+            # Moved into storage by the run being resumed, e.g. when applying a plan.
+            return True
+
+        return recorded == (stat.st_size, stat.st_mtime_ns)
+
+    def _sync(self) -> None:
+        """fsync the journal.  Callers must hold the lock."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def _append(self, op: str, operation: Operation) -> None:
+        """Write a record through to the operating system, syncing every sync_interval records."""
+        line = json.dumps({"op": op, "operation": list(operation)}) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_interval:
+                self._sync()
+
+    def _operation(self, target: FileTarget, copy: bool) -> Operation:
+        stat = fl.stat_target(target)
+        return Operation(
+            source=os.path.abspath(target.file_path),
+            destination=os.path.abspath(target.target_move_path),
+            copy=copy,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            encoded_hash=target.encoded_hash,
+            hash_algorithm=self.hash_algorithm.value,
+        )
+
+    def planned(self, target: FileTarget, copy: bool) -> None:
+        """Record that target is about to be placed at its target_move_path, just created."""
+        self._append(PLANNED, self._operation(target, copy))
+
+    def completed(self, target: FileTarget, copy: bool) -> None:
+        """Record that target was placed at its target_move_path."""
+        self._append(COMPLETED, self._operation(target, copy))
+
+    def aborted(self, target: FileTarget, copy: bool) -> None:
+        """Record that placing target failed, and its destination was removed."""
+        self._append(ABORTED, self._operation(target, copy))
+
+    def close(self) -> None:
+        """Sync and close the journal."""
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -1,111 +1,557 @@
 #!/usr/bin/env python
 import logging
+import os
+from concurrent.futures import Executor
+from contextlib import ExitStack, nullcontext
 from functools import partial
 from pathlib import Path
 from threading import Event
-from time import sleep
-from typing import List, Sequence, Union
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple, Union
 
-import rx
 import typer
-from better_exceptions import patch_logging
-from rx import operators
-from rx.scheduler import ThreadPoolScheduler
 
+from organiser import budget as bg
+from organiser import content_index as ci
+from organiser import date_sources as dsrc
+from organiser import dedup as dd
+from organiser import engine
+from organiser import executors as ex
 from organiser import file_listing as fl
 from organiser import file_ops as fo
 from organiser import filename_calculations as fc
-from organiser import image_metadata as im
+from organiser import journal as jn
+from organiser import metrics as mt
+from organiser import plan as pl
+from organiser import scan_cache as sc
+from organiser import tree_snapshot as ts
+from organiser import watch as wt
 from organiser.types import FailedTarget, FileTarget
 
 LOG = logging.getLogger(__name__)
-patch_logging()
+
+app = typer.Typer()
 
 
 def dry_run_print(target: FileTarget) -> None:
     """Print the dry run changes."""
+    date_taken = target.date_tags.get("EXIF DateTimeOriginal", "Unknown")
+    if target.date_source in dsrc.NAME_SOURCES and target.datestamp is not None:
+        date_taken = f"{target.datestamp:%Y-%m-%d %H:%M:%S} (from {target.date_source})"
+
     typer.echo(
         f"Moving: {target.file_path}, To: {target.target_move_path} -- "
-        f"Date taken: {target.image_metadata.get('EXIF DateTimeOriginal', 'Unknown')}",
+        f"Date taken: {date_taken}",
     )
 
 
-def get_files(base_dir: Path, filter_regex: str, scheduler: rx.typing.Scheduler) -> rx.Observable:
-    """Return an observable of files to process as FileTarget's."""
-    return rx.from_iterable(
-        fl.file_listing_iterator(base_dir, filter_regex),
-        scheduler=scheduler,
-    )
+def record_planned(target: FileTarget, writer: pl.PlanWriter) -> None:
+    """Print the dry run changes, and record them in the plan being written."""
+    dry_run_print(target)
+    writer.add(target)
 
 
-def load_file_content(file_stream: rx.Observable) -> rx.Observable:
-    """Load files content from disk."""
-    return file_stream.pipe(operators.map(fl.load_file_contents))
+def skip_completed(target: FileTarget, journal: jn.Journal) -> Optional[FileTarget]:
+    """Drop target if the run being resumed already placed it."""
+    if journal.is_completed(target):
+        LOG.debug("Skipping %s, it was placed by the interrupted run.", target.file_path)
+        return None
 
+    return target
 
-def generate_file_metadata(file_stream: rx.Observable) -> rx.Observable:
-    """Add various file metadata to the FileTargets being streamed."""
-    return file_stream.pipe(
-        operators.map(fl.sha256_file),
-        operators.map(fl.encode_shasum),
-    )
 
+def fill_from_cache(target: FileTarget, cache: sc.ScanCache) -> FileTarget:
+    """Restore previously computed scan results for target, if it is unchanged."""
+    return cache.fill(target)
+
+
+def store_in_cache(target: FileTarget, cache: sc.ScanCache) -> FileTarget:
+    """Record scan results for a newly processed target.
+
+    Targets dated by their names aren't recorded, as a later run may take
+    its dates from elsewhere, and the cache would otherwise override it.
+    """
+    if not dsrc.dated_from_contents(target):
+        return target
+
+    return cache.store(target)
+
+
+def skip_duplicates(
+        targets: List[FileTarget],
+        hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> List[FileTarget]:
+    """Drop any of targets that duplicate another within it.
+
+    Only files whose size collides with another are ever read to make this
+    decision, see organiser.dedup for details.
+    """
+    originals: List[FileTarget] = []
+
+    for target in dd.mark_duplicates(targets, algorithm=hash_algorithm):
+        if target.duplicate_of is None:
+            originals.append(target)
+            continue
+
+        typer.secho(
+            f"Skipping {target.file_path}, it is a duplicate of {target.duplicate_of}.",
+            fg=typer.colors.YELLOW,
+        )
+
+    return originals
+
+
+def analyse_file_target(
+        target: FileTarget,
+        executor: Executor,
+        hash_files: bool = True,
+        header_size: int = fl.HEADER_SIZE,
+        sources: Optional[dsrc.DateSources] = None,
+        hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+        budget: Optional[bg.ByteBudget] = None,
+        cancelled: Optional[Event] = None,
+) -> FileTarget:
+    """Date, load, hash and parse the metadata of target within executor.
+
+    Targets are dated from each of sources in turn, the default being their
+    EXIF data, then their modification time.  When hash_files is unset, only
+    the metadata header of the file is read, and nothing at all is read of
+    files dated before reading their EXIF data.  Targets restored from the
+    scan cache are passed straight through.
+
+    Whilst a file is read, the bytes held to read it are charged to budget,
+    if given, waiting until they fit, or cancelled is set.  Files are streamed
+    through a single buffer, so those are at most its header and one chunk.
+    """
+    if target.from_cache:
+        return target
+
+    if sources is None:
+        sources = dsrc.DateSources()
+
+    target = sources.date_before_read(target)
+    dated = target.datestamp
+    identify_date = sources.needs_exif(target)
+
+    if identify_date or hash_files:
+        read_size = 0
+        if budget is not None:
+            file_size = fl.stat_target(target).st_size
+            held_size = header_size + fl.CHUNK_SIZE if hash_files else header_size
+            read_size = min(file_size, held_size)
+
+        with budget.hold(read_size, cancelled) if budget is not None else nullcontext():
+            analysis = executor.submit(
+                ex.analyse_file,
+                target.file_path,
+                hash_files,
+                header_size,
+                target.file_stat,
+                identify_date,
+                # The sources following EXIF date the target, if its EXIF data doesn't.
+                False,
+                hash_algorithm,
+            )
+            result = analysis.result()
+
+        source = target.date_source
+        target = ex.apply_analysis(target, result)
+
+        if dated is not None and identify_date:
+            sources.cross_check(target, dated, dsrc.DateSource(source))
+
+    return sources.date_after_read(target)
+
+
+def generate_move_path(target: FileTarget, storage_dir: str) -> FileTarget:
+    """Identify the appropriate move path for target."""
+    return fc.identify_photo_move_path(storage_dir, target).clear_contents_data()
+
+
+def skip_stored(target: FileTarget, index: ci.ContentIndex) -> Optional[FileTarget]:
+    """Drop target if identical content is already held in storage."""
+    if target.file_hash is None:
+        return target
+
+    stored_path = index.lookup(target.file_hash)
+    if stored_path is None or stored_path == os.path.abspath(target.file_path):
+        return target
 
-def generate_image_metadata(file_stream: rx.Observable) -> rx.Observable:
-    """Add image metadata to file_stream."""
-    return file_stream.pipe(
-        operators.map(im.parse_image_meta_for_file_target),
-        operators.map(im.identify_image_datestamp),
+    typer.secho(
+        f"Skipping {target.file_path}, it is already stored as {stored_path}.",
+        fg=typer.colors.YELLOW,
     )
+    return None
+
+
+def migrate(
+        target: FileTarget,
+        copy_only: bool,
+        planner: fo.NamePlanner,
+        index: Optional[ci.ContentIndex] = None,
+        vacated: Optional[fo.VacatedDirectories] = None,
+        journal: Optional[jn.Journal] = None,
+) -> engine.StageResult:
+    """Move or copy target to its move path.
+
+    When a content index is provided, targets whose content is already in
+    storage are skipped, and the index is updated with those that are placed.
+    Moved targets have their source directory recorded in vacated, to be
+    removed at the end of the run if it was left empty.  Placements are
+    recorded in journal, so that an interrupted run can be recovered.
+    """
+    if index is not None:
+        stored_path = index.claim(target)
+        if stored_path is not None:
+            typer.secho(
+                f"Skipping {target.file_path}, it is already stored as {stored_path}.",
+                fg=typer.colors.YELLOW,
+            )
+            return None
+
+    on_planned = None
+    if journal is not None:
+        on_planned = partial(journal.planned, copy=copy_only)
+
+    try:
+        target = fo.migrate_file_target(target, copy_only, planner, on_planned)
+
+    except Exception:
+        if index is not None:
+            index.release(target)
+        if journal is not None:
+            journal.aborted(target, copy_only)
+        raise
+
+    if index is not None:
+        index.complete(target)
+
+    # Nothing was journaled for targets which were already in place.
+    if journal is not None and target.transfer_method is not None:
+        journal.completed(target, copy_only)
+
+    if copy_only or vacated is None:
+        return target
+
+    return vacated.record(target)
+
+
+def replan_target(
+        target: FileTarget,
+        executor: Executor,
+        storage_dir: str,
+        header_size: int = fl.HEADER_SIZE,
+        sources: Optional[dsrc.DateSources] = None,
+        hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> FileTarget:
+    """Plan target afresh, as a run of organiser would."""
+    target = analyse_file_target(target, executor, True, header_size, sources, hash_algorithm)
+    return generate_move_path(target, storage_dir)
+
+
+def check_planned(
+        target: FileTarget,
+        replan: Optional[Callable[[FileTarget], FileTarget]] = None,
+) -> Optional[FileTarget]:
+    """Pass target on if its file is as it was when planned, by its size and mtime.
+
+    Files removed since being planned are dropped, as are those which
+    changed, unless replan is given, to plan them afresh.
+    """
+    if not isinstance(target, pl.PlannedTarget):
+        return target
+
+    try:
+        changed = pl.changed_since_planned(target)
+    except FileNotFoundError:
+        typer.secho(
+            f"Skipping {target.file_path}, it was removed since it was planned.",
+            fg=typer.colors.YELLOW,
+        )
+        return None
 
+    if not changed:
+        return target
+
+    if replan is None:
+        typer.secho(
+            f"Skipping {target.file_path}, it changed since it was planned.",
+            fg=typer.colors.YELLOW,
+        )
+        return None
 
-def generate_move_path(file_stream: rx.Observable, storage_dir: str) -> rx.Observable:
-    """Identify the appropriate move path for files in the file_stream."""
-    return file_stream.pipe(
-        operators.map(lambda target: fc.identify_photo_move_path(storage_dir, target)),
-        operators.map(lambda target: target.clear_contents_data()),
+    typer.secho(
+        f"Planning {target.file_path} again, it changed since it was planned.",
+        fg=typer.colors.YELLOW,
     )
+    return replan(FileTarget(target.file_path, file_stat=target.file_stat))
 
 
-def handle_error(err: Exception, event: Event) -> None:
-    """Log the occurrence of an error, and set the shutdown event."""
-    LOG.exception(
-        "Application hit an error: %s",
-        err,
-        stack_info=True,
-        exc_info=True,
+def report_migrated(target: FileTarget, copy_only: bool) -> None:
+    """Print the completed move or copy of target."""
+    typer.echo(
+        f"{'Copied' if copy_only else 'Moved'} "
+        f"{target.file_path} to {target.target_move_path} ({target.transfer_method}).",
     )
-    event.set()
 
 
-def filter_errors(
-        item: Union[FileTarget, FailedTarget],
-        error_collection: Sequence[FailedTarget],
-) -> bool:
-    """Filter to remove failed records, push them to error_collection for later processing.
+def report_watched(target: FileTarget, copy_only: bool, watcher: wt.Watcher) -> None:
+    """Print the completed move or copy of target, and stop the watcher picking it up again."""
+    watcher.ignore(target.target_move_path)
+    report_migrated(target, copy_only)
+
+
+def record_failure(item: FailedTarget, error_collection: List[FailedTarget]) -> None:
+    """Report a failed record, pushing it to error_collection for later processing.
 
     Suggest that callers wrap this with partial, to provide the
-    error_collection, and use the resulting partial directly in
-    `operators.filter` calls.
+    error_collection, and use the resulting partial as the pipelines
+    on_failure callback.
     """
-    if not isinstance(item, FailedTarget):
-        return True
-
+    LOG.debug(
+        "Processing for %s failed.",
+        item.original_record.file_path,
+        exc_info=item.failure_reason,
+    )
     typer.secho(
         f"Processing for {item.original_record.file_path} failed: {item.failure_reason}",
         fg=typer.colors.RED,
         err=True,
     )
     error_collection.append(item)
-    return False
 
 
+def _open_journal(
+        storage_dir: Path,
+        resume: bool,
+        hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+) -> jn.Journal:
+    """Open the journal for storage_dir, recovering anything an interrupted run left behind.
+
+    Exits if another run is already placing files into storage_dir.
+    """
+    try:
+        journal = jn.Journal(jn.default_journal_path(storage_dir), hash_algorithm=hash_algorithm)
+    except jn.JournalInUse as err:
+        typer.secho(str(err), fg=typer.colors.RED, err=True)
+        raise typer.Exit(1) from err
+
+    recovery = journal.recover(resume)
+    if recovery.finished or recovery.rolled_back:
+        typer.secho(
+            f"Recovered an interrupted run: {recovery.finished} files finished, "
+            f"{recovery.rolled_back} to be placed again.",
+            fg=typer.colors.YELLOW,
+            err=True,
+        )
+
+    return journal
+
+
+def _check_hash_algorithm(hash_algorithm: fl.HashAlgorithm) -> None:
+    """Fail with a usage error if the package providing hash_algorithm isn't installed."""
+    if not fl.hash_algorithm_available(hash_algorithm):
+        raise typer.BadParameter(
+            f"The {hash_algorithm.value} hash needs the xxhash package, install it with"
+            f" pip install xxhash.",
+            param_hint="--hash",
+        )
+
+
+def _report_cross_checks(sources: dsrc.DateSources) -> None:
+    """Print how many of the dates cross-checked against EXIF data disagreed with it."""
+    if not sources.checked:
+        return
+
+    typer.secho(
+        f"Cross-checked {sources.checked} dates against EXIF data, "
+        f"{sources.disagreed} disagreed.",
+        fg=typer.colors.YELLOW if sources.disagreed else None,
+        err=True,
+    )
+
+
+def _byte_budget(max_inflight_bytes: Optional[str]) -> Optional[bg.ByteBudget]:
+    """Return the budget of bytes the readers may hold at once, if one was set."""
+    if max_inflight_bytes is None:
+        return None
+
+    try:
+        max_bytes = bg.parse_size(max_inflight_bytes)
+    except ValueError as err:
+        raise typer.BadParameter(str(err), param_hint="--max-inflight-bytes") from err
+
+    if max_bytes <= 0:
+        raise typer.BadParameter("--max-inflight-bytes must be above zero.")
+
+    return bg.ByteBudget(max_bytes)
+
+
+def _read_plan_header(plan_path: Path) -> pl.PlanHeader:
+    """Read the header of the plan at plan_path, failing with a usage error if it isn't one."""
+    try:
+        return pl.read_header(plan_path)
+    except (OSError, ValueError) as err:
+        raise typer.BadParameter(str(err), param_hint="PLAN_PATH") from err
+
+
+def _finish_plan(writer: pl.PlanWriter, cancelled: Event) -> None:
+    """Move the plan writer wrote into place, unless the run was cancelled before finishing."""
+    if cancelled.is_set():
+        writer.discard()
+        typer.secho("The run was cancelled, no plan was written.", fg=typer.colors.RED)
+        return
+
+    writer.close()
+    typer.echo(
+        f"Wrote the plan of {writer.entries} files to {writer.plan_path}, "
+        f"carry it out with organiser apply.",
+    )
+
+
+def _filters(
+        ext: Optional[str],
+        exclude: Optional[List[str]],
+        filter_regex: str,
+) -> Tuple[str, Optional[FrozenSet[str]], Tuple[str, ...]]:
+    """Return the filename filter, extensions and directory excludes files are selected by.
+
+    Extensions take precedence over filter_regex, which is dropped when any are given.
+    """
+    extensions = fl.parse_extensions(ext)
+    excludes = (*fl.DEFAULT_EXCLUDES, *(exclude or []))
+    if ext:
+        filter_regex = ""
+
+    return filter_regex, extensions, excludes
+
+
+def _analysis_options(
+        date_sources: str,
+        hash_algorithm: fl.HashAlgorithm,
+        verify_sample: float = 0.0,
+        max_inflight_bytes: Optional[str] = None,
+) -> Tuple[dsrc.DateSources, Optional[bg.ByteBudget]]:
+    """Check the options files are analysed with, returning their date sources and budget."""
+    sources = dsrc.DateSources(dsrc.parse_date_sources(date_sources), verify_sample)
+    _check_hash_algorithm(hash_algorithm)
+
+    return sources, _byte_budget(max_inflight_bytes)
+
+
+def _analysis_stage(
+        resources: ExitStack,
+        executor: ex.ExecutorKind,
+        workers: Optional[int],
+        queue_size: int,
+        header_size: int,
+        sources: dsrc.DateSources,
+        hash_algorithm: fl.HashAlgorithm,
+        hash_files: bool = True,
+        budget: Optional[bg.ByteBudget] = None,
+        cancelled: Optional[Event] = None,
+) -> engine.Stage:
+    """Return the stage loading targets from disk, hashing them and parsing their metadata.
+
+    Its pool of workers is shut down along with resources.
+    """
+    analysis_workers = workers or os.cpu_count() or 1
+    analysis_pool = ex.make_executor(executor, analysis_workers)
+    resources.callback(analysis_pool.shutdown, cancel_futures=True)
+
+    return engine.Stage(
+        "analyse",
+        partial(
+            analyse_file_target,
+            executor=analysis_pool,
+            hash_files=hash_files,
+            header_size=header_size,
+            sources=sources,
+            hash_algorithm=hash_algorithm,
+            budget=budget,
+            cancelled=cancelled,
+        ),
+        workers=analysis_workers,
+        queue_size=queue_size,
+    )
+
+
+def _run_pipeline(
+        stages: List[Union[engine.Stage, engine.BarrierStage]],
+        source: Iterable[FileTarget],
+        sink: Callable[[FileTarget], None],
+        failed_results: List[FailedTarget],
+        budget: Optional[bg.ByteBudget] = None,
+        cancelled: Optional[Event] = None,
+        progress: bool = True,
+        metrics_interval: float = mt.DEFAULT_INTERVAL,
+        metrics_json: Optional[Path] = None,
+        metrics_prometheus: Optional[Path] = None,
+) -> None:
+    """Run every target of source through stages into sink, reporting metrics as it runs.
+
+    Targets which fail are appended to failed_results, even if the run is
+    interrupted.
+    """
+    pipeline = engine.Pipeline(
+        stages,
+        on_failure=partial(record_failure, error_collection=failed_results),
+        budget=budget,
+        cancelled=cancelled,
+    )
+
+    reporter = mt.MetricsReporter(
+        pipeline.metrics,
+        pipeline.queue_depths,
+        interval=metrics_interval,
+        json_path=metrics_json,
+        prometheus_path=metrics_prometheus,
+        progress=progress,
+    )
+    with reporter:
+        pipeline.run(source, sink)
+
+
+def _report_failures(failed_results: List[FailedTarget]) -> None:
+    """Print each of the targets which failed to process."""
+    typer.echo(f"Encountered {len(failed_results)} Records that failed to process:")
+    for fail in failed_results:
+        typer.secho(str(fail), fg=typer.colors.RED)
+
+
+@app.callback(invoke_without_command=True)
 def main(
+        ctx: typer.Context,
         base_dir: Path = "",
         storage_dir: Path = "",
         filter_regex: str = r".*(?:jpg|JPG|JPEG|jpeg)$",
         copy_only: bool = False,
         dry_run: bool = False,
+        plan_output: Optional[Path] = None,
+        cache: bool = True,
+        rebuild_cache: bool = False,
+        cache_path: Optional[Path] = None,
+        cache_max_entries: int = sc.DEFAULT_MAX_ENTRIES,
+        exif_budget_kb: int = fl.HEADER_SIZE // 1024,
+        date_sources: str = ",".join(dsrc.DEFAULT_DATE_SOURCES),
+        verify_sample: float = 0.0,
+        dedup: bool = False,
+        hash_algorithm: fl.HashAlgorithm = typer.Option(fl.DEFAULT_HASH_ALGORITHM, "--hash"),
+        workers: Optional[int] = None,
+        executor: ex.ExecutorKind = ex.ExecutorKind.thread,
+        scan_workers: int = 4,
+        move_workers: int = 4,
+        queue_size: int = engine.DEFAULT_QUEUE_SIZE,
+        max_inflight_bytes: Optional[str] = None,
+        ext: Optional[str] = None,
+        exclude: Optional[List[str]] = None,
+        skip_existing: bool = False,
+        incremental: bool = False,
+        full_scan: bool = False,
+        resume: bool = False,
+        progress: bool = True,
+        metrics_interval: float = mt.DEFAULT_INTERVAL,
+        metrics_json: Optional[Path] = None,
+        metrics_prometheus: Optional[Path] = None,
 ) -> None:
     """Organise image files from one location to another.
 
@@ -118,6 +564,9 @@ def main(
     By setting the --copy-only flag, this application will copy, rather than
     the default move, files when organising them.
 
+    The options below are shared by the watch, plan and apply commands, which
+    only document those of their own.
+
     Arguments:
         base_dir: The location from which the application should search for
             image files.
@@ -134,96 +583,801 @@ def main(
         dry_run: A flag to print proposed changes only, don't actually do
             anything.
 
+        plan_output: With dry_run, also write the proposed changes to this
+            file, as a plan of where each file goes, along with its size,
+            modification time, hash and datestamp.  Once reviewed, carry the
+            plan out with organiser apply, which needs neither a walk nor a
+            read of any file unchanged since.  Every file is hashed when
+            writing a plan.
+
+        cache: Whether to reuse hashes and datestamps of files which haven't
+            changed since they were last processed.  Use --no-cache to
+            process every file from scratch.
+
+        rebuild_cache: Discard any existing scan cache before starting.
+
+        cache_path: Location of the scan cache, defaults to
+            $XDG_CACHE_HOME/organiser/scan_cache.sqlite3.
+
+        cache_max_entries: The maximum number of files to retain in the scan
+            cache, the least recently seen are evicted beyond this.
+
+        exif_budget_kb: The maximum number of KB read from the start of each
+            file when looking for its EXIF metadata.  Dry runs read nothing
+            beyond this, as they have no need to hash files.
+
+        date_sources: A comma separated list of where to take each file's
+            date from, the first to give a date being used: filename, e.g.
+            IMG_20190203_142501.jpg, directory, the date of an album or dated
+            directory holding the file, exif, or mtime, the file's
+            modification time.  Files dated by sources listed before exif
+            never have their EXIF data read, so with e.g.
+            filename,directory,exif,mtime dry runs of phone imports read no
+            files at all.
+
+        verify_sample: The fraction, from 0 to 1, of files dated by sources
+            listed before exif to cross-check against their EXIF data anyway.
+            Files which disagree are reported, and take their EXIF date.
+
+        dedup: Skip files which are byte-identical to another file found in
+            base_dir.  Only files sharing a size with another are hashed when
+            this is set, every other file has just its metadata header read.
+
+        hash_algorithm: The algorithm files are hashed with.  sha256 and
+            blake2b are cryptographic, xxh3 is not, but is much faster and
+            plenty to tell a library's files apart.  xxh3 needs the xxhash
+            package installed.  Hashes are stored along with their algorithm,
+            so changing it rehashes any files it is needed for.
+
+        workers: The number of workers used to read, hash and parse files,
+            defaults to a number based on the CPUs available.
+
+        executor: Whether those workers are threads, or processes.  Parsing
+            EXIF data is CPU bound, so processes scale better on large hosts.
+
+        scan_workers: The number of threads checking files against the scan
+            cache, this is mostly waiting on stat calls.
+
+        move_workers: The number of threads moving or copying files into
+            storage_dir.
+
+        queue_size: The number of files each stage may have waiting for it,
+            which bounds how far the walk can run ahead of slower stages.
+
+        max_inflight_bytes: The memory the readers may hold at once, e.g.
+            512M or 2G, unlimited by default.  Each file is streamed through
+            a 1MiB buffer, keeping its metadata header, so is charged its
+            size, up to that of the two (only the header, of files which
+            aren't hashed).  Files are read in the order they were found,
+            each once its charge fits within what remains of the budget.
+
+        ext: A comma separated list of file extensions to operate on, e.g.
+            jpg,jpeg,heic.  This is faster than, and takes precedence over,
+            filter_regex.
+
+        exclude: Glob patterns of directory names to skip entirely, in
+            addition to @eaDir, .thumbnails, .git and .organiser.  May be
+            repeated.
+
+        skip_existing: Skip files whose content is already held somewhere in
+            storage_dir, using an index of storage_dir kept within it.  The
+            index is brought up to date before processing starts, which
+            requires hashing any files added to storage_dir since.  Files
+            within base_dir are left out of it, as they are yet to be placed.
+
+        incremental: Only list the directories of base_dir which changed
+            since the last incremental run, reusing the listings recorded then
+            for the rest.  Files edited in place, rather than replaced, are
+            not noticed.
+
+        full_scan: With --incremental, list every directory regardless,
+            bringing the recorded listings fully up to date.
+
+        resume: Continue an interrupted run, skipping the files it already
+            placed.  Whether resuming or not, any file the interrupted run was
+            part way through placing is either finished, or removed from
+            storage_dir so that it is placed again.
+
+        progress: Print a line every metrics_interval seconds, giving the
+            number of files processed, the rate they are being processed at,
+            an estimate of the time remaining once every file has been found,
+            and the number of files queued for, and being worked on by, each
+            stage.  A stage with a full queue is the bottleneck.
+
+        metrics_interval: Seconds between each progress line, and each export
+            of metrics.
+
+        metrics_json: A file to append the metrics of every stage to, as a
+            line of JSON, every metrics_interval seconds.
+
+        metrics_prometheus: A file to rewrite with the metrics of every stage,
+            in the Prometheus text format, every metrics_interval seconds.
+            Point node_exporter's textfile collector at its directory.
+
     """
-    operation_complete = Event()
-    operation_failed = Event()
+    # Slow to import, so only done once there is something to run, rather than for --help.
+    from better_exceptions import patch_logging  # pylint: disable=import-outside-toplevel
+    patch_logging()
+
+    if ctx.invoked_subcommand is not None:
+        return
 
     if not storage_dir:
         storage_dir = base_dir
 
-    worker_pool = ThreadPoolScheduler(3)
+    filter_regex, extensions, excludes = _filters(ext, exclude, filter_regex)
+    sources, budget = _analysis_options(
+        date_sources,
+        hash_algorithm,
+        verify_sample,
+        max_inflight_bytes,
+    )
+    cancelled = Event()
+
+    if plan_output is not None and not dry_run:
+        raise typer.BadParameter("Plans are only written by dry runs.", param_hint="--plan-output")
+
+    # Dry runs have no use for file hashes, and when de-duplicating only the
+    # files which collide with another need hashing, so only read headers.
+    # Every file needs a hash to be checked against the content index, or to
+    # be recorded in a plan, though.
+    hash_files = skip_existing or plan_output is not None or not (dry_run or dedup)
+
     failed_results: List[FailedTarget] = []
+    with ExitStack() as resources:
+        content_index: Optional[ci.ContentIndex] = None
+        if skip_existing:
+            content_index = ci.ContentIndex(ci.default_index_path(storage_dir), hash_algorithm)
+            resources.callback(content_index.close)
+            typer.echo(f"Indexing the contents of {storage_dir}.", err=True)
+            content_index.refresh(storage_dir, filter_regex, extensions, excludes, base_dir)
 
-    # Use this to pull errors out of the stream.
-    failed_record_filter = partial(filter_errors, error_collection=failed_results)
+        scan_cache: Optional[sc.ScanCache] = None
+        if cache:
+            scan_cache = sc.ScanCache(
+                cache_path or sc.default_cache_path(),
+                max_entries=cache_max_entries,
+                rebuild=rebuild_cache,
+                require_hash=hash_files,
+                hash_algorithm=hash_algorithm,
+            )
+            resources.callback(scan_cache.close)
 
-    # Identify targets
-    file_listing_shared = get_files(base_dir, filter_regex, worker_pool).pipe(
-        operators.filter(failed_record_filter),
-        operators.publish(),
-    )
+        source = fl.file_listing_iterator(base_dir, filter_regex, extensions, excludes)
+        if incremental:
+            snapshot = ts.TreeSnapshot(ts.default_snapshot_path(base_dir))
+            resources.callback(snapshot.close)
+            source = snapshot.walk(
+                base_dir,
+                filter_regex,
+                extensions,
+                excludes,
+                full_scan=full_scan,
+            )
+
+        journal: Optional[jn.Journal] = None
+        if not dry_run:
+            journal = _open_journal(storage_dir, resume, hash_algorithm)
+            resources.callback(journal.close)
+
+        vacated = fo.VacatedDirectories(base_dir)
+
+        stages: List[Union[engine.Stage, engine.BarrierStage]] = []
+
+        if resume and journal is not None:
+            stages.append(
+                engine.Stage(
+                    "resume",
+                    partial(skip_completed, journal=journal),
+                    queue_size=queue_size,
+                ),
+            )
+
+        if scan_cache is not None:
+            stages.append(
+                engine.Stage(
+                    "scan",
+                    partial(fill_from_cache, cache=scan_cache),
+                    workers=scan_workers,
+                    queue_size=queue_size,
+                ),
+            )
+
+        if dedup:
+            stages.append(
+                engine.BarrierStage(
+                    "dedup",
+                    partial(skip_duplicates, hash_algorithm=hash_algorithm),
+                    queue_size=queue_size,
+                ),
+            )
+
+        stages.append(
+            _analysis_stage(
+                resources,
+                executor,
+                workers,
+                queue_size,
+                exif_budget_kb * 1024,
+                sources,
+                hash_algorithm,
+                hash_files=hash_files,
+                budget=budget,
+                cancelled=cancelled,
+            ),
+        )
+
+        if scan_cache is not None:
+            stages.append(
+                engine.Stage(
+                    "record",
+                    partial(store_in_cache, cache=scan_cache),
+                    queue_size=queue_size,
+                ),
+            )
+
+        stages.append(
+            engine.Stage(
+                "plan",
+                partial(generate_move_path, storage_dir=str(storage_dir)),
+                queue_size=queue_size,
+            ),
+        )
+
+        sink: Callable[[FileTarget], None] = dry_run_print
+
+        plan_writer: Optional[pl.PlanWriter] = None
+        if plan_output is not None:
+            header = pl.PlanHeader(
+                base_dir=os.path.abspath(base_dir),
+                storage_dir=os.path.abspath(storage_dir),
+                hash_algorithm=hash_algorithm.value,
+            )
+            plan_writer = resources.enter_context(pl.PlanWriter(plan_output, header))
+            sink = partial(record_planned, writer=plan_writer)
+
+        if dry_run and content_index is not None:
+            stages.append(
+                engine.Stage(
+                    "stored",
+                    partial(skip_stored, index=content_index),
+                    queue_size=queue_size,
+                ),
+            )
+
+        if not dry_run:
+            stages.append(
+                engine.Stage(
+                    "migrate",
+                    partial(
+                        migrate,
+                        copy_only=copy_only,
+                        planner=fo.NamePlanner(),
+                        index=content_index,
+                        vacated=vacated,
+                        journal=journal,
+                    ),
+                    workers=move_workers,
+                    queue_size=queue_size,
+                ),
+            )
+            sink = partial(report_migrated, copy_only=copy_only)
+
+        _run_pipeline(
+            stages,
+            source,
+            sink,
+            failed_results,
+            budget,
+            cancelled,
+            progress,
+            metrics_interval,
+            metrics_json,
+            metrics_prometheus,
+        )
 
-    # Load targets from disk
-    loaded_files = load_file_content(file_listing_shared).pipe(
-        operators.filter(failed_record_filter),
+        if plan_writer is not None:
+            _finish_plan(plan_writer, cancelled)
+
+        # One pass over the directories files were moved out of, rather than a
+        # walk up the tree after every file.
+        vacated.sweep()
+
+    typer.echo("Operation completed.")
+
+    _report_cross_checks(sources)
+    _report_failures(failed_results)
+
+
+@app.command()
+def watch(
+        base_dir: Path = Path(),
+        storage_dir: Optional[Path] = None,
+        filter_regex: str = r".*(?:jpg|JPG|JPEG|jpeg)$",
+        copy_only: bool = False,
+        ext: Optional[str] = None,
+        exclude: Optional[List[str]] = None,
+        skip_existing: bool = False,
+        exif_budget_kb: int = fl.HEADER_SIZE // 1024,
+        date_sources: str = ",".join(dsrc.DEFAULT_DATE_SOURCES),
+        verify_sample: float = 0.0,
+        hash_algorithm: fl.HashAlgorithm = typer.Option(fl.DEFAULT_HASH_ALGORITHM, "--hash"),
+        workers: Optional[int] = None,
+        executor: ex.ExecutorKind = ex.ExecutorKind.thread,
+        move_workers: int = 4,
+        queue_size: int = engine.DEFAULT_QUEUE_SIZE,
+        max_inflight_bytes: Optional[str] = None,
+        quiet_period: float = wt.DEFAULT_QUIET_PERIOD,
+        poll_interval: float = wt.DEFAULT_POLL_INTERVAL,
+        inotify: bool = True,
+        progress: bool = False,
+        metrics_interval: float = mt.DEFAULT_INTERVAL,
+        metrics_json: Optional[Path] = None,
+        metrics_prometheus: Optional[Path] = None,
+) -> None:
+    """Continuously organise image files as they are added to a directory.
+
+    Files already within base_dir are organised first, then base_dir is
+    watched for new files, which are organised as soon as they have finished
+    being written.  No rescans of base_dir are needed, except where inotify is
+    unavailable.  Runs until interrupted, e.g. with Ctrl-C.
+
+    Directories files are moved out of are left in place, as drop folders are
+    usually expected to persist.  Files are only hashed with skip_existing.
+    Every other option is as for the main command, see organiser --help.
+
+    Arguments:
+        base_dir: The directory to watch for new image files.
+
+        storage_dir: The location from which the application should create the
+            archive of organised files, defaults to base_dir.
+
+        quiet_period: Seconds a file must be left unchanged, after being
+            closed, before it is organised.
+
+        poll_interval: Seconds between rescans of base_dir, only used when
+            inotify is unavailable.
+
+        inotify: Use inotify to watch for new files where available.  Use
+            --no-inotify to always poll, e.g. for network file systems.
+
+    """
+    if storage_dir is None:
+        storage_dir = base_dir
+
+    filter_regex, extensions, excludes = _filters(ext, exclude, filter_regex)
+    sources, budget = _analysis_options(
+        date_sources,
+        hash_algorithm,
+        verify_sample,
+        max_inflight_bytes,
     )
+    cancelled = Event()
 
-    enriched_files = loaded_files.pipe(
-        generate_file_metadata,
-        operators.filter(failed_record_filter),
-        generate_image_metadata,
-        operators.filter(failed_record_filter),
+    failed_results: List[FailedTarget] = []
+    with ExitStack() as resources:
+        content_index: Optional[ci.ContentIndex] = None
+        if skip_existing:
+            content_index = ci.ContentIndex(ci.default_index_path(storage_dir), hash_algorithm)
+            resources.callback(content_index.close)
+            typer.echo(f"Indexing the contents of {storage_dir}.", err=True)
+            content_index.refresh(storage_dir, filter_regex, extensions, excludes, base_dir)
+
+        journal = _open_journal(storage_dir, resume=False, hash_algorithm=hash_algorithm)
+        resources.callback(journal.close)
+
+        watcher = wt.Watcher(
+            base_dir,
+            filter_regex,
+            extensions,
+            excludes,
+            quiet_period=quiet_period,
+            poll_interval=poll_interval,
+            use_inotify=inotify,
+        )
+
+        stages: List[Union[engine.Stage, engine.BarrierStage]] = [
+            _analysis_stage(
+                resources,
+                executor,
+                workers,
+                queue_size,
+                exif_budget_kb * 1024,
+                sources,
+                hash_algorithm,
+                # Only the content index has a use for hashes here.
+                hash_files=skip_existing,
+                budget=budget,
+                cancelled=cancelled,
+            ),
+            engine.Stage(
+                "plan",
+                partial(generate_move_path, storage_dir=str(storage_dir)),
+                queue_size=queue_size,
+            ),
+            engine.Stage(
+                "migrate",
+                partial(
+                    migrate,
+                    copy_only=copy_only,
+                    planner=fo.NamePlanner(),
+                    index=content_index,
+                    journal=journal,
+                ),
+                workers=move_workers,
+                queue_size=queue_size,
+            ),
+        ]
+
+        typer.echo(f"Watching {base_dir} for new files.", err=True)
+        try:
+            _run_pipeline(
+                stages,
+                watcher.watch(cancelled),
+                partial(report_watched, copy_only=copy_only, watcher=watcher),
+                failed_results,
+                budget,
+                cancelled,
+                progress,
+                metrics_interval,
+                metrics_json,
+                metrics_prometheus,
+            )
+
+        except KeyboardInterrupt:
+            typer.echo("Stopped watching.", err=True)
+
+    _report_cross_checks(sources)
+    _report_failures(failed_results)
+
+
+@app.command()
+def plan(
+        plan_path: Path = typer.Argument(...),
+        base_dir: Path = Path(),
+        storage_dir: Optional[Path] = None,
+        shard: str = str(pl.WHOLE_TREE),
+        shard_by: pl.ShardKey = pl.ShardKey.directory,
+        filter_regex: str = r".*(?:jpg|JPG|JPEG|jpeg)$",
+        ext: Optional[str] = None,
+        exclude: Optional[List[str]] = None,
+        cache: bool = True,
+        cache_path: Optional[Path] = None,
+        cache_max_entries: int = sc.DEFAULT_MAX_ENTRIES,
+        exif_budget_kb: int = fl.HEADER_SIZE // 1024,
+        date_sources: str = ",".join(dsrc.DEFAULT_DATE_SOURCES),
+        verify_sample: float = 0.0,
+        hash_algorithm: fl.HashAlgorithm = typer.Option(fl.DEFAULT_HASH_ALGORITHM, "--hash"),
+        workers: Optional[int] = None,
+        executor: ex.ExecutorKind = ex.ExecutorKind.thread,
+        scan_workers: int = 4,
+        queue_size: int = engine.DEFAULT_QUEUE_SIZE,
+        max_inflight_bytes: Optional[str] = None,
+        progress: bool = True,
+        metrics_interval: float = mt.DEFAULT_INTERVAL,
+        metrics_json: Optional[Path] = None,
+        metrics_prometheus: Optional[Path] = None,
+) -> None:
+    """Plan where each file of base_dir, or of one shard of it, is to be placed.
+
+    Nothing is moved, the planned placement of each file is written to
+    plan_path, for the plans of every shard to be combined with merge, and
+    then carried out with apply.  Shards can be planned at the same time, by
+    separate processes on one host, or on several hosts mounting the same
+    tree, with nothing coordinating them.  Every file is hashed, so that
+    merge can find duplicates across shards, and every shard must use the
+    same hash algorithm.  Every other option is as for the main command, see
+    organiser --help.
+
+    Arguments:
+        plan_path: The file to write the plan to.  It is only written once
+            the whole shard is planned.
+
+        base_dir: The directory from which to recursively search for image
+            files.
+
+        storage_dir: The location from which the application should create the
+            archive of organised files, defaults to base_dir.
+
+        shard: The part of base_dir to plan, as number/total, e.g. 2/4 for
+            the second of four shards.  Plan every number from 1 to total.
+
+        shard_by: Whether files are split between shards by their top level
+            directory within base_dir, keeping each album within a single
+            shard, and only walking the directories of the shard, or by their
+            whole path, evening out shards when a few directories hold most of
+            the files.
+
+    """
+    if storage_dir is None:
+        storage_dir = base_dir
+
+    filter_regex, extensions, excludes = _filters(ext, exclude, filter_regex)
+
+    try:
+        planned_shard = pl.parse_shard(shard)
+    except ValueError as err:
+        raise typer.BadParameter(str(err), param_hint="--shard") from err
+
+    sources, budget = _analysis_options(
+        date_sources,
+        hash_algorithm,
+        verify_sample,
+        max_inflight_bytes,
     )
-    #  hashed_files = generate_file_metadata(file_listing)
-    #  files_with_metadata = generate_image_metadata(hashed_files)
+    cancelled = Event()
 
-    files_with_move_path = generate_move_path(enriched_files, storage_dir).pipe(
-        operators.filter(failed_record_filter),
+    header = pl.PlanHeader(
+        base_dir=os.path.abspath(base_dir),
+        storage_dir=os.path.abspath(storage_dir),
+        hash_algorithm=hash_algorithm.value,
+        shard=str(planned_shard),
+        shard_by=shard_by.value,
     )
 
-    if dry_run:
-        files_with_move_path.subscribe(
-            on_next=dry_run_print,
-            on_error=lambda err: handle_error(err, operation_failed),
-            on_completed=operation_complete.set,
+    failed_results: List[FailedTarget] = []
+    with ExitStack() as resources:
+        scan_cache: Optional[sc.ScanCache] = None
+        if cache:
+            scan_cache = sc.ScanCache(
+                cache_path or sc.default_cache_path(),
+                max_entries=cache_max_entries,
+                hash_algorithm=hash_algorithm,
+            )
+            resources.callback(scan_cache.close)
+
+        stages: List[Union[engine.Stage, engine.BarrierStage]] = []
+
+        if scan_cache is not None:
+            stages.append(
+                engine.Stage(
+                    "scan",
+                    partial(fill_from_cache, cache=scan_cache),
+                    workers=scan_workers,
+                    queue_size=queue_size,
+                ),
+            )
+
+        stages.append(
+            _analysis_stage(
+                resources,
+                executor,
+                workers,
+                queue_size,
+                exif_budget_kb * 1024,
+                sources,
+                hash_algorithm,
+                budget=budget,
+                cancelled=cancelled,
+            ),
         )
 
-        file_listing_shared.connect()
+        if scan_cache is not None:
+            stages.append(
+                engine.Stage(
+                    "record",
+                    partial(store_in_cache, cache=scan_cache),
+                    queue_size=queue_size,
+                ),
+            )
 
-        while not any((operation_complete.is_set(), operation_failed.is_set())):
-            typer.echo("Waiting for processing to complete.", err=True)
-            sleep(1)
+        stages.append(
+            engine.Stage(
+                "plan",
+                partial(generate_move_path, storage_dir=str(storage_dir)),
+                queue_size=queue_size,
+            ),
+        )
 
-        typer.echo(f"Encountered {len(failed_results)} Records that failed to process:")
-        for fail in failed_results:
-            typer.secho(fail, fg=typer.colors.RED)
+        source = pl.sharded_listing(
+            base_dir,
+            planned_shard,
+            shard_by,
+            filter_regex,
+            extensions,
+            excludes,
+        )
 
-        typer.echo("Operation completed.")
+        with pl.PlanWriter(plan_path, header) as writer:
+            _run_pipeline(
+                stages,
+                source,
+                writer.add,
+                failed_results,
+                budget,
+                cancelled,
+                progress,
+                metrics_interval,
+                metrics_json,
+                metrics_prometheus,
+            )
 
-        return
+            if cancelled.is_set():
+                typer.secho("Planning was cancelled, no plan was written.", fg=typer.colors.RED)
+                raise typer.Exit(1)
 
-    moved_files = files_with_move_path.pipe(
-        operators.map(lambda target: fo.migrate_file_target(target, copy_only)),
-        operators.filter(failed_record_filter),
-        operators.map(fo.clear_empty_directories),
-        operators.filter(failed_record_filter),
-    )
+    typer.echo(f"Planned {writer.entries} files of shard {planned_shard} into {plan_path}.")
 
-    moved_files.subscribe(
-        on_next=lambda target: typer.echo(
-            f"{'Copied' if copy_only else 'Moved'} "
-            f"{target.file_path} to {target.target_move_path}.",
-        ),
-        on_error=lambda err: handle_error(err, operation_complete),
-        on_completed=operation_complete.set,
+    _report_cross_checks(sources)
+    _report_failures(failed_results)
+
+
+@app.command()
+def merge(
+        plan_paths: List[Path] = typer.Argument(...),
+        output: Path = typer.Option(...),
+        dedup: bool = True,
+) -> None:
+    """Merge the plans of every shard into a single plan, to be carried out with apply.
+
+    Merging needs nothing but the plans, so can be done on any host.
+
+    Arguments:
+        plan_paths: The plans to merge, one for each shard.
+
+        output: The file to write the merged plan to.
+
+        dedup: Keep only the first, in order of their paths, of the files
+            which are byte-identical to each other, whichever shards they
+            were planned in.  Use --no-dedup to place every file.
+
+    """
+    try:
+        report = pl.merge_plans(plan_paths, output, dedup)
+    except (OSError, ValueError) as err:
+        raise typer.BadParameter(str(err), param_hint="PLAN_PATHS") from err
+
+    if report.missing_shards:
+        typer.secho(
+            f"No plans were given for shards {', '.join(map(str, report.missing_shards))}, "
+            f"their files will not be placed.",
+            fg=typer.colors.YELLOW,
+            err=True,
+        )
+
+    typer.echo(
+        f"Merged {report.planned} files into {output}, dropping {report.duplicates} "
+        f"duplicates, and renaming {report.renamed} which shared a destination.",
     )
 
-    file_listing_shared.connect()
 
-    while not any((operation_complete.is_set(), operation_failed.is_set())):
-        typer.echo("Waiting for processing to complete.", err=True)
-        sleep(1)
+@app.command()
+def apply(
+        plan_path: Path = typer.Argument(...),
+        base_dir: Optional[Path] = None,
+        storage_dir: Optional[Path] = None,
+        copy_only: bool = False,
+        replan: bool = True,
+        exif_budget_kb: int = fl.HEADER_SIZE // 1024,
+        date_sources: str = ",".join(dsrc.DEFAULT_DATE_SOURCES),
+        check_workers: int = 16,
+        move_workers: int = 16,
+        queue_size: int = engine.DEFAULT_QUEUE_SIZE,
+        resume: bool = False,
+        progress: bool = True,
+        metrics_interval: float = mt.DEFAULT_INTERVAL,
+        metrics_json: Optional[Path] = None,
+        metrics_prometheus: Optional[Path] = None,
+) -> None:
+    """Carry out a plan, placing each of its files without walking or reading any of them.
+
+    Each file is only stat'ed, to check it is as it was when planned.  Files
+    removed since are skipped, and those which changed are planned afresh,
+    using exif_budget_kb and date_sources.  Names are still checked against
+    storage_dir as files are placed, so a file is never overwritten, and
+    placements are journaled, as a run of organiser would.  Placing files
+    needs no reading of them, so by default many more move_workers are used,
+    particularly suiting network file systems.  Every other option is as for
+    the main command, see organiser --help.
+
+    Arguments:
+        plan_path: The plan to carry out, as written by a dry run, or by
+            merge.
+
+        base_dir: Where the tree the plan was made of is mounted, defaults to
+            where it was when planned.
+
+        storage_dir: Where the files are to be placed, defaults to where they
+            were planned to be placed.
+
+        replan: Read, hash and date files which changed since they were
+            planned, to plan them afresh.  Use --no-replan to skip them.
+
+        check_workers: The number of threads checking files are unchanged
+            since they were planned, this is mostly waiting on stat calls.
+
+    """
+    header = _read_plan_header(plan_path)
+    base_dir = base_dir or Path(header.base_dir)
+    storage_dir = storage_dir or Path(header.storage_dir)
+    hash_algorithm = fl.HashAlgorithm(header.hash_algorithm)
+
+    sources, _ = _analysis_options(date_sources, hash_algorithm)
+
+    failed_results: List[FailedTarget] = []
+    with ExitStack() as resources:
+        journal = _open_journal(storage_dir, resume, hash_algorithm)
+        resources.callback(journal.close)
+
+        analysis_pool = ex.make_executor(ex.ExecutorKind.thread, check_workers)
+        resources.callback(analysis_pool.shutdown, cancel_futures=True)
+
+        vacated = fo.VacatedDirectories(base_dir)
+
+        stages: List[Union[engine.Stage, engine.BarrierStage]] = []
+
+        if resume:
+            stages.append(
+                engine.Stage(
+                    "resume",
+                    partial(skip_completed, journal=journal),
+                    workers=check_workers,
+                    queue_size=queue_size,
+                ),
+            )
+
+        replan_changed: Optional[Callable[[FileTarget], FileTarget]] = None
+        if replan:
+            replan_changed = partial(
+                replan_target,
+                executor=analysis_pool,
+                storage_dir=str(storage_dir),
+                header_size=exif_budget_kb * 1024,
+                sources=sources,
+                hash_algorithm=hash_algorithm,
+            )
+
+        stages.append(
+            engine.Stage(
+                "check",
+                partial(check_planned, replan=replan_changed),
+                workers=check_workers,
+                queue_size=queue_size,
+            ),
+        )
+
+        stages.append(
+            engine.Stage(
+                "migrate",
+                partial(
+                    migrate,
+                    copy_only=copy_only,
+                    planner=fo.NamePlanner(),
+                    vacated=vacated,
+                    journal=journal,
+                ),
+                workers=move_workers,
+                queue_size=queue_size,
+            ),
+        )
+
+        source = (
+            pl.PlannedTarget(entry, str(base_dir), str(storage_dir))
+            for entry in pl.read_entries(plan_path)
+        )
+
+        _run_pipeline(
+            stages,
+            source,
+            partial(report_migrated, copy_only=copy_only),
+            failed_results,
+            progress=progress,
+            metrics_interval=metrics_interval,
+            metrics_json=metrics_json,
+            metrics_prometheus=metrics_prometheus,
+        )
+
+        vacated.sweep()
 
     typer.echo("Operation completed.")
 
-    typer.echo(f"Encountered {len(failed_results)} Records that failed to process:")
-    for fail in failed_results:
-        typer.secho(fail, fg=typer.colors.RED)
+    _report_cross_checks(sources)
+    _report_failures(failed_results)
 
 
 def entrypoint() -> None:
     """Typer launchpoint."""
-    typer.run(main)
+    app()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,460 @@
+"""Instrumentation of pipeline stages, and periodic reporting of it.
+
+Each stage of a pipeline counts the items it receives, the bytes of the files
+they refer to, how each item left the stage (emitted, dropped or failed), how
+many it is currently holding, and a histogram of how long the stage function
+took.  Alongside the depth of each stage's input queue, this shows which
+stage is the bottleneck: the queue before it stays full, and those after it
+stay empty.  Where the readers are limited to a budget of bytes in flight,
+its current and peak usage are reported too.
+
+Recording an item costs a couple of clock reads and an uncontended lock, which
+is negligible against reading a file, so metrics are always collected.  A
+MetricsReporter periodically prints a progress line, and optionally appends a
+JSON line to a file, or rewrites a Prometheus textfile, for node_exporter's
+textfile collector to pick up.
+"""
+
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, TextIO, Tuple, TypedDict, Union
+
+import typer
+
+from organiser.budget import BudgetSnapshot, ByteBudget
+from organiser.types import FailedTarget, FileTarget
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5.0
+
+# Upper bounds, in seconds, of the latency histogram buckets, beyond which is +Inf.
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+PROMETHEUS_PREFIX = "organiser"
+
+# Kind and description of the series exported for every stage, by key of StageSnapshot.
+STAGE_SERIES = {
+    "bytes": ("counter", "Bytes of the files each stage received."),
+    "in_flight": ("gauge", "Items each stage is currently working on, or holding."),
+    "queued": ("gauge", "Items waiting for each stage."),
+}
+
+# Name suffix, kind and description of the series exported for a ByteBudget, by key of its snapshot.
+BUDGET_SERIES = {
+    "current": ("", "gauge", "Bytes of the files currently being read."),
+    "peak": ("_peak", "gauge", "Most bytes of files ever being read at once."),
+    "limit": ("_limit", "gauge", "Bytes of files which may be read at once."),
+    "waiting": ("_waiting", "gauge", "Files waiting for room in the budget."),
+    "oversized": ("_oversized_total", "counter", "Files larger than the budget."),
+}
+
+
+class LatencySnapshot(TypedDict):
+    """Summary of a stage's latency histogram, in seconds."""
+
+    count: int
+    sum: float
+    p50: float
+    p95: float
+    max: float
+    buckets: Dict[str, int]
+
+
+class StageSnapshot(TypedDict):
+    """The metrics of a single stage, see StageMetrics.snapshot."""
+
+    received: int
+    emitted: int
+    dropped: int
+    failed: int
+    bytes: int
+    in_flight: int
+    queued: int
+    latency_seconds: LatencySnapshot
+
+
+class _PipelineSnapshot(TypedDict):
+    time: float
+    elapsed: float
+    walked: int
+    walk_finished: bool
+    completed: int
+    finished: int
+    sink_queued: int
+    stages: Dict[str, StageSnapshot]
+
+
+class Snapshot(_PipelineSnapshot, total=False):
+    """The metrics of a pipeline, see PipelineMetrics.snapshot and MetricsReporter.report."""
+
+    # Only where the pipeline's readers are limited to a budget.
+    inflight_bytes: BudgetSnapshot
+    # Added by MetricsReporter.report.
+    files_per_second: float
+    eta_seconds: Optional[float]
+
+
+class Histogram:
+    """Latencies counted into fixed buckets, as Prometheus histograms are.
+
+    Not thread safe by itself, callers hold the lock of the owning StageMetrics.
+    """
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Count one latency of seconds."""
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def cumulative(self) -> List[int]:
+        """Return the number of observations at or below each bound, ending with +Inf."""
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+
+        return cumulative
+
+    def buckets(self) -> Dict[str, int]:
+        """Return the cumulative counts keyed on the bucket bounds, as Prometheus labels them."""
+        bounds = [str(bound) for bound in self.bounds] + ["+Inf"]
+        return dict(zip(bounds, self.cumulative()))
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile, as the upper bound of the bucket it falls within."""
+        if not self.count:
+            return 0.0
+
+        for bound, total in zip(self.bounds, self.cumulative()):
+            if total >= fraction * self.count:
+                return min(bound, self.max)
+
+        return self.max
+
+
+class StageMetrics:
+    """Counters and latencies of a single pipeline stage, safe to share between its workers."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.received = 0
+        self.emitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.latency = Histogram()
+
+        self._lock = Lock()
+
+    def started(self, target: FileTarget) -> float:
+        """Record that the stage took target, returning the time to pass to finished."""
+        size = target.file_stat.st_size if target.file_stat is not None else 0
+        with self._lock:
+            self.received += 1
+            self.in_flight += 1
+            self.bytes += size
+
+        return time.perf_counter()
+
+    def finished(
+            self,
+            started: float,
+            result: Union[FileTarget, FailedTarget, None],
+    ) -> None:
+        """Record that the stage finished with an item it started at started."""
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            self.latency.observe(elapsed)
+
+            if result is None:
+                self.dropped += 1
+            elif isinstance(result, FailedTarget):
+                self.failed += 1
+            else:
+                self.emitted += 1
+
+    def snapshot(self, queued: int) -> StageSnapshot:
+        """Return the current values, along with the number of items queued for the stage."""
+        with self._lock:
+            return {
+                "received": self.received,
+                "emitted": self.emitted,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "in_flight": self.in_flight,
+                "queued": queued,
+                "latency_seconds": {
+                    "count": self.latency.count,
+                    "sum": self.latency.sum,
+                    "p50": self.latency.quantile(0.5),
+                    "p95": self.latency.quantile(0.95),
+                    "max": self.latency.max,
+                    "buckets": self.latency.buckets(),
+                },
+            }
+
+
+class PipelineMetrics:
+    """Metrics of every stage of a pipeline, and of the walk feeding it and the sink draining it.
+
+    The walk and the sink each run on a single thread, so their counters
+    need no lock.
+    """
+
+    def __init__(self, stage_names: List[str], budget: Optional[ByteBudget] = None) -> None:
+        self.started_at = time.monotonic()
+        self.stages = [StageMetrics(name) for name in stage_names]
+        self.budget = budget
+
+        self.walked = 0
+        self.walk_finished = False
+        self.completed = 0
+
+    def finished_items(self) -> int:
+        """Return the number of walked items which were completed, dropped or failed."""
+        return self.completed + sum(stage.dropped + stage.failed for stage in self.stages)
+
+    def snapshot(self, queue_depths: List[int]) -> Snapshot:
+        """Return every metric, given the depth of each stage's queue and the sink's."""
+        snapshot: Snapshot = {
+            "time": time.time(),
+            "elapsed": time.monotonic() - self.started_at,
+            "walked": self.walked,
+            "walk_finished": self.walk_finished,
+            "completed": self.completed,
+            "finished": self.finished_items(),
+            "sink_queued": queue_depths[-1],
+            "stages": {
+                stage.name: stage.snapshot(queued)
+                for stage, queued in zip(self.stages, queue_depths)
+            },
+        }
+
+        if self.budget is not None:
+            snapshot["inflight_bytes"] = self.budget.snapshot()
+
+        return snapshot
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def to_prometheus(snapshot: Snapshot) -> str:
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, description: str) -> str:
+        name = f"{PROMETHEUS_PREFIX}_{name}"
+        lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {kind}"])
+        return name
+
+    for counter, description, count in (
+            ("walked", "Files found by the walk.", snapshot["walked"]),
+            ("completed", "Files which made it through every stage.", snapshot["completed"]),
+    ):
+        lines.append(f"{metric(f'{counter}_total', 'counter', description)} {count}")
+
+    name = metric("walk_finished", "gauge", "Whether the walk has found every file.")
+    lines.append(f"{name} {int(bool(snapshot['walk_finished']))}")
+
+    stages = snapshot["stages"]
+
+    name = metric("stage_items_total", "counter", "Items leaving each stage, by outcome.")
+    for stage, values in stages.items():
+        for outcome in ("emitted", "dropped", "failed"):
+            lines.append(f"{name}{{{_labels(stage=stage, outcome=outcome)}}} {values[outcome]}")
+
+    for series in ("bytes", "in_flight", "queued"):
+        kind, description = STAGE_SERIES[series]
+        suffix = "_total" if kind == "counter" else ""
+        name = metric(f"stage_{series}{suffix}", kind, description)
+        for stage, values in stages.items():
+            lines.append(f"{name}{{{_labels(stage=stage)}}} {values[series]}")
+
+    name = metric("stage_latency_seconds", "histogram", "Time each stage spent on an item.")
+    for stage, values in stages.items():
+        latency = values["latency_seconds"]
+        for bound, total in latency["buckets"].items():
+            lines.append(f"{name}_bucket{{{_labels(stage=stage, le=bound)}}} {total}")
+
+        lines.append(f"{name}_sum{{{_labels(stage=stage)}}} {latency['sum']}")
+        lines.append(f"{name}_count{{{_labels(stage=stage)}}} {latency['count']}")
+
+    inflight = snapshot.get("inflight_bytes")
+    if inflight is not None:
+        for key in ("current", "peak", "limit", "waiting", "oversized"):
+            suffix, kind, description = BUDGET_SERIES[key]
+            lines.append(f"{metric(f'inflight_bytes{suffix}', kind, description)} {inflight[key]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path, content: str) -> None:
+    """Replace path with content atomically, so collectors never read a partial file."""
+    partial_path = path.with_name(f".{path.name}.tmp")
+    partial_path.write_text(content)
+    os.replace(partial_path, path)
+
+
+def _format_bytes(count: int) -> str:
+    return f"{count / (1 << 20):.1f}MiB"
+
+
+def _format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "unknown"
+
+    return str(timedelta(seconds=round(seconds)))
+
+
+class MetricsReporter:
+    """Report the metrics of a pipeline every interval seconds, whilst it runs.
+
+    Use as a context manager around running the pipeline, a final report is
+    made on leaving it.
+
+    The progress line gives the rate items are finishing at over the last
+    interval, and once the walk has found every file, an estimate of the time
+    remaining.  Stages are listed with the items queued for, and held by,
+    each, so a bottleneck shows up as a stage with a full queue.
+    """
+
+    def __init__(
+            self,
+            metrics: PipelineMetrics,
+            queue_depths: Callable[[], List[int]],
+            interval: float = DEFAULT_INTERVAL,
+            json_path: Optional[Path] = None,
+            prometheus_path: Optional[Path] = None,
+            progress: bool = True,
+    ) -> None:
+        self.metrics = metrics
+        self.queue_depths = queue_depths
+        self.interval = interval
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.progress = progress
+
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="metrics", daemon=True)
+        self._json_file: Optional[TextIO] = None
+
+        self._last_time = self.metrics.started_at
+        self._last_finished = 0
+
+    def __enter__(self) -> "MetricsReporter":
+        if self.json_path is not None:
+            self._json_file = open(self.json_path, "a", encoding="utf-8")
+
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._try_report(final=True)
+
+        if self._json_file is not None:
+            self._json_file.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._try_report()
+
+    def _try_report(self, final: bool = False) -> None:
+        """Report, logging rather than raising should a destination not be writable."""
+        try:
+            self.report(final)
+        except OSError as err:
+            LOG.warning("Unable to report metrics: %s", err)
+
+    def _rate(self, snapshot: Snapshot) -> float:
+        """Return the number of items finished per second since the previous report."""
+        now = time.monotonic()
+        finished = snapshot["finished"]
+
+        elapsed = now - self._last_time
+        rate = (finished - self._last_finished) / elapsed if elapsed > 0 else 0.0
+        self._last_time, self._last_finished = now, finished
+
+        return rate
+
+    def report(self, final: bool = False) -> Snapshot:
+        """Take a snapshot of the metrics, and report it to each configured destination."""
+        snapshot = self.metrics.snapshot(self.queue_depths())
+
+        elapsed = snapshot["elapsed"]
+        finished = snapshot["finished"]
+        walked = snapshot["walked"]
+
+        rate = finished / elapsed if final and elapsed > 0 else self._rate(snapshot)
+
+        eta: Optional[float] = None
+        if snapshot["walk_finished"] and rate > 0:
+            eta = (walked - finished) / rate
+
+        snapshot["files_per_second"] = rate
+        snapshot["eta_seconds"] = eta
+
+        if self._json_file is not None:
+            self._json_file.write(json.dumps(snapshot) + "\n")
+            self._json_file.flush()
+
+        if self.prometheus_path is not None:
+            write_textfile(self.prometheus_path, to_prometheus(snapshot))
+
+        if self.progress:
+            typer.echo(progress_line(snapshot), err=True)
+
+        return snapshot
+
+
+def progress_line(snapshot: Snapshot) -> str:
+    """Summarise a reported snapshot in a single line."""
+    stages = snapshot["stages"]
+
+    total = f"{snapshot['walked']}{'' if snapshot['walk_finished'] else '+'}"
+    eta = snapshot["eta_seconds"]
+
+    busy = ", ".join(
+        f"{stage} {values['queued']}/{values['in_flight']}"
+        for stage, values in stages.items()
+    )
+
+    line = (
+        f"Processed {snapshot['finished']} of {total} files "
+        f"({snapshot['files_per_second']:.1f} files/s, ETA {_format_eta(eta)}) "
+        f"-- queued/in flight: {busy}"
+    )
+
+    inflight = snapshot.get("inflight_bytes")
+    if inflight is not None:
+        line += (
+            f" -- reading {_format_bytes(inflight['current'])} of "
+            f"{_format_bytes(inflight['limit'])}, peak {_format_bytes(inflight['peak'])}"
+        )
+
+    return line
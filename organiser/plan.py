@@ -0,0 +1,413 @@
+"""Plans of where each file is to be placed, which can be sharded, merged and then applied.
+
+A large tree is planned in shards, each by its own process, on one host or
+several, with nothing coordinating them.  Each file belongs to exactly one
+of N shards, decided by a CRC32 of its top level directory, or of its path,
+relative to base_dir, so every planner agrees on the split without talking
+to the others.  Sharding by directory keeps albums within a single shard,
+and lets each planner walk only its own directories.
+
+A plan is a manifest of JSON lines: a header, recording the directories and
+the hash algorithm the plan was made with, followed by an entry per file, as
+a compact list of its fields.  Paths are held relative to the directories
+of the header, so plans made on hosts mounting the tree in different places
+can be merged, and applied on any of them.
+
+Merging combines the plans of every shard, dropping files whose content
+duplicates that of another, and renaming files planned to the same
+destination, so that the merged plan can be applied by a single run.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import zlib
+from enum import Enum
+from pathlib import Path
+from typing import (
+    IO,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from organiser import file_listing as fl
+from organiser import file_ops as fo
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+# Bump this whenever the header or the fields of an entry change.
+PLAN_VERSION = 1
+
+SHARD_PATTERN = re.compile(r"(?P<number>\d+)\s*/\s*(?P<total>\d+)")
+
+
+class ShardKey(str, Enum):
+    """What decides the shard a file belongs to."""
+
+    directory = "directory"
+    path = "path"
+
+
+class Shard(NamedTuple):
+    """Shard number of total shards of a tree, numbered from 1."""
+
+    number: int
+    total: int
+
+    def __str__(self) -> str:
+        return f"{self.number}/{self.total}"
+
+    def owns(self, relative_path: str, key: ShardKey = ShardKey.directory) -> bool:
+        """Check whether the file at relative_path, from base_dir, belongs to this shard.
+
+        Sharding by directory, files at the top of base_dir are sharded by their name.
+        """
+        if self.total == 1:
+            return True
+
+        if key is ShardKey.directory:
+            relative_path = relative_path.split(os.sep, 1)[0]
+
+        checksum = zlib.crc32(relative_path.encode("utf-8", "surrogateescape"))
+        return checksum % self.total == self.number - 1
+
+
+WHOLE_TREE = Shard(1, 1)
+
+
+def parse_shard(shard: str) -> Shard:
+    """Parse a shard given as number/total, e.g. 2/4 for the second of four shards.
+
+    Raises ValueError if shard can't be parsed, or doesn't exist.
+    """
+    shard_match = SHARD_PATTERN.fullmatch(shard.strip())
+    if not shard_match:
+        raise ValueError(f"Unable to parse {shard!r} as a shard, e.g. 2/4.")
+
+    parsed = Shard(int(shard_match.group("number")), int(shard_match.group("total")))
+    if not 1 <= parsed.number <= parsed.total:
+        raise ValueError(f"Shard {parsed} doesn't exist, they are numbered from 1.")
+
+    return parsed
+
+
+def sharded_listing(
+        base_dir: Union[str, Path],
+        shard: Shard = WHOLE_TREE,
+        key: ShardKey = ShardKey.directory,
+        filename_filter: Optional[str] = None,
+        extensions: Optional[FrozenSet[str]] = None,
+        excludes: Iterable[str] = fl.DEFAULT_EXCLUDES,
+) -> Iterator[FileTarget]:
+    """Yield FileTargets for the files of shard within base_dir, see file_listing_iterator.
+
+    Sharding by directory, only the top level directories of the shard are walked.
+    """
+    if shard.total == 1 or key is ShardKey.path:
+        for target in fl.file_listing_iterator(base_dir, filename_filter, extensions, excludes):
+            if shard.owns(os.path.relpath(target.file_path, base_dir), key):
+                yield target
+
+        return
+
+    top_level = os.path.relpath(os.path.abspath(base_dir), os.path.curdir)
+    try:
+        sub_dirs, files = fl.list_directory(
+            top_level,
+            fl.compile_filename_filter(filename_filter),
+            extensions,
+            fl.compile_excludes(excludes),
+        )
+    except OSError as err:
+        LOG.warning("Unable to list %s: %s", top_level, err)
+        return
+
+    for file_path, file_stat in files:
+        if shard.owns(os.path.basename(file_path), key):
+            yield FileTarget(file_path, file_stat=file_stat)
+
+    for sub_dir in sub_dirs:
+        if shard.owns(os.path.basename(sub_dir), key):
+            yield from fl.file_listing_iterator(sub_dir, filename_filter, extensions, excludes)
+
+
+class PlanHeader(NamedTuple):
+    """How, and from where to where, a plan was made."""
+
+    base_dir: str
+    storage_dir: str
+    hash_algorithm: str = fl.DEFAULT_HASH_ALGORITHM.value
+    shard: str = str(WHOLE_TREE)
+    shard_by: str = ShardKey.directory.value
+
+
+class PlanEntry(NamedTuple):
+    """The planned placement of a single file, as recorded in a plan."""
+
+    # Relative to the base_dir of the plan.
+    source: str
+    # Relative to the storage_dir of the plan.
+    target: str
+    size: int
+    mtime_ns: int
+    encoded_hash: Optional[str]
+    datestamp: Optional[str]
+    date_source: Optional[str]
+
+
+class MergeReport(NamedTuple):
+    """The outcome of merging the plans of several shards."""
+
+    planned: int
+    duplicates: int
+    renamed: int
+    missing_shards: Tuple[int, ...]
+
+
+def entry_from_target(target: FileTarget, header: PlanHeader) -> PlanEntry:
+    """Record the planned placement of target, relative to the directories of header."""
+    stat = fl.stat_target(target)
+    datestamp = target.datestamp
+
+    return PlanEntry(
+        source=os.path.relpath(os.path.abspath(target.file_path), header.base_dir),
+        target=os.path.relpath(os.path.abspath(target.target_move_path), header.storage_dir),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        encoded_hash=target.encoded_hash,
+        datestamp=datestamp.isoformat() if datestamp is not None else None,
+        date_source=target.date_source,
+    )
+
+
+class PlannedTarget(FileTarget):
+    """A FileTarget read from a plan, holding the entry it was read from.
+
+    The file is taken from base_dir, and placed into storage_dir, which may
+    differ from the directories the plan was made with.
+    """
+
+    __slots__ = ("entry",)
+
+    def __init__(self, entry: PlanEntry, base_dir: str, storage_dir: str) -> None:
+        super().__init__(
+            os.path.join(base_dir, entry.source),
+            file_hash=base64.b64decode(entry.encoded_hash) if entry.encoded_hash else None,
+            target_move_path=os.path.join(storage_dir, entry.target),
+        )
+        self.date_source = entry.date_source
+        self.entry = entry
+
+
+def changed_since_planned(target: PlannedTarget) -> bool:
+    """Check whether target's file was modified since it was planned, by its size and mtime.
+
+    Raises FileNotFoundError if the file was removed.
+    """
+    stat = fl.stat_target(target)
+    return (stat.st_size, stat.st_mtime_ns) != (target.entry.size, target.entry.mtime_ns)
+
+
+def in_place(entry: PlanEntry, header: PlanHeader) -> bool:
+    """Check whether entry is planned to stay where it already is."""
+    source = os.path.join(header.base_dir, entry.source)
+    return os.path.normpath(source) == os.path.normpath(
+        os.path.join(header.storage_dir, entry.target),
+    )
+
+
+class PlanWriter:
+    """Writes a plan, only replacing plan_path once every entry has been written.
+
+    A plan is never left partially written, e.g. by its planner being
+    killed, as it is written to a temporary file, and renamed over plan_path
+    when closed.  Leaving the context manager with an exception discards it,
+    otherwise closes it, unless it was already closed or discarded.
+    Not thread safe, write entries from a single thread, e.g. a pipeline's sink.
+    """
+
+    def __init__(self, plan_path: Path, header: PlanHeader) -> None:
+        self.plan_path = plan_path
+        self.header = header
+        self.entries = 0
+
+        plan_path.parent.mkdir(parents=True, exist_ok=True)
+        self._partial_path = plan_path.with_name(f".{plan_path.name}.tmp")
+        self._file: IO[str] = open(self._partial_path, "w", encoding="utf-8")
+        self._file.write(json.dumps({"plan": PLAN_VERSION, **header._asdict()}) + "\n")
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], *_: object) -> None:
+        if self.closed:
+            return
+
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def closed(self) -> bool:
+        """Whether the plan was closed, or discarded."""
+        return self._file.closed
+
+    def write(self, entry: PlanEntry) -> None:
+        """Append entry to the plan."""
+        self._file.write(json.dumps(list(entry)) + "\n")
+        self.entries += 1
+
+    def add(self, target: FileTarget) -> None:
+        """Append the planned placement of target to the plan."""
+        self.write(entry_from_target(target, self.header))
+
+    def close(self) -> None:
+        """Sync the plan to disk, and move it into place."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._partial_path, self.plan_path)
+
+    def discard(self) -> None:
+        """Close and remove the partially written plan."""
+        self._file.close()
+        os.unlink(self._partial_path)
+
+
+def read_header(plan_path: Path) -> PlanHeader:
+    """Read the header of the plan at plan_path, raising ValueError if it isn't a plan."""
+    with open(plan_path, encoding="utf-8") as plan_file:
+        line = plan_file.readline()
+
+    try:
+        record = json.loads(line)
+        version = record.pop("plan")
+        header = PlanHeader(**record)
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f"{plan_path} is not a plan: {err}") from err
+
+    if version != PLAN_VERSION:
+        raise ValueError(f"{plan_path} is a version {version} plan, expected {PLAN_VERSION}.")
+
+    return header
+
+
+def read_entries(plan_path: Path) -> Iterator[PlanEntry]:
+    """Yield each entry of the plan at plan_path, raising ValueError for any unreadable entry."""
+    with open(plan_path, encoding="utf-8") as plan_file:
+        plan_file.readline()
+
+        for line_number, line in enumerate(plan_file, start=2):
+            try:
+                yield PlanEntry(*json.loads(line))
+            except (ValueError, TypeError) as err:
+                message = f"Entry {line_number} of {plan_path} is unreadable: {err}"
+                raise ValueError(message) from err
+
+
+def _merged_header(plan_paths: List[Path], headers: List[PlanHeader]) -> PlanHeader:
+    """Check the plans of plan_paths can be merged, returning the header of the merged plan.
+
+    Plans made with different directories are taken to be of the same tree,
+    mounted in different places, and merged into the directories of the first.
+    """
+    first = headers[0]
+    for plan_path, header in zip(plan_paths, headers):
+        if header.hash_algorithm != first.hash_algorithm:
+            raise ValueError(
+                f"{plan_path} was hashed with {header.hash_algorithm}, "
+                f"not {first.hash_algorithm}, so its duplicates can't be found.",
+            )
+
+        if header.shard_by != first.shard_by:
+            raise ValueError(f"{plan_path} was sharded by {header.shard_by}, not {first.shard_by}.")
+
+        if (header.base_dir, header.storage_dir) != (first.base_dir, first.storage_dir):
+            LOG.warning(
+                "%s was planned from %s to %s, it is merged as from %s to %s.",
+                plan_path,
+                header.base_dir,
+                header.storage_dir,
+                first.base_dir,
+                first.storage_dir,
+            )
+
+    return first._replace(shard=str(WHOLE_TREE))
+
+
+def _missing_shards(plan_paths: List[Path], headers: List[PlanHeader]) -> Tuple[int, ...]:
+    """Return the shards none of plan_paths are of, raising ValueError for any repeated shard."""
+    planned: Dict[int, Path] = {}
+    totals = set()
+    for plan_path, header in zip(plan_paths, headers):
+        try:
+            shard = parse_shard(header.shard)
+        except ValueError as err:
+            raise ValueError(f"{plan_path} has an invalid shard: {err}") from err
+
+        totals.add(shard.total)
+
+        if shard.number in planned:
+            raise ValueError(f"{plan_path} and {planned[shard.number]} are both of shard {shard}.")
+        planned[shard.number] = plan_path
+
+    if len(totals) > 1:
+        raise ValueError(f"Plans of {sorted(totals)} shards can't be merged with each other.")
+
+    return tuple(number for number in range(1, totals.pop() + 1) if number not in planned)
+
+
+def merge_plans(plan_paths: List[Path], output_path: Path, dedup: bool = True) -> MergeReport:
+    """Merge the plans of plan_paths, e.g. one per shard, into a single plan at output_path.
+
+    When dedup is set, only the first of the files sharing a hash, in order
+    of their paths, is kept.  Files planned to the same destination are given
+    a "(n)" suffix, as they would be when placed, except for any file already
+    in its place.  Entries are merged in order of their paths, so the merged
+    plan is the same whatever order plan_paths are given in.  Raises
+    ValueError if the plans can't be merged.
+    """
+    headers = [read_header(plan_path) for plan_path in plan_paths]
+    missing_shards = _missing_shards(plan_paths, headers)
+    header = _merged_header(plan_paths, headers)
+
+    entries = sorted(
+        (entry for plan_path in plan_paths for entry in read_entries(plan_path)),
+        # Files already in place keep their names, so take them before any other.
+        key=lambda entry: (not in_place(entry, header), entry.source),
+    )
+
+    originals: Dict[str, str] = {}
+    planner = fo.NamePlanner(list_existing=False)
+    duplicates = renamed = 0
+
+    with PlanWriter(output_path, header) as writer:
+        for entry in entries:
+            if dedup and entry.encoded_hash is not None:
+                original = originals.setdefault(entry.encoded_hash, entry.source)
+                if original != entry.source:
+                    LOG.info("Dropping %s, it is a duplicate of %s.", entry.source, original)
+                    duplicates += 1
+                    continue
+
+            planned = os.path.join(header.storage_dir, entry.target)
+            reserved = planner.reserve(planned)
+            if reserved != planned:
+                entry = entry._replace(target=os.path.relpath(reserved, header.storage_dir))
+                renamed += 1
+
+            writer.write(entry)
+
+    return MergeReport(writer.entries, duplicates, renamed, missing_shards)
@@ -0,0 +1,260 @@
+"""Persistent cache of per-file scan results, used to avoid re-reading unchanged files.
+
+Entries are keyed on the source path, and are only considered valid whilst the
+device, inode, size and modification time (in nanoseconds) of the file still
+match those recorded alongside the entry.  Any change to the file therefore
+invalidates its entry, which is replaced the next time the file is processed.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple, Optional, Tuple
+
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+# Bump this whenever the table layout or the meaning of a column changes, any
+# cache written with a different version is discarded on open.
+SCHEMA_VERSION = 2
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# Number of writes buffered before they are committed to disk.
+COMMIT_INTERVAL = 500
+
+
+class CacheKey(NamedTuple):
+    """Identity of a file on disk, any change to which invalidates cached results."""
+
+    path: str
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def from_stat(cls, path: str, stat: os.stat_result) -> "CacheKey":
+        """Build a CacheKey for path from an existing stat result."""
+        return cls(
+            path=os.path.abspath(path),
+            device=stat.st_dev,
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+
+def default_cache_path() -> Path:
+    """Return the default location of the scan cache, respecting XDG_CACHE_HOME."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"),
+        ".cache",
+    )
+
+    return Path(cache_home) / "organiser" / "scan_cache.sqlite3"
+
+
+class ScanCache:
+    """SQLite backed store of file hashes, EXIF date tags and datestamps.
+
+    Instances are safe to share between the worker threads of a pipeline, all
+    access to the underlying connection is serialised through a lock.
+    """
+
+    def __init__(
+            self,
+            cache_path: Path,
+            max_entries: int = DEFAULT_MAX_ENTRIES,
+            rebuild: bool = False,
+            require_hash: bool = True,
+            hash_algorithm: fl.HashAlgorithm = fl.DEFAULT_HASH_ALGORITHM,
+    ) -> None:
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+
+        # Entries recorded without a hash (e.g. by a dry run), or with the hash
+        # of another algorithm, only count as hits when the caller doesn't
+        # need the hash.
+        self.require_hash = require_hash
+        self.hash_algorithm = hash_algorithm
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._pending_writes = 0
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(cache_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            LOG.info("Rebuilding scan cache at %s.", cache_path)
+            self._connection.execute("DROP TABLE IF EXISTS scan_results")
+
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scan_results (
+                path TEXT PRIMARY KEY,
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                file_hash BLOB,
+                encoded_hash TEXT,
+                hash_algorithm TEXT,
+                date_tags TEXT NOT NULL,
+                datestamp TEXT,
+                last_seen REAL NOT NULL
+            )
+            """,
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS scan_results_last_seen ON scan_results (last_seen)",
+        )
+        self._connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._connection.commit()
+
+    def __enter__(self) -> "ScanCache":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _lookup(
+            self,
+            key: CacheKey,
+    ) -> Optional[Tuple[Optional[bytes], Optional[str], str, Optional[str]]]:
+        """Return the cached row for key, or None if missing or stale.
+
+        Hashes of any algorithm other than the cache's are returned as None.
+        """
+        row: Optional[Tuple[Optional[bytes], Optional[str], str, Optional[str]]]
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT CASE WHEN hash_algorithm = ? THEN file_hash END,"
+                "  encoded_hash, date_tags, datestamp FROM scan_results"
+                " WHERE path = ? AND device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (self.hash_algorithm.value, *key),
+            ).fetchone()
+
+            if row:
+                self._connection.execute(
+                    "UPDATE scan_results SET last_seen = ? WHERE path = ?",
+                    (time.time(), key.path),
+                )
+                self._record_write()
+
+        return row
+
+    def _record_write(self) -> None:
+        """Commit buffered writes once enough have accumulated.  Callers must hold the lock."""
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def fill(self, target: FileTarget) -> FileTarget:
+        """Populate target from the cache, setting FileTarget.from_cache on a hit.
+
+        Targets which can't be found, or whose entry is stale, are returned
+        unchanged so that later stages read and process the file as usual.
+        """
+        try:
+            key = CacheKey.from_stat(target.file_path, fl.stat_target(target))
+        except OSError as err:
+            LOG.warning("Unable to stat %s for cache lookup: %s", target.file_path, err)
+            return target
+
+        import pendulum  # pylint: disable=import-outside-toplevel
+
+        row = self._lookup(key)
+        datestamp = pendulum.parse(row[3]) if row and row[3] else None
+        missing_hash = self.require_hash and (not row or row[0] is None)
+        if not row or missing_hash or not isinstance(datestamp, pendulum.DateTime):
+            self.misses += 1
+            return target
+
+        file_hash, _, date_tags, _ = row
+
+        target.file_hash = file_hash
+        target.date_tags = json.loads(date_tags)
+        target.datestamp = datestamp
+        target.from_cache = True
+
+        self.hits += 1
+
+        return target
+
+    def store(self, target: FileTarget) -> FileTarget:
+        """Record the scan results of target, replacing any previous entry for its path."""
+        if target.from_cache or target.datestamp is None:
+            return target
+
+        try:
+            key = CacheKey.from_stat(target.file_path, fl.stat_target(target))
+        except OSError as err:
+            LOG.warning("Unable to stat %s for caching: %s", target.file_path, err)
+            return target
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO scan_results"
+                " (path, device, inode, size, mtime_ns, file_hash, encoded_hash, hash_algorithm,"
+                "  date_tags, datestamp, last_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *key,
+                    target.file_hash,
+                    target.encoded_hash,
+                    self.hash_algorithm.value if target.file_hash is not None else None,
+                    json.dumps(target.date_tags),
+                    target.datestamp.isoformat(),
+                    time.time(),
+                ),
+            )
+            self._record_write()
+
+        return target
+
+    def __len__(self) -> int:
+        with self._lock:
+            count: int = self._connection.execute(
+                "SELECT COUNT(*) FROM scan_results",
+            ).fetchone()[0]
+
+        return count
+
+    def trim(self) -> int:
+        """Evict the least recently seen entries beyond max_entries, returning the count removed."""
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM scan_results WHERE path IN ("
+                "  SELECT path FROM scan_results ORDER BY last_seen DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            ).rowcount
+            self._connection.commit()
+            self._pending_writes = 0
+
+        if removed:
+            LOG.info("Evicted %d entries from the scan cache.", removed)
+
+        return removed
+
+    def close(self) -> None:
+        """Flush pending writes, enforce the size cap and close the cache."""
+        self.trim()
+        LOG.info("Scan cache: %d hits, %d misses.", self.hits, self.misses)
+
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,186 @@
+"""Transfer of file contents into storage, using the cheapest primitive available.
+
+Moves within a single file system are a rename.  Copies attempt, in order:
+
+* A FICLONE reflink, which on copy-on-write file systems (Btrfs, XFS etc.)
+  shares the source's extents, making the copy a metadata only operation.
+* os.copy_file_range, which copies within the kernel, and which some file
+  systems (and NFS/SMB servers) offload entirely.
+* os.sendfile, which also avoids copying through user space buffers.
+* A plain buffered copy, which always works.
+
+Primitives which turn out to be unsupported between a pair of devices are
+remembered, so they are only attempted once per pair for the whole run.
+"""
+
+import errno
+import logging
+import os
+import shutil
+from enum import Enum
+from typing import Callable, Dict, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Not available on Windows.
+    fcntl = None  # type: ignore
+
+LOG = logging.getLogger(__name__)
+
+# From linux/fs.h, _IOW(0x94, 9, int).
+FICLONE = 0x40049409
+
+# Largest single copy_file_range/sendfile request, larger files take several.
+MAX_CHUNK = 1024 * 1024 * 1024
+
+# Errors indicating a primitive isn't supported for this pair of files, rather
+# than the copy itself having failed.
+UNSUPPORTED_ERRNOS = frozenset(
+    (
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTSUP,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.EPERM,
+        errno.EXDEV,
+    ),
+)
+
+
+class TransferMethod(str, Enum):
+    """The primitive used to place a file into storage."""
+
+    rename = "rename"
+    reflink = "reflink"
+    copy_file_range = "copy_file_range"
+    sendfile = "sendfile"
+    buffered = "buffered"
+
+
+# (method, source device, destination device) combinations known not to work.
+_UNSUPPORTED: Set[Tuple[TransferMethod, int, int]] = set()
+
+
+def _reflink(source_fd: int, destination_fd: int, _: int) -> None:
+    """Clone the extents of source_fd into destination_fd."""
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "FICLONE requires fcntl")
+
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copy size bytes from source_fd to destination_fd within the kernel."""
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        raise OSError(errno.ENOSYS, "os.copy_file_range is unavailable")
+
+    offset = 0
+    while offset < size:
+        copied: int = copy_file_range(
+            source_fd,
+            destination_fd,
+            min(MAX_CHUNK, size - offset),
+            offset,
+            offset,
+        )
+        if not copied:
+            if not offset:
+                # Some file systems (e.g. procfs, or FUSE) report success, without copying.
+                raise OSError(errno.ENOTSUP, "copy_file_range copied nothing")
+
+            raise OSError(errno.EIO, "copy_file_range copied nothing before the end of file")
+
+        offset += copied
+
+
+def _sendfile(source_fd: int, destination_fd: int, size: int) -> None:
+    """Copy size bytes from source_fd to destination_fd with sendfile."""
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(destination_fd, source_fd, offset, min(MAX_CHUNK, size - offset))
+        if not sent:
+            if not offset:
+                raise OSError(errno.ENOTSUP, "sendfile sent nothing")
+
+            raise OSError(errno.EIO, "sendfile sent nothing before the end of file")
+
+        offset += sent
+
+
+def _buffered(source_fd: int, destination_fd: int, _: int) -> None:
+    """Copy source_fd to destination_fd through a user space buffer."""
+    with open(source_fd, "rb", closefd=False) as source:
+        with open(destination_fd, "wb", closefd=False) as destination:
+            shutil.copyfileobj(source, destination)
+
+
+COPY_METHODS: Dict[TransferMethod, Callable[[int, int, int], None]] = {
+    TransferMethod.reflink: _reflink,
+    TransferMethod.copy_file_range: _copy_file_range,
+    TransferMethod.sendfile: _sendfile,
+    TransferMethod.buffered: _buffered,
+}
+
+
+def _reset(file_descriptor: int) -> None:
+    """Truncate an open destination, discarding anything a failed attempt left behind."""
+    os.ftruncate(file_descriptor, 0)
+    os.lseek(file_descriptor, 0, os.SEEK_SET)
+
+
+def copy_into(source_path: str, destination_fd: int) -> TransferMethod:
+    """Copy the contents of source_path into the open, empty, destination_fd.
+
+    Returns the method which was used.
+    """
+    with open(source_path, "rb") as source:
+        source_fd = source.fileno()
+        source_stat = os.fstat(source_fd)
+        destination_device = os.fstat(destination_fd).st_dev
+
+        if not source_stat.st_size:
+            return TransferMethod.buffered
+
+        for method, copy in COPY_METHODS.items():
+            devices = (method, source_stat.st_dev, destination_device)
+            if devices in _UNSUPPORTED:
+                continue
+
+            try:
+                copy(source_fd, destination_fd, source_stat.st_size)
+                return method
+
+            except OSError as err:
+                if method is TransferMethod.buffered or err.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+
+                LOG.debug("%s unsupported for %s: %s", method.value, source_path, err)
+                _UNSUPPORTED.add(devices)
+                _reset(destination_fd)
+
+    # The buffered copy always either succeeds, or raises.
+    raise AssertionError("Unreachable")
+
+
+def move_into(source_path: str, destination_path: str, destination_fd: int) -> TransferMethod:
+    """Move source_path to destination_path, replacing the placeholder open as destination_fd.
+
+    Within a file system this is an atomic rename, otherwise the contents are
+    copied, with the source's metadata, before the source is removed.
+    """
+    try:
+        os.replace(source_path, destination_path)
+        return TransferMethod.rename
+
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+
+    method = copy_into(source_path, destination_fd)
+    shutil.copystat(source_path, destination_path)
+    os.unlink(source_path)
+
+    return method
@@ -0,0 +1,306 @@
+"""Persistent snapshot of a directory tree, used to avoid relisting unchanged directories.
+
+A directory's modification time changes whenever an entry is added to,
+removed from or renamed within it.  The snapshot records the modification
+time, inode and number of entries of every directory walked, along with its
+(filtered) listing.  Rescans stat each directory, and only list those whose
+modification time or inode changed since, reusing the recorded listing for
+the rest.
+
+Files modified in place don't change the modification time of their
+directory, so the stats reused from the snapshot don't reflect such edits.
+Photos are rarely edited in place, but walk accepts full_scan to relist every
+directory, refreshing the snapshot as it goes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import time
+from os.path import relpath
+from pathlib import Path
+from typing import FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from organiser import file_listing as fl
+from organiser import scan_cache as sc
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+# Number of writes buffered before they are committed to disk.
+COMMIT_INTERVAL = 500
+
+# Directories modified this recently when listed may still change within the
+# same modification time tick (e.g. on file systems with one second
+# resolution), so are always relisted on the next walk.
+RACY_WINDOW_NS = 2 * 1_000_000_000
+
+# Recorded in place of the modification time of racily listed directories.
+RELIST = -1
+
+Listing = Tuple[List[str], List[Tuple[str, os.stat_result]]]
+
+
+def default_snapshot_path(base_dir: Union[str, Path]) -> Path:
+    """Return the default location of the snapshot for base_dir, alongside the scan cache."""
+    digest = hashlib.sha1(os.path.abspath(base_dir).encode()).hexdigest()[:16]
+    return sc.default_cache_path().parent / f"tree_{digest}.sqlite3"
+
+
+def _filter_signature(
+        filename_filter: Optional[str],
+        extensions: Optional[FrozenSet[str]],
+        excludes: Iterable[str],
+) -> str:
+    """Describe the filters a listing was made with, listings made with others can't be reused."""
+    return json.dumps(
+        [filename_filter or "", sorted(extensions or []), sorted(excludes)],
+    )
+
+
+def _file_stat(size: int, mtime_ns: int, inode: int, device: int) -> os.stat_result:
+    """Rebuild the parts of a regular file's stat which are recorded in the snapshot."""
+    mtime = mtime_ns / 1_000_000_000
+    return os.stat_result(
+        (stat.S_IFREG, inode, device, 1, 0, 0, size, mtime, mtime, mtime),
+        {"st_mtime_ns": mtime_ns, "st_atime_ns": mtime_ns, "st_ctime_ns": mtime_ns},
+    )
+
+
+class TreeSnapshot:
+    """SQLite backed record of the directories, and their listings, found by a walk.
+
+    Walks run on a single thread, but not necessarily the one the snapshot was
+    opened on.
+    """
+
+    def __init__(self, snapshot_path: Path) -> None:
+        self.snapshot_path = snapshot_path
+
+        self.listed = 0
+        self.reused = 0
+
+        self._pending_writes = 0
+
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(snapshot_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            LOG.info("Rebuilding tree snapshot at %s.", snapshot_path)
+            self._connection.execute("DROP TABLE IF EXISTS directories")
+            self._connection.execute("DROP TABLE IF EXISTS entries")
+            self._connection.execute("DROP TABLE IF EXISTS settings")
+
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                child_count INTEGER NOT NULL
+            )
+            """,
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                directory TEXT NOT NULL,
+                name TEXT NOT NULL,
+                is_dir INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                device INTEGER NOT NULL,
+                PRIMARY KEY (directory, name)
+            ) WITHOUT ROWID
+            """,
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        )
+        self._connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._connection.commit()
+
+    def __enter__(self) -> "TreeSnapshot":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _commit_periodically(self) -> None:
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def _use_filters(self, signature: str) -> None:
+        """Discard the recorded listings if they were made with different filters."""
+        row = self._connection.execute(
+            "SELECT value FROM settings WHERE key = 'filters'",
+        ).fetchone()
+        if row is not None and row[0] == signature:
+            return
+
+        if row is not None:
+            LOG.info("File filters changed, discarding the tree snapshot.")
+
+        self._connection.execute("DELETE FROM directories")
+        self._connection.execute("DELETE FROM entries")
+        self._connection.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES ('filters', ?)",
+            (signature,),
+        )
+        self._connection.commit()
+
+    def _load(self, directory: str, key: str, dir_stat: os.stat_result) -> Optional[Listing]:
+        """Return the recorded listing of directory, if it is unchanged since it was made."""
+        row = self._connection.execute(
+            "SELECT mtime_ns, inode, child_count FROM directories WHERE path = ?",
+            (key,),
+        ).fetchone()
+        if row is None or (row[0], row[1]) != (dir_stat.st_mtime_ns, dir_stat.st_ino):
+            return None
+
+        entries = self._connection.execute(
+            "SELECT name, is_dir, size, mtime_ns, inode, device FROM entries WHERE directory = ?",
+            (key,),
+        ).fetchall()
+        if len(entries) != row[2]:
+            LOG.debug("Snapshot of %s is incomplete, relisting it.", directory)
+            return None
+
+        sub_dirs: List[str] = []
+        files: List[Tuple[str, os.stat_result]] = []
+        for name, is_dir, size, mtime_ns, inode, device in entries:
+            path = os.path.join(directory, name)
+            if is_dir:
+                sub_dirs.append(path)
+            else:
+                files.append((path, _file_stat(size, mtime_ns, inode, device)))
+
+        return sub_dirs, files
+
+    def _save(self, key: str, dir_stat: os.stat_result, listing: Listing) -> None:
+        """Record the listing of the directory at key."""
+        sub_dirs, files = listing
+
+        mtime_ns = dir_stat.st_mtime_ns
+        if time.time_ns() - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = RELIST
+
+        self._connection.execute("DELETE FROM entries WHERE directory = ?", (key,))
+        self._connection.executemany(
+            "INSERT INTO entries (directory, name, is_dir, size, mtime_ns, inode, device)"
+            " VALUES (?, ?, 1, 0, 0, 0, 0)",
+            ((key, os.path.basename(path)) for path in sub_dirs),
+        )
+        self._connection.executemany(
+            "INSERT INTO entries (directory, name, is_dir, size, mtime_ns, inode, device)"
+            " VALUES (?, ?, 0, ?, ?, ?, ?)",
+            (
+                (
+                    key,
+                    os.path.basename(path),
+                    file_stat.st_size,
+                    file_stat.st_mtime_ns,
+                    file_stat.st_ino,
+                    file_stat.st_dev,
+                )
+                for path, file_stat in files
+            ),
+        )
+        self._connection.execute(
+            "INSERT OR REPLACE INTO directories (path, mtime_ns, inode, child_count)"
+            " VALUES (?, ?, ?, ?)",
+            (key, mtime_ns, dir_stat.st_ino, len(sub_dirs) + len(files)),
+        )
+        self._commit_periodically()
+
+    def _prune(self, seen: Set[str]) -> None:
+        """Drop directories which no longer exist beneath the walked tree."""
+        stale = [
+            path
+            for (path,) in self._connection.execute("SELECT path FROM directories").fetchall()
+            if path not in seen
+        ]
+        for path in stale:
+            self._connection.execute("DELETE FROM directories WHERE path = ?", (path,))
+            self._connection.execute("DELETE FROM entries WHERE directory = ?", (path,))
+
+        if stale:
+            LOG.debug("Dropped %d directories from the tree snapshot.", len(stale))
+
+    def walk(
+            self,
+            base_dir: Union[str, Path],
+            filename_filter: Optional[str] = None,
+            extensions: Optional[FrozenSet[str]] = None,
+            excludes: Iterable[str] = fl.DEFAULT_EXCLUDES,
+            full_scan: bool = False,
+    ) -> Iterator[FileTarget]:
+        """Yield FileTargets for the files beneath base_dir, as file_listing_iterator does.
+
+        Directories unchanged since the last walk aren't listed, their files
+        are yielded from the snapshot instead, along with the stats recorded
+        for them.  Set full_scan to list every directory regardless.
+        """
+        excludes = tuple(excludes)
+        self._use_filters(_filter_signature(filename_filter, extensions, excludes))
+
+        name_pattern = fl.compile_filename_filter(filename_filter)
+        exclude_pattern = fl.compile_excludes(excludes)
+
+        seen: Set[str] = set()
+        pending_dirs = [relpath(os.path.abspath(base_dir), os.path.curdir)]
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            key = os.path.abspath(directory)
+
+            try:
+                dir_stat = os.stat(directory)
+                listing = None if full_scan else self._load(directory, key, dir_stat)
+                if listing is None:
+                    listing = fl.list_directory(
+                        directory,
+                        name_pattern,
+                        extensions,
+                        exclude_pattern,
+                    )
+                    self._save(key, dir_stat, listing)
+                    self.listed += 1
+                else:
+                    self.reused += 1
+
+            except OSError as err:
+                LOG.warning("Unable to list %s: %s", directory, err)
+                continue
+
+            seen.add(key)
+            sub_dirs, files = listing
+            for file_path, file_stat in files:
+                yield FileTarget(file_path, file_stat=file_stat)
+
+            pending_dirs.extend(reversed(sub_dirs))
+
+        # Only a complete walk shows which directories have gone.
+        self._prune(seen)
+        self._connection.commit()
+        self._pending_writes = 0
+
+    def close(self) -> None:
+        """Flush pending writes and close the snapshot."""
+        LOG.info(
+            "Tree snapshot: %d directories listed, %d reused.",
+            self.listed,
+            self.reused,
+        )
+        self._connection.commit()
+        self._connection.close()
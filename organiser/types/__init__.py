@@ -1,6 +1,5 @@
 """Various types used within the Organiser codebase."""
 
 from organiser.types.file_target import FailedTarget, FileTarget
-from organiser.types.target_reports import FailedResults, Results
 
-__all__ = ["FileTarget", "FailedTarget", "Results", "FailedResults"]
+__all__ = ["FileTarget", "FailedTarget"]
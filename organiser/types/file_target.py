@@ -1,30 +1,164 @@
-"""Contains the FileTarget class, which is the dataclass used to maintain working state on files."""
+"""Contains the FileTarget class, which is the record used to maintain working state on files.
 
-from dataclasses import dataclass, field
-from typing import Dict, Optional
-from os.path import sep
+A FileTarget is held for every file of a run, so it is kept compact: it is
+slotted, holds the raw digest with its base64 form derived on demand, the
+datestamp as integer microseconds since the epoch along with its UTC offset,
+building the pendulum DateTime only once it is first read, and only the
+printable values of the few EXIF tags the pipeline uses, with repeated values
+shared between targets.
+"""
 
-from exifread.classes import IfdTag
-from pendulum import DateTime
+import base64
+import calendar
+import os
+import sys
+from datetime import datetime
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, Mapping, Optional, Tuple
+
+# Only needed for annotations, importing pendulum is a large part of startup time.
+if TYPE_CHECKING:
+    from pendulum import DateTime
+
+# Shared by every target without EXIF values, it can't be modified in place.
+NO_TAGS: Mapping[str, str] = MappingProxyType({})
+
+# The EXIF date tags whose printable values are recorded, see FileTarget.date_tags.
+DATE_TAGS = ("EXIF DateTimeDigitized", "EXIF DateTimeOriginal", "Image DateTime")
 
 
-@dataclass
 class FileTarget:
     """Class used to manage state related to a file that needs organising."""
-    file_path: str
 
-    file_contents: Optional[bytes] = field(default=None)
-    file_hash: Optional[bytes] = field(default=None)
-    encoded_hash: Optional[str] = field(default=None)
+    __slots__ = (
+        "file_path",
+        "file_contents",
+        "file_hash",
+        "file_stat",
+        "target_move_path",
+        "image_metadata",
+        "from_cache",
+        "date_source",
+        "duplicate_of",
+        "transfer_method",
+        "operation_complete",
+        "_epoch_us",
+        "_utc_offset",
+        "_datestamp",
+        "_date_values",
+    )
+
+    def __init__(
+            self,
+            file_path: str,
+            file_contents: Optional[bytes] = None,
+            file_hash: Optional[bytes] = None,
+            file_stat: Optional[os.stat_result] = None,
+            datestamp: Optional["DateTime"] = None,
+            target_move_path: str = "",
+    ) -> None:
+        self.file_path = file_path
+
+        # Leading bytes of the file retained for metadata parsing, see file_listing.HEADER_SIZE.
+        self.file_contents = file_contents
+
+        # Raw digest of the file, in the run's hash algorithm, see encoded_hash for its base64.
+        self.file_hash = file_hash
+
+        # Stat of the source file, used to key cached scan results.
+        self.file_stat = file_stat
+
+        self.target_move_path = target_move_path
+
+        # Printable values of the EXIF tags used to identify the datestamp, only
+        # held between parsing the metadata and identifying the datestamp.
+        self.image_metadata = NO_TAGS
+
+        # Values of each of DATE_TAGS, see date_tags.
+        self._date_values: Optional[Tuple[Optional[str], ...]] = None
+
+        # Set when hash and datestamp were restored from the scan cache.
+        self.from_cache = False
+
+        # Where the datestamp was taken from, see date_sources.DateSource.
+        self.date_source: Optional[str] = None
+
+        # Path of the file this is a byte-identical copy of, if any.
+        self.duplicate_of: Optional[str] = None
+
+        # How the file was placed into storage, see transfer.TransferMethod.
+        self.transfer_method: Optional[str] = None
+
+        self.operation_complete = False
+
+        # The datestamp, as microseconds since the epoch and seconds east of UTC.
+        self._epoch_us: Optional[int] = None
+        self._utc_offset = 0
+        # Built from the above when first read, see datestamp.
+        self._datestamp: Optional["DateTime"] = None
+        self.datestamp = datestamp
+
+    @property
+    def encoded_hash(self) -> Optional[str]:
+        """The base64 encoded file_hash."""
+        if self.file_hash is None:
+            return None
+
+        return base64.b64encode(self.file_hash).decode("utf-8")
 
-    datestamp: Optional[DateTime] = field(default=None)
+    @property
+    def date_tags(self) -> Dict[str, str]:
+        """Printable values of the EXIF date tags used to identify the datestamp.
 
-    target_move_path: str = field(default="")
+        Returns a new dict, so changes must be assigned back rather than made in place.
+        """
+        if self._date_values is None:
+            return {}
+
+        return {tag: value for tag, value in zip(DATE_TAGS, self._date_values) if value is not None}
+
+    @date_tags.setter
+    def date_tags(self, date_tags: Mapping[str, str]) -> None:
+        # The same few dates recur across a run, e.g. in bursts, so share a single copy of each.
+        values = tuple(
+            sys.intern(date_tags[tag]) if tag in date_tags else None
+            for tag in DATE_TAGS
+        )
+        self._date_values = values if any(value is not None for value in values) else None
+
+    @property
+    def datestamp(self) -> Optional["DateTime"]:
+        """The date the file was taken, in the timezone it was taken in where known."""
+        if self._epoch_us is None:
+            return None
+
+        if self._datestamp is not None:
+            return self._datestamp
+
+        import pendulum  # pylint: disable=import-outside-toplevel
+        from pendulum.tz import fixed_timezone  # pylint: disable=import-outside-toplevel
+
+        timezone = fixed_timezone(self._utc_offset) if self._utc_offset else pendulum.UTC
+        seconds, microseconds = divmod(self._epoch_us, 1_000_000)
+
+        moment = datetime.fromtimestamp(seconds, timezone).replace(microsecond=microseconds)
+        self._datestamp = pendulum.instance(moment)
+        return self._datestamp
 
-    # TODO - Make an ImageFile subclass of FileTarget for use with image specific processing.
-    image_metadata: Dict[str, IfdTag] = field(init=False, default_factory=dict)
+    @datestamp.setter
+    def datestamp(self, datestamp: Optional[datetime]) -> None:
+        self._datestamp = None
+        if datestamp is None:
+            self._epoch_us = None
+            self._utc_offset = 0
+            return
 
-    operation_complete: bool = field(init=False, default=False)
+        # Naive datestamps are taken to be in UTC, as pendulum does.
+        offset = datestamp.utcoffset()
+        self._utc_offset = int(offset.total_seconds()) if offset is not None else 0
+
+        wall_clock = calendar.timegm(datestamp.timetuple())
+        self._epoch_us = (wall_clock - self._utc_offset) * 1_000_000 + datestamp.microsecond
 
     def clear_contents_data(self) -> "FileTarget":
         """Purge the contents of the file from the instance to preserve memory."""
@@ -40,6 +174,12 @@ class FileTarget:
             f"   Target Path: {self.target_move_path}"
         )
 
+    def __repr__(self) -> str:
+        return (
+            f"FileTarget(file_path={self.file_path!r}, encoded_hash={self.encoded_hash!r}, "
+            f"datestamp={self.datestamp!r}, target_move_path={self.target_move_path!r})"
+        )
+
     def __eq__(self, other: object) -> bool:
         """Check whether this FileTarget is a duplicate of another or not.
 
@@ -67,36 +207,47 @@ class FileTarget:
         Will never update the original file path (effectively thats our primary
         key).
         """
-        excludes = ("file_path",)
-        attrs = (
-            attr for attr in dir(other)
-            if not callable(getattr(other, attr)) and not attr.startswith("_")
-        )
+        def merged(mine: object, theirs: object) -> bool:
+            return bool(theirs) and (overwrite or not mine)
 
-        for attr in attrs:
-            if attr in excludes:
-                continue
-
-            other_attr = getattr(other, attr)
-            if not other_attr:
-                # Don't bother updating if other doesn't have a value for this attribute.
-                continue
-
-            if overwrite:
-                setattr(self, attr, other_attr)
-
-            elif not getattr(self, attr):
-                setattr(self, attr, other_attr)
+        if merged(self.file_contents, other.file_contents):
+            self.file_contents = other.file_contents
+        if merged(self.file_hash, other.file_hash):
+            self.file_hash = other.file_hash
+        if merged(self.file_stat, other.file_stat):
+            self.file_stat = other.file_stat
+        if merged(self.target_move_path, other.target_move_path):
+            self.target_move_path = other.target_move_path
+        if merged(self.image_metadata, other.image_metadata):
+            self.image_metadata = other.image_metadata
+        if merged(self._date_values, other._date_values):
+            self._date_values = other._date_values
+        if merged(self.from_cache, other.from_cache):
+            self.from_cache = other.from_cache
+        if merged(self.date_source, other.date_source):
+            self.date_source = other.date_source
+        if merged(self.duplicate_of, other.duplicate_of):
+            self.duplicate_of = other.duplicate_of
+        if merged(self.transfer_method, other.transfer_method):
+            self.transfer_method = other.transfer_method
+        if merged(self.operation_complete, other.operation_complete):
+            self.operation_complete = other.operation_complete
+        if merged(self._epoch_us is not None, other._epoch_us is not None):
+            self._epoch_us = other._epoch_us
+            self._utc_offset = other._utc_offset
+            self._datestamp = other._datestamp
 
         return self
 
 
-@dataclass
 class FailedTarget():
     """Subclass of FileTarget used to track operations which failed."""
 
-    original_record: FileTarget
-    failure_reason: Exception
+    __slots__ = ("original_record", "failure_reason")
+
+    def __init__(self, original_record: FileTarget, failure_reason: Exception) -> None:
+        self.original_record = original_record
+        self.failure_reason = failure_reason
 
     def __str__(self) -> str:
         return (
@@ -0,0 +1,17 @@
+# Stubs for xxhash (Python 3), covering only what the organiser uses.
+
+from typing import Union
+
+
+class xxh3_128:
+    def __init__(self, input: bytes = ..., seed: int = ...) -> None:
+        ...
+
+    def update(self, input: Union[bytes, bytearray, memoryview]) -> None:
+        ...
+
+    def digest(self) -> bytes:
+        ...
+
+    def hexdigest(self) -> str:
+        ...
@@ -0,0 +1,358 @@
+"""Continuous ingestion of files as they are added beneath a directory.
+
+On Linux, directories are watched with inotify, so new files are noticed as
+soon as they are written, without rescanning the tree.  Where inotify is
+unavailable, the tree is polled instead.  Either way, each file is held back
+until it has been closed and left unchanged for a quiet period, so that files
+still being uploaded are never picked up half written.
+"""
+
+import ctypes
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from threading import Event, Lock
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+LOG = logging.getLogger(__name__)
+
+# Time a file must be left unchanged, once closed, before it is processed.
+DEFAULT_QUIET_PERIOD = 2.0
+
+# How often the tree is rescanned when inotify is unavailable.
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Longest the watcher blocks before checking whether it has been stopped.
+WAKE_INTERVAL = 0.5
+
+# From sys/inotify.h.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event, which is followed by a NUL padded name of length len.
+_EVENT_HEADER = struct.Struct("iIII")
+
+_READ_SIZE = 64 * 1024
+
+FileState = Tuple[int, int]
+
+
+def _file_state(stat: os.stat_result) -> FileState:
+    """Return the parts of a stat which change as a file is written."""
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Debouncer:
+    """Holds back paths until they have been closed, then left unchanged for quiet_period."""
+
+    def __init__(
+            self,
+            quiet_period: float = DEFAULT_QUIET_PERIOD,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.quiet_period = quiet_period
+        self._clock = clock
+
+        # Path -> (deadline, closed, size and mtime when last seen).
+        self._pending: Dict[str, Tuple[float, bool, Optional[FileState]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, path: str, closed: bool, stat: Optional[os.stat_result] = None) -> None:
+        """Record activity on path, restarting its quiet period.
+
+        Set closed once the writer is done with the file.  Only files which
+        have been closed are stat'ed, so that a stream of writes costs nothing
+        beyond a dictionary update.
+        """
+        state: Optional[FileState] = None
+        if closed:
+            try:
+                state = _file_state(stat or os.stat(path))
+            except FileNotFoundError:
+                self.forget(path)
+                return
+
+        self._pending[path] = (self._clock() + self.quiet_period, closed, state)
+
+    def forget(self, path: str) -> None:
+        """Stop tracking path, e.g. as it was deleted."""
+        self._pending.pop(path, None)
+
+    def next_deadline(self) -> Optional[float]:
+        """Return the earliest time a pending path may become ready."""
+        return min((deadline for deadline, _, _ in self._pending.values()), default=None)
+
+    def ready(self) -> List[FileTarget]:
+        """Return FileTargets for, and stop tracking, every path which has settled.
+
+        Paths whose size or modification time changed since they were last
+        seen start a new quiet period instead.
+        """
+        now = self._clock()
+        settled: List[FileTarget] = []
+
+        for path, (deadline, closed, state) in list(self._pending.items()):
+            if not closed or deadline > now:
+                continue
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.forget(path)
+                continue
+
+            if _file_state(stat) != state:
+                self._pending[path] = (now + self.quiet_period, True, _file_state(stat))
+                continue
+
+            self.forget(path)
+            settled.append(FileTarget(path, file_stat=stat))
+
+        return settled
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError as err:
+            raise OSError("inotify is not available on this platform") from err
+
+        self.fd: int = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str) -> int:
+        """Watch the directory at path, returning its watch descriptor."""
+        descriptor: int = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        return descriptor
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Return the (watch descriptor, mask, name) of events arriving within timeout."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((descriptor, mask, name))
+
+        return events
+
+    def close(self) -> None:
+        """Release the inotify instance, and every watch with it."""
+        os.close(self.fd)
+
+
+class Watcher:
+    """Yields FileTargets for files as they settle beneath base_dir.
+
+    Files already present when watching starts are yielded too, so nothing
+    added whilst the watcher wasn't running is missed.
+    """
+
+    def __init__(
+            self,
+            base_dir: Union[str, Path],
+            filename_filter: Optional[str] = None,
+            extensions: Optional[FrozenSet[str]] = None,
+            excludes: Iterable[str] = fl.DEFAULT_EXCLUDES,
+            quiet_period: float = DEFAULT_QUIET_PERIOD,
+            poll_interval: float = DEFAULT_POLL_INTERVAL,
+            use_inotify: bool = True,
+    ) -> None:
+        self.base_dir = os.path.abspath(base_dir)
+        self.filename_filter = filename_filter
+        self.extensions = extensions
+        self.excludes = tuple(excludes)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+
+        self._name_pattern = fl.compile_filename_filter(filename_filter)
+        self._exclude_pattern = fl.compile_excludes(self.excludes)
+        self._debouncer = Debouncer(quiet_period)
+
+        self._lock = Lock()
+        self._ignored: Set[str] = set()
+
+        self._directories: Dict[int, str] = {}
+
+    def ignore(self, path: str) -> None:
+        """Don't yield path the next time it settles, e.g. as it was placed there by us."""
+        path = os.path.abspath(path)
+        if os.path.commonpath((path, self.base_dir)) != self.base_dir:
+            return
+
+        with self._lock:
+            self._ignored.add(path)
+
+    def _settled(self) -> Iterator[FileTarget]:
+        """Yield the settled files which weren't placed by us."""
+        for target in self._debouncer.ready():
+            with self._lock:
+                if target.file_path in self._ignored:
+                    self._ignored.discard(target.file_path)
+                    continue
+
+            yield target
+
+    def _is_excluded(self, name: str) -> bool:
+        return bool(self._exclude_pattern and self._exclude_pattern.match(name))
+
+    def _add_tree(self, inotify: _Inotify, directory: str) -> None:
+        """Watch directory and everything beneath it, noting any files already within."""
+        pending_dirs = [directory]
+        while pending_dirs:
+            directory = pending_dirs.pop()
+            try:
+                # Watch before listing, so files created in between aren't missed.
+                self._directories[inotify.add_watch(directory)] = directory
+
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self._is_excluded(entry.name):
+                                pending_dirs.append(entry.path)
+                            continue
+
+                        if entry.is_file() and fl.matches_file_name(
+                                entry.name,
+                                self._name_pattern,
+                                self.extensions,
+                        ):
+                            self._debouncer.touch(entry.path, closed=True, stat=entry.stat())
+
+            except OSError as err:
+                LOG.warning("Unable to watch %s: %s", directory, err)
+
+    def _handle(self, inotify: _Inotify, descriptor: int, mask: int, name: str) -> None:
+        """Update the pending files with a single inotify event."""
+        if mask & IN_Q_OVERFLOW:
+            LOG.warning("Missed file system events, rescanning %s.", self.base_dir)
+            self._add_tree(inotify, self.base_dir)
+            return
+
+        directory = self._directories.get(descriptor)
+        if mask & IN_IGNORED:
+            self._directories.pop(descriptor, None)
+            return
+
+        if directory is None or not name:
+            return
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and not self._is_excluded(name):
+                self._add_tree(inotify, path)
+            return
+
+        if not fl.matches_file_name(name, self._name_pattern, self.extensions):
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._debouncer.forget(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._debouncer.touch(path, closed=True)
+        elif mask & (IN_CREATE | IN_MODIFY):
+            self._debouncer.touch(path, closed=False)
+
+    def _timeout(self) -> float:
+        """Return how long to wait for events before checking on pending files again."""
+        deadline = self._debouncer.next_deadline()
+        if deadline is None:
+            return WAKE_INTERVAL
+
+        return max(0.0, min(WAKE_INTERVAL, deadline - time.monotonic()))
+
+    def _watch_inotify(self, inotify: _Inotify, stop: Event) -> Iterator[FileTarget]:
+        try:
+            self._add_tree(inotify, self.base_dir)
+
+            while not stop.is_set():
+                for descriptor, mask, name in inotify.read(self._timeout()):
+                    self._handle(inotify, descriptor, mask, name)
+
+                yield from self._settled()
+
+        finally:
+            inotify.close()
+
+    def _watch_polling(self, stop: Event) -> Iterator[FileTarget]:
+        known: Dict[str, FileState] = {}
+        next_poll = 0.0
+
+        while not stop.is_set():
+            if time.monotonic() >= next_poll:
+                seen = set()
+                for target in fl.file_listing_iterator(
+                        self.base_dir,
+                        self.filename_filter,
+                        self.extensions,
+                        self.excludes,
+                ):
+                    path = os.path.abspath(target.file_path)
+                    stat = fl.stat_target(target)
+                    seen.add(path)
+                    if known.get(path) != _file_state(stat):
+                        known[path] = _file_state(stat)
+                        self._debouncer.touch(path, closed=True, stat=stat)
+
+                for path in set(known) - seen:
+                    del known[path]
+                    self._debouncer.forget(path)
+
+                next_poll = time.monotonic() + self.poll_interval
+
+            yield from self._settled()
+            stop.wait(self._timeout())
+
+    def watch(self, stop: Event) -> Iterator[FileTarget]:
+        """Yield files as they settle, until stop is set."""
+        if self.use_inotify:
+            try:
+                inotify = _Inotify()
+            except OSError as err:
+                LOG.warning("inotify is unavailable, polling for changes instead: %s", err)
+            else:
+                LOG.info("Watching %s with inotify.", self.base_dir)
+                yield from self._watch_inotify(inotify, stop)
+                return
+
+        LOG.info("Polling %s every %s seconds.", self.base_dir, self.poll_interval)
+        yield from self._watch_polling(stop)
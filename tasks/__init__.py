@@ -9,9 +9,10 @@ from tasks.patch_invoke import fix_annotations
 fix_annotations()
 
 # pylint: disable = wrong-import-position
+from tasks.benchmark import benchmark
 from tasks.lint import lint
 from tasks.test import unit_test
 # pylint: enable = wrong-import-position
 
 
-__all__ = ["lint", "unit_test"]
+__all__ = ["benchmark", "lint", "unit_test"]
@@ -0,0 +1,35 @@
+"""Automation around benchmarking the project."""
+
+from typing import Optional
+
+from invoke import Context, task
+
+
+@task
+def benchmark(
+        context: Context,
+        output: str = "benchmark.json",
+        files: int = 1000,
+        layout: str = "camera",
+        repeat: int = 3,
+        corpus_dir: Optional[str] = None,
+        baseline: Optional[str] = None,
+) -> None:
+    """Benchmark each stage, and whole runs, against a synthetic photo corpus.
+
+    Results are written to output as JSON.  Pass the output of an earlier
+    commit as baseline to fail on any stage slowing by more than 10%.  See
+    python -m benchmarks.suite --help for every option.
+    """
+    cmd = (
+        "python -m benchmarks.suite --output {output} --files {files} --layout {layout}"
+        " --repeat {repeat} {corpus_dir} {baseline}".format(
+            output=output,
+            files=files,
+            layout=layout,
+            repeat=repeat,
+            corpus_dir=f"--corpus-dir {corpus_dir}" if corpus_dir else "",
+            baseline=f"--baseline {baseline}" if baseline else "",
+        )
+    )
+    context.run(cmd)
@@ -16,6 +16,11 @@ def get_project_files(exclude_tasks: bool = False, exclude_tests: bool = False)
             if any((file.endswith('.py'), file.endswith('.pyi'))):
                 project_files.append(normpath(join(root, file)))
 
+    for root, _, files in walk(join(dirname(__file__), "../benchmarks")):
+        for file in files:
+            if any((file.endswith('.py'), file.endswith('.pyi'))):
+                project_files.append(normpath(join(root, file)))
+
     if not exclude_tasks:
         for root, _, files in walk(join(dirname(__file__), "../tasks")):
             for file in files:
@@ -0,0 +1,64 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+from benchmarks import corpus as cp
+from benchmarks import suite
+from organiser import file_listing as fl
+from organiser import image_metadata as im
+
+
+def _digests(directory: Path) -> Dict[str, str]:
+    return {
+        os.path.relpath(os.path.join(root, name), directory): hashlib.sha256(
+            Path(root, name).read_bytes(),
+        ).hexdigest()
+        for root, _, files in os.walk(directory)
+        for name in files
+    }
+
+
+@pytest.mark.parametrize("layout", list(cp.Layout))
+def test_generate_corpus(layout: cp.Layout, tmp_path: Path) -> None:
+    """Corpora should be reproducible, and hold files whose dates can be parsed."""
+    spec = cp.CorpusSpec(
+        files=30, layout=layout, min_kb=1, max_kb=4, tiff_ratio=0.3, no_exif_ratio=0,
+    )
+
+    summary = cp.generate_corpus(spec, tmp_path / "first")
+    cp.generate_corpus(spec, tmp_path / "second")
+
+    assert _digests(tmp_path / "first") == _digests(tmp_path / "second")
+    assert cp.load_corpus(spec, tmp_path / "first") == summary
+    assert cp.load_corpus(cp.CorpusSpec(files=31), tmp_path / "first") is None
+
+    targets = list(fl.file_listing_iterator(tmp_path / "first", suite.FILE_FILTER))
+    assert len(targets) == summary.files == 30
+    assert sum(fl.stat_target(target).st_size for target in targets) == summary.bytes
+
+    for target in targets:
+        target = im.identify_image_datestamp(
+            im.parse_image_meta_for_file_target(fl.load_file_header(target)),
+        )
+        assert target.datestamp is not None
+        assert spec.first_year <= target.datestamp.year <= spec.last_year
+
+
+def test_compare() -> None:
+    """Only stages slowing beyond the threshold should be reported."""
+    baseline = {
+        "walk": {"files_per_second": 1000.0},
+        "get_file_meta": {"files_per_second": 1000.0},
+        "end_to_end": {"files_per_second": 100.0},
+    }
+    results = {
+        "walk": {"files_per_second": 950.0},
+        "get_file_meta": {"files_per_second": 800.0},
+        "end_to_end": {"files_per_second": 150.0},
+        "sha256_file": {"files_per_second": 10.0},
+    }
+
+    assert suite.compare(baseline, results, threshold=0.1) == ["get_file_meta"]
@@ -0,0 +1,210 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import List
+
+import pytest
+
+from organiser import budget as bg
+from organiser import date_sources as dsrc
+from organiser import engine
+from organiser import file_listing as fl
+from organiser import main
+from organiser import metrics as mt
+from organiser.types import FileTarget
+
+
+@pytest.mark.parametrize(
+    "size, expected_result",
+    [
+        ("1048576", 1 << 20),
+        ("512K", 512 << 10),
+        ("512m", 512 << 20),
+        ("2GiB", 2 << 30),
+        (" 1 GB ", 1 << 30),
+    ],
+)
+def test_parse_size(size: str, expected_result: int) -> None:
+    """Sizes should be parsed as bytes, with optional binary units."""
+    assert bg.parse_size(size) == expected_result
+
+
+def test_parse_size_rejects() -> None:
+    """Anything but a whole number of bytes, or of a known unit, should be rejected."""
+    for size in ("", "1.5G", "12X", "-1"):
+        with pytest.raises(ValueError):
+            bg.parse_size(size)
+
+
+def _hold_all(budget: bg.ByteBudget, sizes: List[int]) -> List[int]:
+    """Hold each of sizes from its own thread, returning the peak bytes held at once."""
+    lock = Lock()
+    held = [0]
+    peaks: List[int] = []
+
+    def reader(size: int) -> None:
+        with budget.hold(size):
+            with lock:
+                held[0] += size
+                peaks.append(held[0])
+
+            time.sleep(0.01)
+
+            with lock:
+                held[0] -= size
+
+    threads = [Thread(target=reader, args=(size,)) for size in sizes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    return peaks
+
+
+def test_budget_bounds_bytes_in_flight() -> None:
+    """Files should only be held together whilst their sizes fit within the budget."""
+    budget = bg.ByteBudget(100)
+    peaks = _hold_all(budget, [30, 30, 30, 30, 60, 10, 90, 10])
+
+    assert len(peaks) == 8
+    assert max(peaks) <= 100
+    assert budget.peak == max(peaks)
+    assert budget.current == 0
+    assert budget.waiting == 0
+
+
+def test_oversized_files_are_held_alone() -> None:
+    """A file larger than the whole budget should be admitted, but only once nothing else is."""
+    budget = bg.ByteBudget(100)
+    peaks = _hold_all(budget, [40, 250, 40, 40])
+
+    assert len(peaks) == 4
+    assert 250 in peaks
+    assert all(peak <= 100 or peak == 250 for peak in peaks)
+    assert budget.oversized == 1
+    assert budget.snapshot() == {
+        "current": 0,
+        "peak": 250,
+        "limit": 100,
+        "waiting": 0,
+        "oversized": 1,
+    }
+
+
+def test_budget_is_first_come_first_served() -> None:
+    """Smaller files shouldn't overtake a larger one waiting for room."""
+    budget = bg.ByteBudget(100)
+    admitted: List[int] = []
+
+    budget.acquire(60)
+
+    def reader(size: int) -> None:
+        with budget.hold(size):
+            admitted.append(size)
+
+    large = Thread(target=reader, args=(80,))
+    large.start()
+    while not budget.waiting:
+        time.sleep(0.001)
+
+    small = Thread(target=reader, args=(10,))
+    small.start()
+    while budget.waiting < 2:
+        time.sleep(0.001)
+
+    assert not admitted
+
+    budget.release(60)
+    large.join(10)
+    small.join(10)
+
+    assert admitted == [80, 10]
+
+
+def test_waiting_readers_are_cancelled() -> None:
+    """A reader waiting for room should give up its place once its pipeline is cancelled."""
+    budget = bg.ByteBudget(100)
+    cancelled = Event()
+    raised: List[Exception] = []
+
+    def reader() -> None:
+        try:
+            budget.acquire(80, cancelled)
+        except bg.Cancelled as err:
+            raised.append(err)
+
+    budget.acquire(60)
+    waiting = Thread(target=reader)
+    waiting.start()
+    while not budget.waiting:
+        time.sleep(0.001)
+
+    cancelled.set()
+    waiting.join(10)
+
+    assert len(raised) == 1
+    assert (budget.current, budget.waiting) == (60, 0)
+
+
+def test_analyse_charges_budget(tmp_path: Path) -> None:
+    """Reading a file should hold its size, up to its header and one chunk, or only its header."""
+    path = tmp_path / "IMG_4228.JPG"
+    path.write_bytes(b"\x00" * 4096)
+    video = tmp_path / "VID_4229.MP4"
+    video.write_bytes(b"\x00" * (3 << 20))
+    budget = bg.ByteBudget(1 << 20)
+
+    with ThreadPoolExecutor(1) as executor:
+        main.analyse_file_target(FileTarget(str(path)), executor, budget=budget)
+        assert (budget.peak, budget.current) == (4096, 0)
+
+        budget = bg.ByteBudget(4 << 20)
+        main.analyse_file_target(FileTarget(str(video)), executor, header_size=1024, budget=budget)
+        assert (budget.peak, budget.current) == (1024 + fl.CHUNK_SIZE, 0)
+
+        budget = bg.ByteBudget(1 << 20)
+        main.analyse_file_target(
+            FileTarget(str(path)), executor, hash_files=False, header_size=1024, budget=budget,
+        )
+        assert (budget.peak, budget.current) == (1024, 0)
+
+        # Files dated without being read hold nothing.
+        budget = bg.ByteBudget(1 << 20)
+        sources = dsrc.DateSources(dsrc.parse_date_sources("filename,exif"))
+        main.analyse_file_target(
+            FileTarget(str(tmp_path / "IMG_20190203_142501.jpg")),
+            executor,
+            hash_files=False,
+            sources=sources,
+            budget=budget,
+        )
+        assert budget.peak == 0
+
+
+def test_budget_reported() -> None:
+    """The budget's usage should be reported alongside the stages charging it."""
+    budget = bg.ByteBudget(1 << 20)
+    pipeline = engine.Pipeline(
+        [engine.Stage("pass", lambda target: target)],
+        lambda _: None,
+        budget=budget,
+    )
+    budget.acquire(3 << 20)
+    budget.release(3 << 20)
+
+    pipeline.run((FileTarget(str(index)) for index in range(3)), lambda _: None)
+    snapshot = pipeline.metrics.snapshot(pipeline.queue_depths())
+    snapshot["files_per_second"] = 0.0
+    snapshot["eta_seconds"] = None
+
+    assert snapshot["inflight_bytes"] == {
+        "current": 0,
+        "peak": 3 << 20,
+        "limit": 1 << 20,
+        "waiting": 0,
+        "oversized": 1,
+    }
+    assert f"organiser_inflight_bytes_peak {3 << 20}\n" in mt.to_prometheus(snapshot)
+    assert mt.progress_line(snapshot).endswith("reading 0.0MiB of 1.0MiB, peak 3.0MiB")
@@ -0,0 +1,125 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from organiser import content_index as ci
+from organiser import file_listing as fl
+from organiser.types import FileTarget
+
+
+def _target(file_path: Path, data: bytes, target_move_path: Path) -> FileTarget:
+    """Return a hashed FileTarget for data, written to file_path."""
+    file_path.write_bytes(data)
+
+    target = FileTarget(str(file_path))
+    target.file_hash = hashlib.sha256(data).digest()
+    target.target_move_path = str(target_move_path)
+
+    return target
+
+
+def test_refresh_indexes_new_files_only(tmp_path: Path) -> None:
+    """Refreshing should hash new and changed files, and skip its own state directory."""
+    storage = tmp_path / "storage"
+    (storage / "2019" / "02").mkdir(parents=True)
+    (storage / "2019" / "02" / "a.jpg").write_bytes(b"a")
+    (storage / "2019" / "02" / "b.jpg").write_bytes(b"b")
+
+    with ci.ContentIndex(ci.default_index_path(storage)) as index:
+        assert index.refresh(storage) == 2
+        assert index.refresh(storage) == 0
+
+        (storage / "2019" / "02" / "b.jpg").write_bytes(b"bb")
+        assert index.refresh(storage) == 1
+
+        assert len(index) == 2
+        assert index.lookup(hashlib.sha256(b"a").digest()) == str(storage / "2019/02/a.jpg")
+        assert index.lookup(hashlib.sha256(b"b").digest()) is None
+
+
+def test_lookup_drops_missing_files(tmp_path: Path) -> None:
+    """Entries for files removed from storage should no longer match."""
+    (tmp_path / "a.jpg").write_bytes(b"a")
+
+    with ci.ContentIndex(ci.default_index_path(tmp_path)) as index:
+        index.refresh(tmp_path)
+        (tmp_path / "a.jpg").unlink()
+
+        assert index.lookup(hashlib.sha256(b"a").digest()) is None
+        assert len(index) == 0
+
+
+def test_claim_complete_and_release(tmp_path: Path) -> None:
+    """Claims should block identical content until completed or released."""
+    first = _target(tmp_path / "first.jpg", b"same", tmp_path / "stored.jpg")
+    second = _target(tmp_path / "second.jpg", b"same", tmp_path / "stored(1).jpg")
+
+    with ci.ContentIndex(tmp_path / "index.sqlite3") as index:
+        assert index.claim(first) is None
+        assert index.claim(second) == str(tmp_path / "stored.jpg")
+
+        index.release(first)
+        assert index.claim(second) is None
+
+        (tmp_path / "stored(1).jpg").write_bytes(b"same")
+        index.complete(second)
+
+        assert index.claim(first) == str(tmp_path / "stored(1).jpg")
+
+
+def test_claim_requires_hash(tmp_path: Path) -> None:
+    """Targets can't be checked against the index without a hash."""
+    with ci.ContentIndex(tmp_path / "index.sqlite3") as index:
+        with pytest.raises(ValueError):
+            index.claim(FileTarget(str(tmp_path / "a.jpg")))
+
+
+def test_refresh_rehashes_other_algorithms(tmp_path: Path) -> None:
+    """Files indexed with another algorithm should be hashed again, and only match with it."""
+    (tmp_path / "a.jpg").write_bytes(b"a")
+
+    with ci.ContentIndex(ci.default_index_path(tmp_path)) as index:
+        assert index.refresh(tmp_path) == 1
+
+    blake2b = fl.HashAlgorithm.blake2b
+    with ci.ContentIndex(ci.default_index_path(tmp_path), blake2b) as index:
+        assert index.lookup(hashlib.sha256(b"a").digest()) is None
+        assert index.refresh(tmp_path) == 1
+        assert index.refresh(tmp_path) == 0
+
+        assert len(index) == 1
+        assert index.lookup(hashlib.blake2b(b"a", digest_size=32).digest()) == str(
+            tmp_path / "a.jpg",
+        )
+
+
+def test_refresh_skips_the_source_dir(tmp_path: Path) -> None:
+    """Files still to be organised should not be indexed as stored."""
+    storage = tmp_path / "storage"
+    (storage / "2019").mkdir(parents=True)
+    (storage / "incoming").mkdir()
+    (storage / "2019" / "a.jpg").write_bytes(b"a")
+    (storage / "incoming" / "b.jpg").write_bytes(b"b")
+
+    with ci.ContentIndex(ci.default_index_path(storage)) as index:
+        assert index.refresh(storage, source_dir=storage / "incoming") == 1
+        assert index.lookup(hashlib.sha256(b"b").digest()) is None
+
+        assert index.refresh(storage, source_dir=storage) == 0
+        assert index.refresh(storage / "2019", source_dir=storage) == 0
+
+
+def test_claim_registers_stored_copies(tmp_path: Path) -> None:
+    """A target which is itself the stored copy should claim its content."""
+    stored = _target(tmp_path / "stored.jpg", b"same", tmp_path / "stored.jpg")
+
+    with ci.ContentIndex(ci.default_index_path(tmp_path)) as index:
+        index.refresh(tmp_path)
+        assert index.claim(stored) is None
+
+        other = _target(tmp_path / "other.jpg", b"same", tmp_path / "stored(1).jpg")
+        assert index.claim(other) == str(tmp_path / "stored.jpg")
+
+        index.complete(stored)
+        assert index.lookup(hashlib.sha256(b"same").digest()) == str(tmp_path / "stored.jpg")
@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import pendulum
+import pytest
+import typer
+
+from benchmarks import corpus as cp
+from organiser import date_sources as dsrc
+from organiser import main
+from organiser.types import FileTarget
+
+
+@pytest.mark.parametrize(
+    "file_name, expected_result",
+    [
+        ("IMG_20190203_142501.jpg", "2019-02-03T14:25:01+00:00"),
+        ("PXL_20210101_123456789.jpg", "2021-01-01T12:34:56+00:00"),
+        ("VID-20200505-WA0001.mp4", "2020-05-05T00:00:00+00:00"),
+        ("Screenshot_2020-05-05-12-30-00.png", "2020-05-05T12:30:00+00:00"),
+        ("2019-02-03 14.25.01.jpg", "2019-02-03T14:25:01+00:00"),
+        ("IMG_20190203_1425.jpg", "2019-02-03T00:00:00+00:00"),
+        ("IMG_4228.JPG", None),
+        ("IMG_2019020312.jpg", None),
+        ("IMG_20191301_000000.jpg", None),
+        ("IMG_20190230_000000.jpg", None),
+    ],
+)
+def test_date_from_filename(file_name: str, expected_result: Optional[str]) -> None:
+    """Dates, and any times, should be found in the file name alone."""
+    datestamp = dsrc.date_from_filename(FileTarget(f"DCIM/20150101/{file_name}"))
+
+    assert (datestamp.isoformat() if datestamp else None) == expected_result
+
+
+@pytest.mark.parametrize(
+    "directory, expected_result",
+    [
+        ("2015.05.03 Curry with Mates", "2015-05-03T00:00:00+00:00"),
+        ("photos/2015.05 Holiday", "2015-05-01T00:00:00+00:00"),
+        ("photos/2015.13 Holiday", None),
+        ("DCIM/100CAMERA", None),
+    ],
+)
+def test_date_from_directory(directory: str, expected_result: Optional[str]) -> None:
+    """Directories should be dated as identify_photo_move_path recognises them."""
+    datestamp = dsrc.date_from_directory(FileTarget(f"{directory}/IMG_4228.JPG"))
+
+    assert (datestamp.isoformat() if datestamp else None) == expected_result
+
+
+def test_parse_date_sources() -> None:
+    """Sources should be parsed in order, without repeats, and unknown ones rejected."""
+    assert dsrc.parse_date_sources("Filename, exif,mtime,exif") == (
+        dsrc.DateSource.filename,
+        dsrc.DateSource.exif,
+        dsrc.DateSource.mtime,
+    )
+
+    with pytest.raises(typer.BadParameter):
+        dsrc.parse_date_sources("filename,gps")
+
+
+def test_chain_order() -> None:
+    """Sources before exif should be tried before reading, and those after it only after."""
+    sources = dsrc.DateSources(dsrc.parse_date_sources("directory,filename,exif,mtime"))
+    assert sources.before_read == (dsrc.DateSource.directory, dsrc.DateSource.filename)
+    assert sources.after_read == (dsrc.DateSource.mtime,)
+
+    target = sources.date_before_read(FileTarget("DCIM/IMG_20190203_142501.jpg"))
+    assert target.date_source == "filename"
+    assert not sources.needs_exif(target)
+
+    target = sources.date_before_read(FileTarget("2015.05 Holiday/IMG_20190203_142501.jpg"))
+    assert target.date_source == "directory"
+
+    target = sources.date_before_read(FileTarget("DCIM/IMG_4228.JPG"))
+    assert target.datestamp is None
+    assert sources.needs_exif(target)
+    assert not dsrc.DateSources((dsrc.DateSource.filename,)).needs_exif(target)
+
+
+def test_sampling() -> None:
+    """Only files dated before reading are sampled, and the same ones on every run."""
+    names = [f"DCIM/IMG_20190203_{index:06d}.jpg" for index in range(1000)]
+
+    never = dsrc.DateSources((dsrc.DateSource.filename, dsrc.DateSource.exif))
+    always = dsrc.DateSources((dsrc.DateSource.filename, dsrc.DateSource.exif), 1.0)
+    some = dsrc.DateSources((dsrc.DateSource.filename, dsrc.DateSource.exif), 0.1)
+
+    targets = [never.date_before_read(FileTarget(name)) for name in names]
+
+    assert not any(never.sampled(target) for target in targets)
+    assert all(always.sampled(target) for target in targets)
+    sampled = [target.file_path for target in targets if some.sampled(target)]
+    assert 50 < len(sampled) < 150
+    assert sampled == [target.file_path for target in targets if some.sampled(target)]
+
+    assert not always.sampled(FileTarget("DCIM/IMG_4228.JPG"))
+
+
+def _write_jpeg(path: Path, taken: datetime) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(cp.jpeg(taken, b"\x00" * 64))
+
+    return path
+
+
+def test_analyse_without_reading(tmp_path: Path) -> None:
+    """Files dated by their names shouldn't be read at all when they aren't being hashed."""
+    sources = dsrc.DateSources(dsrc.parse_date_sources("filename,exif,mtime"))
+
+    # The file doesn't exist, so any attempt to read it would fail.
+    target = FileTarget(str(tmp_path / "IMG_20190203_142501.jpg"))
+    with ThreadPoolExecutor(1) as executor:
+        target = main.analyse_file_target(target, executor, hash_files=False, sources=sources)
+
+    assert target.datestamp == pendulum.datetime(2019, 2, 3, 14, 25, 1)
+    assert target.date_source == "filename"
+    assert not dsrc.dated_from_contents(target)
+
+
+def test_analyse_falls_back(tmp_path: Path) -> None:
+    """Files no source before exif can date should be read, and fall back on their mtime."""
+    sources = dsrc.DateSources(dsrc.parse_date_sources("filename,exif,mtime"))
+    dated = _write_jpeg(tmp_path / "IMG_4228.JPG", datetime(2017, 6, 7, 8, 9, 10))
+    undated = tmp_path / "IMG_4229.JPG"
+    undated.write_bytes(b"not really a jpeg")
+
+    with ThreadPoolExecutor(1) as executor:
+        dated_target = main.analyse_file_target(
+            FileTarget(str(dated)), executor, hash_files=True, sources=sources,
+        )
+        undated_target = main.analyse_file_target(
+            FileTarget(str(undated)), executor, hash_files=False, sources=sources,
+        )
+
+    assert dated_target.datestamp == pendulum.datetime(2017, 6, 7, 8, 9, 10)
+    assert dated_target.date_source == "exif"
+    assert dated_target.file_hash is not None
+
+    assert undated_target.datestamp is not None
+    assert undated_target.date_source == "mtime"
+    assert dsrc.dated_from_contents(undated_target)
+
+
+def test_cross_check(tmp_path: Path) -> None:
+    """Sampled files should be checked against their EXIF data, and take its date."""
+    sources = dsrc.DateSources(dsrc.parse_date_sources("filename,exif,mtime"), 1.0)
+    agrees = _write_jpeg(tmp_path / "IMG_20190203_142501.jpg", datetime(2019, 2, 3, 14, 25, 2))
+    disagrees = _write_jpeg(tmp_path / "IMG_20190203_142502.jpg", datetime(2018, 1, 1))
+    without_exif = tmp_path / "IMG_20190203_142503.jpg"
+    without_exif.write_bytes(b"not really a jpeg")
+
+    with ThreadPoolExecutor(1) as executor:
+        targets = [
+            main.analyse_file_target(
+                FileTarget(str(path)), executor, hash_files=False, sources=sources,
+            )
+            for path in (agrees, disagrees, without_exif)
+        ]
+
+    assert (sources.checked, sources.disagreed) == (2, 1)
+    assert [target.date_source for target in targets] == ["exif", "exif", "filename"]
+    assert targets[1].datestamp == pendulum.datetime(2018, 1, 1)
+    assert targets[2].datestamp == pendulum.datetime(2019, 2, 3, 14, 25, 3)
@@ -0,0 +1,51 @@
+from typing import Optional
+
+import pendulum
+import pytest
+
+from organiser import datestamps as ds
+
+
+@pytest.mark.parametrize(
+    "value, subsec, offset, expected",
+    [
+        ("2019:02:03 14:25:01", None, None, "2019-02-03T14:25:01+00:00"),
+        ("2019:02:03 14:25:01 ", None, None, "2019-02-03T14:25:01+00:00"),
+        ("2019:02:03T14:25:01", None, None, "2019-02-03T14:25:01+00:00"),
+        ("2019:02:03 14:25:01", "25", None, "2019-02-03T14:25:01.250000+00:00"),
+        ("2019:02:03 14:25:01", "1234567", None, "2019-02-03T14:25:01.123456+00:00"),
+        ("2019:02:03 14:25:01", "  ", "-05:30", "2019-02-03T14:25:01-05:30"),
+        ("2019:02:03 14:25:01", None, "+01:00", "2019-02-03T14:25:01+01:00"),
+        ("2019:02:03 14:25:01", None, "   :  ", "2019-02-03T14:25:01+00:00"),
+        # Formats beyond the EXIF format fall back to pendulum.
+        ("2019-02-03 14:25:01", None, None, "2019-02-03T14:25:01+00:00"),
+        ("2019:02:03", None, None, "2019-02-03T00:00:00+00:00"),
+        # Unset clocks, and nonsense, have no datestamp.
+        ("0000:00:00 00:00:00", None, None, None),
+        ("    :  :     :  :  ", None, None, None),
+        ("2019:02:30 14:25:01", None, None, None),
+        ("unknown", None, None, None),
+    ],
+)
+def test_parse_exif_datestamp(
+        value: str,
+        subsec: Optional[str],
+        offset: Optional[str],
+        expected: Optional[str],
+) -> None:
+    """EXIF dates should be parsed, along with their fractional seconds and offset."""
+    parsed = ds.parse_exif_datestamp(value, subsec, offset)
+
+    assert (parsed.isoformat() if parsed is not None else None) == expected
+
+
+def test_parse_exif_datestamp_matches_pendulum() -> None:
+    """The fast path should produce the same DateTimes pendulum's parser does."""
+    value = "2016:12:31 23:59:59"
+    parsed = ds.parse_exif_datestamp(value)
+    expected = pendulum.parse(value)
+
+    assert isinstance(parsed, pendulum.DateTime)
+    assert isinstance(expected, pendulum.DateTime)
+    assert parsed == expected
+    assert parsed.tzinfo == expected.tzinfo
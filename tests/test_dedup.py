@@ -0,0 +1,87 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, List
+
+from organiser import dedup as dd
+from organiser.types import FileTarget
+
+
+def _write_files(base_dir: Path, contents: Dict[str, bytes]) -> List[FileTarget]:
+    """Write the named contents into base_dir, returning a FileTarget for each."""
+    targets = []
+    for name, data in contents.items():
+        (base_dir / name).write_bytes(data)
+        targets.append(FileTarget(str(base_dir / name)))
+
+    return targets
+
+
+def test_find_duplicates_tiers(tmp_path: Path) -> None:
+    """Only identical files should be grouped, and unique sizes should never be hashed."""
+    same_edges = b"a" * 16 + b"b" * 16 + b"a" * 16
+    targets = _write_files(
+        tmp_path,
+        {
+            "unique.jpg": b"x" * 100,
+            "original.jpg": same_edges,
+            "copy.jpg": same_edges,
+            "edited.jpg": b"a" * 16 + b"c" * 16 + b"a" * 16,
+            "small_one.jpg": b"12",
+            "small_two.jpg": b"12",
+        },
+    )
+
+    groups = dd.find_duplicates(targets, edge_size=16)
+    group_names = sorted(
+        sorted(Path(target.file_path).name for target in group) for group in groups
+    )
+
+    assert group_names == [["copy.jpg", "original.jpg"], ["small_one.jpg", "small_two.jpg"]]
+
+    hashes = {Path(target.file_path).name: target.file_hash for target in targets}
+    assert hashes["unique.jpg"] is None
+    assert hashes["copy.jpg"] == hashlib.sha256(same_edges).digest()
+    assert hashes["edited.jpg"] is not None
+
+
+def test_find_duplicates_uses_known_hashes(tmp_path: Path) -> None:
+    """Targets with hashes already known (e.g. from the cache) shouldn't be read again."""
+    targets = _write_files(tmp_path, {"one.jpg": b"one", "two.jpg": b"two"})
+    for target in targets:
+        target.file_hash = b"cached"
+        target.file_stat = os.stat(target.file_path)
+        os.remove(target.file_path)
+
+    groups = dd.find_duplicates(targets)
+
+    assert groups == [targets]
+
+
+def test_mark_duplicates_keeps_first_by_path(tmp_path: Path) -> None:
+    """The first file by path in each group is the original, the rest are marked."""
+    targets = _write_files(tmp_path, {"b.jpg": b"same", "a.jpg": b"same", "c.jpg": b"diff!"})
+
+    marked = {
+        Path(target.file_path).name: target.duplicate_of
+        for target in dd.mark_duplicates(targets)
+    }
+
+    assert marked == {"a.jpg": None, "b.jpg": str(tmp_path / "a.jpg"), "c.jpg": None}
+
+
+def test_unreadable_files_are_unique(tmp_path: Path) -> None:
+    """Files removed since they were listed shouldn't stop the rest being compared."""
+    targets = _write_files(
+        tmp_path, {"a.jpg": b"same", "b.jpg": b"same", "gone.jpg": b"same"},
+    )
+    for target in targets:
+        target.file_stat = os.stat(target.file_path)
+    os.remove(tmp_path / "gone.jpg")
+
+    marked = {
+        Path(target.file_path).name: target.duplicate_of
+        for target in dd.mark_duplicates(targets)
+    }
+
+    assert marked == {"a.jpg": None, "b.jpg": str(tmp_path / "a.jpg"), "gone.jpg": None}
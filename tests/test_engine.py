@@ -0,0 +1,105 @@
+import itertools
+from typing import Iterator, List
+
+import pytest
+
+from organiser import budget as bg
+from organiser import engine
+from organiser.types import FailedTarget, FileTarget
+
+
+def _fail_odd(target: FileTarget) -> FileTarget:
+    """Stage function raising for every odd numbered target."""
+    if int(target.file_path) % 2:
+        raise ValueError("odd")
+
+    return target
+
+
+def test_pipeline_runs_stages_in_order() -> None:
+    """Every target should pass through each stage, with failures reported and dropped."""
+    failures: List[FailedTarget] = []
+    results: List[str] = []
+
+    def add_suffix(target: FileTarget) -> FileTarget:
+        target.target_move_path = target.file_path + ".moved"
+        return target
+
+    pipeline = engine.Pipeline(
+        [
+            engine.Stage("fail", _fail_odd, workers=3, queue_size=2),
+            engine.BarrierStage("sort", lambda targets: sorted(targets, key=lambda t: t.file_path)),
+            engine.Stage("suffix", add_suffix, workers=2),
+        ],
+        on_failure=failures.append,
+    )
+
+    pipeline.run(
+        (FileTarget(str(index)) for index in range(10)),
+        lambda target: results.append(target.target_move_path),
+    )
+
+    assert sorted(results) == [f"{index}.moved" for index in range(0, 10, 2)]
+    assert sorted(fail.original_record.file_path for fail in failures) == ["1", "3", "5", "7", "9"]
+    assert all(isinstance(fail.failure_reason, ValueError) for fail in failures)
+
+
+def test_pipeline_applies_backpressure() -> None:
+    """The walk should never run further ahead of the sink than the queues allow."""
+    produced: List[int] = []
+    lead: List[int] = []
+
+    def source() -> Iterator[FileTarget]:
+        for index in range(100):
+            produced.append(index)
+            yield FileTarget(str(index))
+
+    def sink(target: FileTarget) -> None:
+        lead.append(len(produced) - int(target.file_path))
+
+    pipeline = engine.Pipeline(
+        [engine.Stage("pass", lambda target: target, queue_size=2)],
+        on_failure=lambda _: None,
+        output_queue_size=2,
+    )
+    pipeline.run(source(), sink)
+
+    # Two queues of two, plus one item held by the stage worker and one by the walk.
+    assert max(lead) <= 6
+
+
+def test_pipeline_cancels_on_interrupt() -> None:
+    """Interrupting the sink should stop the workers, rather than draining the source."""
+    pulled = itertools.count()
+
+    def endless_source() -> Iterator[FileTarget]:
+        while True:
+            yield FileTarget(str(next(pulled)))
+
+    def interrupt(_: FileTarget) -> None:
+        raise KeyboardInterrupt()
+
+    pipeline = engine.Pipeline(
+        [engine.Stage("pass", lambda target: target, workers=2)],
+        on_failure=lambda _: None,
+    )
+
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.run(endless_source(), interrupt)
+
+    assert pipeline.cancelled.is_set()
+    assert next(pulled) < 500
+
+
+def test_cancelled_waits_drop_items() -> None:
+    """Items abandoned whilst waiting on a cancelled pipeline are dropped, rather than failed."""
+    failures: List[FailedTarget] = []
+
+    def abandon(target: FileTarget) -> FileTarget:
+        raise bg.Cancelled("cancelled")
+
+    pipeline = engine.Pipeline([engine.Stage("abandon", abandon)], failures.append)
+    pipeline.run((FileTarget(str(index)) for index in range(3)), lambda _: None)
+
+    assert not failures
+    assert pipeline.metrics.stages[0].dropped == 3
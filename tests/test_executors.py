@@ -0,0 +1,36 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from organiser import executors as ex
+from organiser.types import FileTarget
+
+
+@pytest.mark.parametrize("kind", list(ex.ExecutorKind))
+@pytest.mark.parametrize("hash_file", [True, False])
+def test_analyse_file_in_pool(kind: ex.ExecutorKind, hash_file: bool, tmp_path: Path) -> None:
+    """Verify analysis results make it back from both thread and process workers."""
+    sample_file = tmp_path / "IMG_0001.JPG"
+    sample_file.write_bytes(b"not really a jpeg")
+
+    with ex.make_executor(kind, workers=1) as executor:
+        analysis = executor.submit(
+            ex.analyse_file,
+            str(sample_file),
+            hash_file,
+            1024,
+        ).result()
+
+    target = ex.apply_analysis(FileTarget(str(sample_file)), analysis)
+
+    if hash_file:
+        assert target.file_hash == hashlib.sha256(b"not really a jpeg").digest()
+        assert target.encoded_hash
+    else:
+        assert target.file_hash is None
+
+    # No EXIF data, so the datestamp falls back to the files mtime.
+    assert target.datestamp is not None
+    assert target.date_tags == {}
+    assert target.file_contents is None
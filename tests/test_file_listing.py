@@ -1,11 +1,12 @@
+import hashlib
+from pathlib import Path
 from typing import List
 
-import os.path as path
 import pytest
 from _pytest.monkeypatch import MonkeyPatch
-from unittest.mock import create_autospec
 
 from organiser import file_listing as fl
+from organiser.types import FileTarget
 
 
 @pytest.mark.parametrize(
@@ -15,21 +16,133 @@ from organiser import file_listing as fl
         (r".*\.jpg", ["test/one.jpg"]),
         (r".*\.NONE", []),
         (r"\\\\\\", []),
+        (r"[", []),
     ],
 )
 def test_file_listing_iterator(
         filter: str,
         expected_result: List[str],
+        tmp_path: Path,
         monkeypatch: MonkeyPatch,
 ) -> None:
     """Verify we correctly get file lists based on provided inputs."""
-    mock_walk = create_autospec(fl.os.walk)
-    mock_walk.return_value = [
-        ("test", (None), ("one.py", "two.py", "three.py", "one.jpg")),
+    (tmp_path / "test").mkdir()
+    for file_name in ("one.py", "two.py", "three.py", "one.jpg"):
+        (tmp_path / "test" / file_name).write_bytes(b"")
+
+    monkeypatch.chdir(tmp_path)
+
+    file_listing = [file.file_path for file in fl.file_listing_iterator("test", filter)]
+
+    assert sorted(file_listing) == sorted(expected_result)
+
+
+def test_file_listing_iterator_prunes_and_filters(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Excluded directories shouldn't be descended into, and extensions should be matched."""
+    for directory in ("album/@eaDir", "album/.thumbnails", "album/nested", "skip_me"):
+        (tmp_path / "photos" / directory).mkdir(parents=True)
+
+    for file_name in (
+            "album/a.JPG",
+            "album/b.heic",
+            "album/c.png",
+            "album/jpg",
+            "album/@eaDir/a.JPG",
+            "album/.thumbnails/t.jpg",
+            "album/nested/d.jpeg",
+            "skip_me/e.jpg",
+    ):
+        (tmp_path / "photos" / file_name).write_bytes(b"12345")
+
+    monkeypatch.chdir(tmp_path)
+
+    targets = list(
+        fl.file_listing_iterator(
+            "photos",
+            extensions=fl.parse_extensions("jpg, .jpeg,HEIC"),
+            excludes=(*fl.DEFAULT_EXCLUDES, "skip_*"),
+        ),
+    )
+
+    assert sorted(target.file_path for target in targets) == [
+        "photos/album/a.JPG",
+        "photos/album/b.heic",
+        "photos/album/nested/d.jpeg",
     ]
-    monkeypatch.setattr("organiser.file_listing.os.walk", mock_walk)
 
-    base_dir = path.abspath(path.dirname(__file__))
-    file_listing = [file.file_path for file in fl.file_listing_iterator(base_dir, filter)]
+    # The stat from the walk should be carried on each target.
+    assert all(target.file_stat is not None for target in targets)
+    assert {target.file_stat.st_size for target in targets if target.file_stat} == {5}
+
+
+@pytest.mark.parametrize(
+    "file_size, header_size, chunk_size",
+    [
+        (0, 16, 8),
+        (10, 16, 8),
+        (100, 16, 8),
+        (100, 16, 7),
+        (100, 200, 64),
+    ],
+)
+def test_load_file_contents_streams_hash(
+        file_size: int,
+        header_size: int,
+        chunk_size: int,
+        tmp_path: Path,
+) -> None:
+    """Verify streaming reads hash the whole file, whilst only retaining its header."""
+    file_data = bytes(index % 251 for index in range(file_size))
+    sample_file = tmp_path / "sample.jpg"
+    sample_file.write_bytes(file_data)
+
+    target = fl.load_file_contents(
+        FileTarget(str(sample_file)),
+        header_size=header_size,
+        chunk_size=chunk_size,
+    )
+
+    assert target.file_hash == hashlib.sha256(file_data).digest()
+    assert target.file_contents == file_data[:header_size]
+
+    # Hashing again should leave the streamed digest in place.
+    assert fl.sha256_file(target).file_hash == hashlib.sha256(file_data).digest()
+
+
+@pytest.mark.parametrize(
+    "algorithm, expected_digest",
+    [
+        (fl.HashAlgorithm.sha256, hashlib.sha256(b"image data" * 1000).digest()),
+        (
+            fl.HashAlgorithm.blake2b,
+            hashlib.blake2b(b"image data" * 1000, digest_size=32).digest(),
+        ),
+    ],
+)
+def test_load_file_contents_algorithms(
+        algorithm: fl.HashAlgorithm,
+        expected_digest: bytes,
+        tmp_path: Path,
+) -> None:
+    """Files should be hashed with the requested algorithm."""
+    sample_file = tmp_path / "sample.jpg"
+    sample_file.write_bytes(b"image data" * 1000)
+
+    target = fl.load_file_contents(FileTarget(str(sample_file)), chunk_size=64, algorithm=algorithm)
+
+    assert target.file_hash == expected_digest
+
+
+def test_xxh3_availability() -> None:
+    """xxh3 should only be offered where the xxhash package is installed."""
+    try:
+        import xxhash  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        assert not fl.hash_algorithm_available(fl.HashAlgorithm.xxh3)
+        assert fl.fastest_hash_algorithm() is fl.HashAlgorithm.sha256
+        return
 
-    assert file_listing == expected_result
+    assert fl.fastest_hash_algorithm() is fl.HashAlgorithm.xxh3
+    digest = fl.new_hash(fl.HashAlgorithm.xxh3)
+    digest.update(b"image data")
+    assert digest.digest() == xxhash.xxh3_128(b"image data").digest()
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from organiser import file_ops as fo
+from organiser.types import FileTarget
+
+
+@pytest.mark.parametrize(
+    "existing, expected_names",
+    [
+        ([], ["IMG_0001.JPG", "IMG_0001(1).JPG", "IMG_0001(2).JPG"]),
+        (["IMG_0001.JPG"], ["IMG_0001(1).JPG", "IMG_0001(2).JPG", "IMG_0001(3).JPG"]),
+        (
+            ["IMG_0001.JPG", "IMG_0001(7).JPG"],
+            ["IMG_0001(8).JPG", "IMG_0001(9).JPG", "IMG_0001(10).JPG"],
+        ),
+        (["IMG_0001.jpg"], ["IMG_0001.JPG", "IMG_0001(1).JPG", "IMG_0001(2).JPG"]),
+    ],
+)
+def test_name_planner_reserve(
+        existing: List[str],
+        expected_names: List[str],
+        tmp_path: Path,
+) -> None:
+    """Verify names are suffixed beyond the highest suffix already in the directory."""
+    for file_name in existing:
+        (tmp_path / file_name).write_bytes(b"")
+
+    planner = fo.NamePlanner()
+    names = [Path(planner.reserve(str(tmp_path / "IMG_0001.JPG"))).name for _ in range(3)]
+
+    assert names == expected_names
+
+
+def test_concurrent_migrations_never_clobber(tmp_path: Path) -> None:
+    """Many files with the same name placed concurrently should all survive."""
+    sources = []
+    for index in range(50):
+        (tmp_path / "src" / str(index)).mkdir(parents=True)
+        source = tmp_path / "src" / str(index) / "IMG_0001.JPG"
+        source.write_bytes(str(index).encode())
+        sources.append(source)
+
+    destination = tmp_path / "dest" / "IMG_0001.JPG"
+    destination.parent.mkdir()
+    destination.write_bytes(b"already here")
+
+    planner = fo.NamePlanner()
+
+    def place(source: Path) -> FileTarget:
+        target = FileTarget(str(source), target_move_path=str(destination))
+        return fo.migrate_file_target(target, copy=False, planner=planner)
+
+    with ThreadPoolExecutor(8) as pool:
+        placed = list(pool.map(place, sources))
+
+    assert len({target.target_move_path for target in placed}) == 50
+    assert destination.read_bytes() == b"already here"
+    placed_contents = [path.read_bytes() for path in destination.parent.glob("IMG_0001(*).JPG")]
+    assert sorted(int(contents) for contents in placed_contents) == list(range(50))
+    assert not any(source.exists() for source in sources)
+
+
+def test_migrate_copy_keeps_source(tmp_path: Path) -> None:
+    """Copies should leave the source in place, and preserve its permissions."""
+    source = tmp_path / "IMG_0001.JPG"
+    source.write_bytes(b"data")
+    source.chmod(0o600)
+
+    target = fo.migrate_file_target(
+        FileTarget(str(source), target_move_path=str(tmp_path / "out" / "IMG_0001.JPG")),
+        copy=True,
+    )
+
+    assert target.operation_complete
+    assert source.read_bytes() == b"data"
+    assert Path(target.target_move_path).read_bytes() == b"data"
+    assert Path(target.target_move_path).stat().st_mode & 0o777 == 0o600
+
+
+def test_migrate_failure_removes_placeholder(tmp_path: Path) -> None:
+    """A failed migration shouldn't leave an empty file behind at the destination."""
+    target = FileTarget(
+        str(tmp_path / "missing.JPG"),
+        target_move_path=str(tmp_path / "out" / "missing.JPG"),
+    )
+
+    with pytest.raises(OSError):
+        fo.migrate_file_target(target, copy=False)
+
+    assert not list((tmp_path / "out").iterdir())
+
+
+def test_vacated_directories_sweep(tmp_path: Path) -> None:
+    """Only directories left empty below the root should be removed, deepest first."""
+    base_dir = tmp_path / "base"
+    (base_dir / "a" / "b" / "c").mkdir(parents=True)
+    (base_dir / "a" / "keep").mkdir()
+    (base_dir / "a" / "keep" / "notes.txt").write_text("keep me")
+    (base_dir / "d" / "e").mkdir(parents=True)
+
+    vacated = fo.VacatedDirectories(base_dir)
+    for directory in ("a/b/c", "a/b/c", "a/keep", "d/e"):
+        vacated.record(FileTarget(str(base_dir / directory / "IMG_0001.JPG")))
+
+    removed = vacated.sweep()
+
+    assert sorted(removed) == [
+        str(base_dir / "a" / "b"),
+        str(base_dir / "a" / "b" / "c"),
+        str(base_dir / "d"),
+        str(base_dir / "d" / "e"),
+    ]
+    assert removed.index(str(base_dir / "a" / "b" / "c")) < removed.index(str(base_dir / "a" / "b"))
+    assert (base_dir / "a" / "keep" / "notes.txt").exists()
+    assert base_dir.is_dir()
+    assert vacated.sweep() == []
+
+
+def test_vacated_directories_outside_root(tmp_path: Path) -> None:
+    """Directories outside the root are never touched."""
+    (tmp_path / "base").mkdir()
+    (tmp_path / "elsewhere").mkdir()
+
+    vacated = fo.VacatedDirectories(tmp_path / "base")
+    vacated.record(FileTarget(str(tmp_path / "elsewhere" / "IMG_0001.JPG")))
+
+    assert vacated.sweep() == []
+    assert (tmp_path / "elsewhere").is_dir()
@@ -0,0 +1,66 @@
+import base64
+import hashlib
+
+import pendulum
+import pytest
+from pendulum.tz import fixed_timezone
+
+from organiser.types import FileTarget
+
+
+@pytest.mark.parametrize(
+    "datestamp",
+    [
+        pendulum.datetime(2019, 2, 3, 14, 25, 1),
+        pendulum.datetime(2019, 2, 3, 14, 25, 1, 250000, tz=fixed_timezone(3600)),
+        pendulum.datetime(2019, 2, 3, 14, 25, 1, tz=fixed_timezone(-19800)),
+        pendulum.datetime(1965, 7, 1, 9, 0, 0, 1),
+    ],
+)
+def test_datestamp_round_trip(datestamp: pendulum.DateTime) -> None:
+    """Datestamps should be restored exactly, keeping the offset they were taken at."""
+    target = FileTarget("IMG_0001.JPG", datestamp=datestamp)
+
+    assert target.datestamp is not None
+    assert target.datestamp.isoformat() == datestamp.isoformat()
+    assert (target.datestamp.year, target.datestamp.month) == (datestamp.year, datestamp.month)
+    # Built once, on first access.
+    assert target.datestamp is target.datestamp
+
+    target.datestamp = None
+    assert target.datestamp is None
+
+
+def test_compact_fields() -> None:
+    """Targets shouldn't carry a __dict__, and should derive what they can on demand."""
+    target = FileTarget("IMG_0001.JPG", file_hash=hashlib.sha256(b"image").digest())
+
+    assert not hasattr(target, "__dict__")
+    assert target.encoded_hash == base64.b64encode(hashlib.sha256(b"image").digest()).decode()
+    assert FileTarget("IMG_0002.JPG").encoded_hash is None
+
+    assert target.date_tags == {}
+    target.date_tags = {"EXIF DateTimeOriginal": "2019:02:03 14:25:01", "Other": "ignored"}
+    assert target.date_tags == {"EXIF DateTimeOriginal": "2019:02:03 14:25:01"}
+
+
+def test_update() -> None:
+    """Updating should only fill unset values, unless overwriting."""
+    target = FileTarget("IMG_0001.JPG", target_move_path="2019/02/IMG_0001.JPG")
+    other = FileTarget(
+        "elsewhere/IMG_0001.JPG",
+        file_hash=b"\x01" * 32,
+        datestamp=pendulum.datetime(2019, 2, 3, tz=fixed_timezone(3600)),
+        target_move_path="2020/01/IMG_0001.JPG",
+    )
+    other.date_tags = {"Image DateTime": "2019:02:03 00:00:00"}
+
+    target.update(other)
+
+    assert target.file_path == "IMG_0001.JPG"
+    assert target.file_hash == b"\x01" * 32
+    assert target.datestamp == pendulum.datetime(2019, 2, 3, tz=fixed_timezone(3600))
+    assert target.date_tags == {"Image DateTime": "2019:02:03 00:00:00"}
+    assert target.target_move_path == "2019/02/IMG_0001.JPG"
+
+    assert target.update(other, overwrite=True).target_move_path == "2020/01/IMG_0001.JPG"
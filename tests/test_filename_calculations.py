@@ -1,5 +1,5 @@
-import pytest
 import pendulum
+import pytest
 
 from organiser import filename_calculations as fc
 
@@ -10,7 +10,7 @@ def test_identify_move_path() -> None:
     """
     sample_target = fc.FileTarget("IMG_4228.JPG")
     sample_target.datestamp = pendulum.parse("2015/05/04")
-    expected_result = "2015/05/2015.05.04_IMG_4228.JPG"
+    expected_result = "2015/05/IMG_4228.JPG"
 
     output = fc.identify_photo_move_path("", sample_target)
     assert output.target_move_path == expected_result
@@ -22,12 +22,12 @@ def test_identify_move_path() -> None:
         (
             "2015.05.03 Curry with Mates/IMG_4228.JPG",
             pendulum.parse("2015/05/05"),
-            "2015/05/2015.05 Curry with Mates/2015.05.05_IMG_4228.JPG",
+            "2015/05/2015.05 Curry with Mates/IMG_4228.JPG",
         ),
         (
             "some_folder/some other folder/2015.05.03 Curry with Mates/IMG_4228.JPG",
             pendulum.parse("2015/05/05"),
-            "2015/05/2015.05 Curry with Mates/2015.05.05_IMG_4228.JPG",
+            "2015/05/2015.05 Curry with Mates/IMG_4228.JPG",
         ),
     ],
 )
@@ -51,11 +51,11 @@ def test_identify_move_with_album_name(
     [
         (
             "foobar",
-            "foobar/2015/05/2015.05.05_IMG_4228.JPG",
+            "foobar/2015/05/IMG_4228.JPG",
         ),
         (
             "some_folder/some other folder/",
-            "some_folder/some other folder/2015/05/2015.05.05_IMG_4228.JPG",
+            "some_folder/some other folder/2015/05/IMG_4228.JPG",
         ),
     ],
 )
@@ -73,3 +73,54 @@ def test_identity_move_with_prefix(
     output = fc.identify_photo_move_path(prefix, sample_file_target)
 
     assert output.target_move_path == expected_result
+
+
+@pytest.mark.parametrize(
+    "directory, expected_result",
+    [
+        ("", fc.DirectoryPlacement()),
+        ("DCIM/100CAMERA", fc.DirectoryPlacement()),
+        ("2015/05", fc.DirectoryPlacement()),
+        ("2015.05", fc.DirectoryPlacement("2015", "05")),
+        ("photos/2015-5_03", fc.DirectoryPlacement("2015", "5", day="03")),
+        (
+            "photos/2015.05.03 Curry with Mates",
+            fc.DirectoryPlacement("2015", "05", "Curry with Mates", "03"),
+        ),
+        (
+            "photos//2015.05.03 Curry with Mates/./Day 2",
+            fc.DirectoryPlacement("2015", "05", "Curry with Mates/Day 2", "03"),
+        ),
+    ],
+)
+def test_resolve_directory(directory: str, expected_result: fc.DirectoryPlacement) -> None:
+    """Verify the year, month and album are identified from the directory alone."""
+    assert fc.resolve_directory(directory) == expected_result
+
+
+def test_identify_move_path_resolves_directory_once() -> None:
+    """Files sharing a directory should share its resolution, whilst still
+    taking the album's date prefix from each file's own datestamp.
+    """
+    fc.resolve_directory.cache_clear()
+
+    first = fc.FileTarget("2015.05.03 Curry with Mates/IMG_4228.JPG")
+    first.datestamp = pendulum.datetime(2015, 5, 5)
+    second = fc.FileTarget("2015.05.03 Curry with Mates/IMG_4229.JPG")
+    second.datestamp = pendulum.datetime(2015, 6, 1)
+
+    assert fc.identify_photo_move_path("out", first).target_move_path == (
+        "out/2015/05/2015.05 Curry with Mates/IMG_4228.JPG"
+    )
+    assert fc.identify_photo_move_path("out", second).target_move_path == (
+        "out/2015/05/2015.06 Curry with Mates/IMG_4229.JPG"
+    )
+
+    cache_info = fc.resolve_directory.cache_info()
+    assert (cache_info.misses, cache_info.hits) == (1, 1)
+
+
+def test_identify_move_path_without_datestamp() -> None:
+    """A target without a datestamp can't be placed."""
+    with pytest.raises(ValueError):
+        fc.identify_photo_move_path("out", fc.FileTarget("IMG_4228.JPG"))
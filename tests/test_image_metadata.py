@@ -0,0 +1,84 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from benchmarks import corpus as cp
+from organiser import file_listing as fl
+from organiser import image_metadata as im
+from organiser.types import FileTarget
+
+SAMPLE_DATES = {
+    "Image DateTime": "2019:02:03 14:25:01",
+    "EXIF DateTimeOriginal": "2019:02:03 14:25:01",
+    "EXIF DateTimeDigitized": "2019:02:03 14:25:02",
+}
+
+
+def _exif_jpeg(padding: int = 100_000) -> bytes:
+    """Build a minimal JPEG, with an APP1 Exif segment holding SAMPLE_DATES."""
+    return cp.jpeg(
+        datetime(2019, 2, 3, 14, 25, 1),
+        b"\x00" * padding,
+        [cp.ascii_entry(0x9004, SAMPLE_DATES["EXIF DateTimeDigitized"])],
+    )
+
+
+def test_get_file_meta_reads_date_tags() -> None:
+    """Verify the date tags are parsed from a header-only read of a file."""
+    metadata = im.get_file_meta(_exif_jpeg(padding=0))
+
+    assert {tag: metadata[tag].printable for tag in SAMPLE_DATES} == SAMPLE_DATES
+
+
+def test_get_file_meta_handles_truncated_header() -> None:
+    """A header cut short should never raise, tags beyond the cut are simply missing."""
+    metadata = im.get_file_meta(_exif_jpeg()[:10])
+
+    assert "EXIF DateTimeOriginal" not in metadata
+
+
+@pytest.mark.parametrize(
+    "budget, expect_dates",
+    [
+        (64 * 1024, True),
+        (40, False),
+    ],
+)
+def test_load_file_header_reads_exif_region_only(
+        budget: int,
+        expect_dates: bool,
+        tmp_path: Path,
+) -> None:
+    """Only the APP1 region of a JPEG should be read, and never more than the budget."""
+    sample_data = _exif_jpeg()
+    sample_file = tmp_path / "IMG_0001.JPG"
+    sample_file.write_bytes(sample_data)
+
+    target = fl.load_file_header(FileTarget(str(sample_file)), header_size=budget)
+
+    assert target.file_contents is not None
+    assert len(target.file_contents) <= budget
+    assert len(target.file_contents) < len(sample_data) // 100
+    assert target.file_hash is None
+
+    target = im.identify_image_datestamp(im.parse_image_meta_for_file_target(target))
+
+    assert (target.date_tags == SAMPLE_DATES) is expect_dates
+
+
+def test_identify_image_datestamp_applies_offset_and_subsec() -> None:
+    """The OffsetTime and SubSecTime tags accompanying a date should be applied to it."""
+    jpeg = cp.jpeg(
+        datetime(2019, 2, 3, 14, 25, 1),
+        b"",
+        [cp.ascii_entry(0x9011, "+01:00"), cp.ascii_entry(0x9291, "250")],
+    )
+
+    target = im.identify_image_datestamp(
+        im.parse_image_meta_for_file_target(FileTarget("IMG_0001.JPG", file_contents=jpeg)),
+    )
+
+    assert target.datestamp is not None
+    assert target.datestamp.isoformat() == "2019-02-03T14:25:01.250000+01:00"
+    assert target.date_tags["EXIF DateTimeOriginal"] == "2019:02:03 14:25:01"
@@ -0,0 +1,198 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from organiser import file_listing as fl
+from organiser import file_ops as fo
+from organiser import journal as jn
+from organiser.types import FileTarget
+
+
+def _source(tmp_path: Path, contents: bytes = b"image data") -> FileTarget:
+    """Create a hashed source file, destined for storage."""
+    source = tmp_path / "source" / "IMG_0001.JPG"
+    source.parent.mkdir(exist_ok=True)
+    source.write_bytes(contents)
+
+    target = FileTarget(str(source), file_stat=os.stat(source))
+    target.file_hash = fl.stream_file(str(source), header_size=0)[1]
+    target.target_move_path = str(tmp_path / "storage" / "2019" / "02" / "IMG_0001.JPG")
+
+    return target
+
+
+def _interrupted_placement(tmp_path: Path, copy: bool) -> Tuple[jn.Journal, FileTarget]:
+    """Plan a placement, without completing it."""
+    journal = jn.Journal(tmp_path / "journal.jsonl")
+    target = _source(tmp_path)
+    journal.planned(target, copy)
+    journal.close()
+
+    Path(target.target_move_path).parent.mkdir(parents=True)
+    return jn.Journal(tmp_path / "journal.jsonl"), target
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_recover_rolls_back_partial_placements(copy: bool, tmp_path: Path) -> None:
+    """Partially written destinations should be removed, leaving the source to place again."""
+    journal, target = _interrupted_placement(tmp_path, copy)
+    Path(target.target_move_path).write_bytes(b"image")
+
+    assert journal.recover() == jn.RecoveryReport(finished=0, rolled_back=1)
+    assert not os.path.exists(target.target_move_path)
+    assert os.path.exists(target.file_path)
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_recover_finishes_intact_placements(copy: bool, tmp_path: Path) -> None:
+    """Fully written destinations should be kept, removing the source of moves."""
+    journal, target = _interrupted_placement(tmp_path, copy)
+    Path(target.target_move_path).write_bytes(b"image data")
+
+    assert journal.recover(resume=True) == jn.RecoveryReport(finished=1, rolled_back=0)
+    assert Path(target.target_move_path).read_bytes() == b"image data"
+    assert os.path.exists(target.file_path) == copy
+
+
+def test_recover_finished_renames(tmp_path: Path) -> None:
+    """A move whose source has gone was renamed into place, and is complete."""
+    journal, target = _interrupted_placement(tmp_path, copy=False)
+    os.rename(target.file_path, target.target_move_path)
+
+    assert journal.recover() == jn.RecoveryReport(finished=1, rolled_back=0)
+    assert os.path.exists(target.target_move_path)
+
+
+def test_resume_skips_completed(tmp_path: Path) -> None:
+    """Resumed runs should skip files which were placed, unless they changed since."""
+    target = _source(tmp_path)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        fo.migrate_file_target(target, True, on_planned=lambda item: journal.planned(item, True))
+        journal.completed(target, True)
+
+    # A crash whilst writing the next record leaves it torn.
+    with open(tmp_path / "journal.jsonl", "a") as journal_file:
+        journal_file.write('{"op": "planned", "oper')
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        assert journal.recover(resume=True) == jn.RecoveryReport(finished=0, rolled_back=0)
+        assert journal.is_completed(FileTarget(target.file_path))
+
+        Path(target.file_path).write_bytes(b"edited image data")
+        assert not journal.is_completed(FileTarget(target.file_path))
+
+        journal.planned(target, True)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        journal._file.seek(0)
+        assert journal._file.readlines()[-1].startswith('{"op": "planned", "operation"')
+
+
+def test_new_runs_clear_the_journal(tmp_path: Path) -> None:
+    """Without resuming, the journal starts afresh once recovered."""
+    target = _source(tmp_path)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        journal.planned(target, True)
+        journal.completed(target, True)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        journal.recover()
+        assert not journal.is_completed(target)
+
+    assert (tmp_path / "journal.jsonl").read_text() == ""
+
+
+def test_recover_checks_with_recorded_algorithm(tmp_path: Path) -> None:
+    """Destinations should be checked with the algorithm recorded, SHA256 for older records."""
+    target = _source(tmp_path)
+    target.file_hash = fl.stream_file(
+        target.file_path,
+        header_size=0,
+        algorithm=fl.HashAlgorithm.blake2b,
+    )[1]
+
+    with jn.Journal(tmp_path / "journal.jsonl", hash_algorithm=fl.HashAlgorithm.blake2b) as journal:
+        journal.planned(target, True)
+
+    # Records written before the algorithm was recorded lack it, and are SHA256.
+    older_source = tmp_path / "source" / "IMG_0002.JPG"
+    older_source.write_bytes(b"image data")
+    older = jn.Operation(
+        source=str(older_source),
+        destination=str(tmp_path / "storage" / "IMG_0002.JPG"),
+        copy=True,
+        size=len(b"image data"),
+        mtime_ns=0,
+        encoded_hash=fl.b64_encode(fl.stream_file(str(older_source), header_size=0)[1]),
+    )
+    with open(tmp_path / "journal.jsonl", "a") as journal_file:
+        journal_file.write(json.dumps({"op": jn.PLANNED, "operation": list(older)[:-1]}) + "\n")
+
+    Path(target.target_move_path).parent.mkdir(parents=True)
+    Path(target.target_move_path).write_bytes(b"image data")
+    Path(older.destination).write_bytes(b"image data")
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        assert journal.recover() == jn.RecoveryReport(finished=2, rolled_back=0)
+
+
+@pytest.mark.parametrize("copy", [True, False])
+@pytest.mark.parametrize("placed, finished", [(b"image data", True), (b"image_data", False)])
+def test_recover_without_hash(copy: bool, placed: bytes, finished: bool, tmp_path: Path) -> None:
+    """Placements recorded without a hash should be checked against their source instead."""
+    target = _source(tmp_path)
+    target.file_hash = None
+    Path(target.target_move_path).parent.mkdir(parents=True)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        journal.planned(target, copy)
+    Path(target.target_move_path).write_bytes(placed)
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        assert journal.recover() == jn.RecoveryReport(finished, not finished)
+
+    assert os.path.exists(target.target_move_path) == finished
+    assert os.path.exists(target.file_path) == (copy or not finished)
+
+
+def test_journal_is_locked(tmp_path: Path) -> None:
+    """A journal in use by one run shouldn't be opened, and so recovered, by another."""
+    with jn.Journal(tmp_path / "journal.jsonl"):
+        with pytest.raises(jn.JournalInUse):
+            jn.Journal(tmp_path / "journal.jsonl")
+
+    jn.Journal(tmp_path / "journal.jsonl").close()
+
+
+def test_records_without_op_are_ignored(tmp_path: Path) -> None:
+    """Well formed records lacking an op shouldn't stop the journal being read."""
+    target = _source(tmp_path)
+    operation = jn.Operation(target.file_path, target.target_move_path, True, 1, 0, None)
+    with open(tmp_path / "journal.jsonl", "w") as journal_file:
+        journal_file.write(json.dumps({"operation": list(operation)}) + "\n")
+
+    with jn.Journal(tmp_path / "journal.jsonl") as journal:
+        assert journal.recover() == jn.RecoveryReport(finished=0, rolled_back=0)
+
+
+def test_existing_files_are_never_journaled(tmp_path: Path) -> None:
+    """Only destinations created by the placement should be journaled, and so recoverable."""
+    target = _source(tmp_path)
+    Path(target.target_move_path).parent.mkdir(parents=True)
+    Path(target.target_move_path).write_bytes(b"someone else's")
+    planned: List[FileTarget] = []
+
+    fo.migrate_file_target(
+        target, True, fo.NamePlanner(list_existing=False), on_planned=planned.append,
+    )
+
+    assert [item.target_move_path for item in planned] == [target.target_move_path]
+    assert target.target_move_path.endswith("IMG_0001(1).JPG")
+    assert Path(target.target_move_path).with_name("IMG_0001.JPG").read_bytes() == (
+        b"someone else's"
+    )
@@ -0,0 +1,114 @@
+import json
+from pathlib import Path
+from typing import List, Optional
+
+from organiser import engine
+from organiser import metrics as mt
+from organiser.types import FailedTarget, FileTarget
+
+
+def test_histogram() -> None:
+    """Latencies should be counted into cumulative buckets, with quantiles estimated from them."""
+    histogram = mt.Histogram((0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(seconds)
+
+    assert histogram.buckets() == {"0.1": 2, "1.0": 3, "+Inf": 4}
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == 2.0
+    assert mt.Histogram().quantile(0.5) == 0.0
+
+
+def _drop_odd(target: FileTarget) -> Optional[FileTarget]:
+    """Stage function dropping every odd numbered target."""
+    return None if int(target.file_path) % 2 else target
+
+
+def _fail_sixes(target: FileTarget) -> FileTarget:
+    """Stage function raising for every sixth target."""
+    if int(target.file_path) % 6 == 0:
+        raise ValueError("six")
+
+    return target
+
+
+def _first_two(targets: List[FileTarget]) -> List[FileTarget]:
+    return sorted(targets, key=lambda target: int(target.file_path))[:2]
+
+
+def test_pipeline_metrics() -> None:
+    """Each stage should count the items it received, and how each of them left it."""
+    failures: List[FailedTarget] = []
+    pipeline = engine.Pipeline(
+        [
+            engine.Stage("drop", _drop_odd, workers=2),
+            engine.Stage("fail", _fail_sixes, workers=2),
+            engine.BarrierStage("first", _first_two),
+        ],
+        on_failure=failures.append,
+    )
+
+    pipeline.run((FileTarget(str(index)) for index in range(1, 13)), lambda _: None)
+
+    snapshot = pipeline.metrics.snapshot(pipeline.queue_depths())
+    assert snapshot["walked"] == 12
+    assert snapshot["walk_finished"]
+    assert snapshot["completed"] == 2
+    assert snapshot["finished"] == 12
+
+    stages = snapshot["stages"]
+    assert isinstance(stages, dict)
+    assert [
+        (values["received"], values["emitted"], values["dropped"], values["failed"])
+        for values in stages.values()
+    ] == [(12, 6, 6, 0), (6, 4, 0, 2), (4, 2, 2, 0)]
+    assert all(values["in_flight"] == 0 for values in stages.values())
+    assert stages["drop"]["latency_seconds"]["count"] == 12
+
+
+def test_reporter_exports(tmp_path: Path) -> None:
+    """Reports should be appended as JSON lines, and replace the Prometheus textfile."""
+    pipeline = engine.Pipeline([engine.Stage("pass", lambda target: target)], lambda _: None)
+    reporter = mt.MetricsReporter(
+        pipeline.metrics,
+        pipeline.queue_depths,
+        interval=60,
+        json_path=tmp_path / "metrics.jsonl",
+        prometheus_path=tmp_path / "metrics.prom",
+        progress=False,
+    )
+
+    with reporter:
+        pipeline.run((FileTarget(str(index)) for index in range(5)), lambda _: None)
+        reporter.report()
+
+    reports = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert len(reports) == 2
+    assert reports[-1]["completed"] == 5
+    assert reports[-1]["eta_seconds"] == 0
+
+    textfile = (tmp_path / "metrics.prom").read_text()
+    assert 'organiser_stage_items_total{stage="pass",outcome="emitted"} 5\n' in textfile
+    assert 'organiser_stage_latency_seconds_bucket{stage="pass",le="+Inf"} 5\n' in textfile
+    assert "# TYPE organiser_stage_latency_seconds histogram\n" in textfile
+    assert not list(tmp_path.glob(".*.tmp"))
+
+    assert mt.progress_line(reports[-1]).startswith("Processed 5 of 5 files (")
+
+
+def test_unwritable_exports_are_logged(tmp_path: Path) -> None:
+    """The final report failing to write shouldn't fail the run it reports on."""
+    pipeline = engine.Pipeline([engine.Stage("pass", lambda target: target)], lambda _: None)
+    reporter = mt.MetricsReporter(
+        pipeline.metrics,
+        pipeline.queue_depths,
+        interval=60,
+        prometheus_path=tmp_path / "missing" / "metrics.prom",
+        progress=False,
+    )
+
+    with reporter:
+        pipeline.run((FileTarget(str(index)) for index in range(5)), lambda _: None)
+
+    assert pipeline.metrics.completed == 5
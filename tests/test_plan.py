@@ -0,0 +1,276 @@
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from organiser import file_listing as fl
+from organiser import main
+from organiser import plan as pl
+from organiser.types import FileTarget
+
+HEADER = pl.PlanHeader(base_dir="/photos", storage_dir="/library")
+
+
+def _entry(source: str, target: str, encoded_hash: str) -> pl.PlanEntry:
+    return pl.PlanEntry(source, target, 1, 0, encoded_hash, None, "exif")
+
+
+def _write_plan(plan_path: Path, header: pl.PlanHeader, entries: List[pl.PlanEntry]) -> Path:
+    with pl.PlanWriter(plan_path, header) as writer:
+        for entry in entries:
+            writer.write(entry)
+
+    return plan_path
+
+
+@pytest.mark.parametrize(
+    "shard, expected_result",
+    [("1/1", pl.Shard(1, 1)), ("2/4", pl.Shard(2, 4)), (" 3 / 3 ", pl.Shard(3, 3))],
+)
+def test_parse_shard(shard: str, expected_result: pl.Shard) -> None:
+    """Shards should be parsed from number/total, numbered from 1."""
+    assert pl.parse_shard(shard) == expected_result
+
+
+def test_parse_shard_rejects() -> None:
+    """Shards which don't exist, or don't parse, should be rejected."""
+    for shard in ("0/4", "5/4", "1", "a/b"):
+        with pytest.raises(ValueError):
+            pl.parse_shard(shard)
+
+
+@pytest.mark.parametrize("key", list(pl.ShardKey))
+def test_every_file_in_one_shard(key: pl.ShardKey) -> None:
+    """Every path should belong to exactly one shard, by directory keeping albums together."""
+    paths = [
+        os.path.join(f"album {album}", f"IMG_{photo:04d}.JPG")
+        for album in range(20)
+        for photo in range(20)
+    ]
+    shards = [pl.Shard(number, 4) for number in range(1, 5)]
+
+    owners = {path: [shard for shard in shards if shard.owns(path, key)] for path in paths}
+
+    assert all(len(owner) == 1 for owner in owners.values())
+    assert len({owner[0] for owner in owners.values()}) > 1
+    if key is pl.ShardKey.directory:
+        assert len({owners[path][0] for path in paths[:20]}) == 1
+
+
+@pytest.mark.parametrize("key", list(pl.ShardKey))
+def test_sharded_listing(key: pl.ShardKey, tmp_path: Path) -> None:
+    """The listings of every shard should together hold each file of the tree once."""
+    for album in range(6):
+        for photo in range(3):
+            path = tmp_path / f"album {album}" / "day" / f"IMG_{photo}.JPG"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+    (tmp_path / "IMG_top.JPG").touch()
+
+    def listed(shard: pl.Shard) -> List[str]:
+        return [
+            os.path.abspath(target.file_path)
+            for target in pl.sharded_listing(tmp_path, shard, key, extensions=frozenset(["jpg"]))
+        ]
+
+    everything = sorted(listed(pl.WHOLE_TREE))
+    assert len(everything) == 19
+    assert sorted(path for number in (1, 2, 3) for path in listed(pl.Shard(number, 3))) == (
+        everything
+    )
+
+
+def test_plan_round_trip(tmp_path: Path) -> None:
+    """Plans should be read back as written, with paths relative to their directories."""
+    source = tmp_path / "photos" / "DCIM" / "IMG_0001.JPG"
+    source.parent.mkdir(parents=True)
+    source.write_bytes(b"photo")
+
+    header = pl.PlanHeader(str(tmp_path / "photos"), str(tmp_path / "library"))
+    target = FileTarget(
+        str(source),
+        file_hash=b"\x01" * 32,
+        target_move_path=str(tmp_path / "library" / "2019" / "02" / "IMG_0001.JPG"),
+    )
+    target.date_source = "filename"
+
+    plan_path = tmp_path / "plan.jsonl"
+    with pl.PlanWriter(plan_path, header) as writer:
+        writer.add(target)
+
+    assert pl.read_header(plan_path) == header
+    entries = list(pl.read_entries(plan_path))
+    assert [entry[:3] for entry in entries] == [
+        (os.path.join("DCIM", "IMG_0001.JPG"), os.path.join("2019", "02", "IMG_0001.JPG"), 5),
+    ]
+
+    restored = pl.PlannedTarget(entries[0], "/mnt/photos", "/mnt/library")
+    assert restored.file_path == os.path.join("/mnt/photos", "DCIM", "IMG_0001.JPG")
+    assert restored.target_move_path == os.path.join("/mnt/library", "2019", "02", "IMG_0001.JPG")
+    assert restored.file_hash == target.file_hash
+    assert restored.date_source == "filename"
+
+
+def test_failed_plans_are_discarded(tmp_path: Path) -> None:
+    """Nothing should be left at the plan's path if planning fails part way."""
+    plan_path = tmp_path / "plan.jsonl"
+
+    with pytest.raises(RuntimeError):
+        with pl.PlanWriter(plan_path, HEADER) as writer:
+            writer.write(_entry("a.jpg", "a.jpg", "aaaa"))
+            raise RuntimeError("interrupted")
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_plans_closed_early_are_left_alone(tmp_path: Path) -> None:
+    """Leaving the context manager should not close plans again, once closed or discarded."""
+    with pl.PlanWriter(tmp_path / "kept.jsonl", HEADER) as writer:
+        writer.close()
+
+    with pl.PlanWriter(tmp_path / "dropped.jsonl", HEADER) as writer:
+        writer.discard()
+
+    assert [path.name for path in tmp_path.iterdir()] == ["kept.jsonl"]
+
+
+def test_merge_plans(tmp_path: Path) -> None:
+    """Duplicates across shards should be dropped, and shared destinations renamed."""
+    in_place = os.path.relpath("/library/2019/01/IMG_0001.JPG", "/photos")
+    first = _write_plan(
+        tmp_path / "1.jsonl",
+        HEADER._replace(shard="1/3"),
+        [
+            _entry("b/IMG_0001.JPG", "2019/01/IMG_0001.JPG", "bbbb"),
+            _entry("b/IMG_0002.JPG", "2019/01/IMG_0002.JPG", "cccc"),
+        ],
+    )
+    second = _write_plan(
+        tmp_path / "2.jsonl",
+        HEADER._replace(shard="2/3"),
+        [
+            _entry("a/IMG_0002.JPG", "2019/01/IMG_0002.JPG", "cccc"),
+            _entry(in_place, "2019/01/IMG_0001.JPG", "dddd"),
+        ],
+    )
+
+    report = pl.merge_plans([first, second], tmp_path / "merged.jsonl")
+
+    assert report == pl.MergeReport(planned=3, duplicates=1, renamed=1, missing_shards=(3,))
+    assert pl.read_header(tmp_path / "merged.jsonl").shard == "1/1"
+    assert [
+        (entry.source, entry.target) for entry in pl.read_entries(tmp_path / "merged.jsonl")
+    ] == [
+        (in_place, "2019/01/IMG_0001.JPG"),
+        ("a/IMG_0002.JPG", "2019/01/IMG_0002.JPG"),
+        ("b/IMG_0001.JPG", "2019/01/IMG_0001(1).JPG"),
+    ]
+
+    report = pl.merge_plans([second, first], tmp_path / "all.jsonl", dedup=False)
+    assert (report.planned, report.duplicates, report.renamed) == (4, 0, 2)
+
+
+def test_merge_rejects_mismatched_plans(tmp_path: Path) -> None:
+    """Plans of the same shard, or of an invalid one, or hashed differently, can't be merged."""
+    first = _write_plan(tmp_path / "1.jsonl", HEADER._replace(shard="1/2"), [])
+    repeat = _write_plan(tmp_path / "1b.jsonl", HEADER._replace(shard="1/2"), [])
+    other_hash = _write_plan(
+        tmp_path / "2.jsonl",
+        HEADER._replace(shard="2/2", hash_algorithm="blake2b"),
+        [],
+    )
+    corrupt = _write_plan(tmp_path / "3.jsonl", HEADER._replace(shard="two of three"), [])
+
+    for plans in ([first, repeat], [first, other_hash], [first, corrupt]):
+        with pytest.raises(ValueError):
+            pl.merge_plans(plans, tmp_path / "merged.jsonl")
+
+    (tmp_path / "junk.jsonl").write_text("not a plan\n")
+    with pytest.raises(ValueError):
+        pl.read_header(tmp_path / "junk.jsonl")
+
+
+def _plan_library(tmp_path: Path) -> Path:
+    """Plan the placement of two photos, as a dry run would, returning the plan's path."""
+    photos = tmp_path / "photos"
+    library = tmp_path / "library"
+    header = pl.PlanHeader(
+        str(photos), str(library), hash_algorithm=fl.DEFAULT_HASH_ALGORITHM.value,
+    )
+
+    (photos / "DCIM").mkdir(parents=True)
+    with pl.PlanWriter(tmp_path / "plan.jsonl", header) as writer:
+        for name in ("IMG_0001.JPG", "IMG_0002.JPG"):
+            (photos / "DCIM" / name).write_bytes(name.encode())
+            writer.add(
+                FileTarget(
+                    str(photos / "DCIM" / name),
+                    target_move_path=str(library / "2019" / "01" / name),
+                ),
+            )
+
+    return writer.plan_path
+
+
+def test_apply(tmp_path: Path) -> None:
+    """Applying a plan should place each of its files where it was planned."""
+    plan_path = _plan_library(tmp_path)
+    photos = tmp_path / "photos"
+    library = tmp_path / "library"
+    # Already taken, so the file planned here has to be placed under another name.
+    (library / "2019" / "01").mkdir(parents=True)
+    (library / "2019" / "01" / "IMG_0002.JPG").write_bytes(b"other")
+
+    main.apply(plan_path, progress=False)
+
+    assert (library / "2019" / "01" / "IMG_0001.JPG").read_bytes() == b"IMG_0001.JPG"
+    assert (library / "2019" / "01" / "IMG_0002(1).JPG").read_bytes() == b"IMG_0002.JPG"
+    assert not list(photos.iterdir())
+
+
+def test_apply_resumes(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    """Files the run being resumed already moved should be skipped, rather than failing."""
+    plan_path = _plan_library(tmp_path)
+    main.apply(plan_path, progress=False)
+    capsys.readouterr()
+
+    main.apply(plan_path, resume=True, progress=False)
+
+    output = capsys.readouterr().out
+    assert "Moved" not in output
+    assert "Encountered 0 Records" in output
+
+
+def test_check_planned(tmp_path: Path) -> None:
+    """Files should be passed on if unchanged, dropped if removed, and replanned if changed."""
+    plan_path = _plan_library(tmp_path)
+    header = pl.read_header(plan_path)
+    unchanged, changed = (
+        pl.PlannedTarget(entry, header.base_dir, header.storage_dir)
+        for entry in pl.read_entries(plan_path)
+    )
+    removed = pl.PlannedTarget(
+        _entry("DCIM/IMG_0003.JPG", "2019/01/IMG_0003.JPG", "dddd"),
+        header.base_dir,
+        header.storage_dir,
+    )
+
+    with open(changed.file_path, "ab") as changed_file:
+        changed_file.write(b" edited")
+
+    replanned: List[FileTarget] = []
+
+    def replan(target: FileTarget) -> FileTarget:
+        replanned.append(target)
+        return target
+
+    assert main.check_planned(unchanged, replan) is unchanged
+    assert main.check_planned(removed, replan) is None
+    assert main.check_planned(changed) is None
+    assert not replanned
+
+    result = main.check_planned(changed, replan)
+    assert result is not None and not isinstance(result, pl.PlannedTarget)
+    assert [target.file_path for target in replanned] == [changed.file_path]
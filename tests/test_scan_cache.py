@@ -0,0 +1,125 @@
+import base64
+import os
+from pathlib import Path
+
+import pendulum
+
+from organiser import file_listing as fl
+from organiser import scan_cache as sc
+from organiser.types import FileTarget
+
+
+def _scanned_target(file_path: Path) -> FileTarget:
+    """Return a FileTarget as it would look after hashing and metadata processing."""
+    target = FileTarget(str(file_path))
+    target.file_hash = b"\x01" * 32
+    target.date_tags = {"EXIF DateTimeOriginal": "2019:02:03 14:25:01"}
+    target.datestamp = pendulum.datetime(2019, 2, 3, 14, 25, 1)
+
+    return target
+
+
+def test_cache_round_trip(tmp_path: Path) -> None:
+    """Verify stored scan results are restored for an unchanged file."""
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        cache.store(_scanned_target(image))
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        restored = cache.fill(FileTarget(str(image)))
+
+        assert restored.from_cache
+        assert restored.file_hash == b"\x01" * 32
+        assert restored.encoded_hash == base64.b64encode(b"\x01" * 32).decode()
+        assert restored.date_tags == {"EXIF DateTimeOriginal": "2019:02:03 14:25:01"}
+        assert restored.datestamp == pendulum.datetime(2019, 2, 3, 14, 25, 1)
+        assert cache.hits == 1
+
+
+def test_cache_invalidated_by_modification(tmp_path: Path) -> None:
+    """Changing a file's size or mtime should cause a cache miss."""
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        cache.store(_scanned_target(image))
+
+        image.write_bytes(b"edited image data")
+        os.utime(image, ns=(0, 0))
+
+        restored = cache.fill(FileTarget(str(image)))
+
+        assert not restored.from_cache
+        assert restored.file_hash is None
+        assert cache.misses == 1
+
+
+def test_cache_rebuild_discards_entries(tmp_path: Path) -> None:
+    """Rebuilding the cache should drop everything previously stored."""
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        cache.store(_scanned_target(image))
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3", rebuild=True) as cache:
+        assert len(cache) == 0
+        assert not cache.fill(FileTarget(str(image))).from_cache
+
+
+def test_cache_trim_enforces_max_entries(tmp_path: Path) -> None:
+    """Only the most recently seen max_entries records should survive a trim."""
+    with sc.ScanCache(tmp_path / "cache.sqlite3", max_entries=2) as cache:
+        for index in range(4):
+            image = tmp_path / f"IMG_000{index}.JPG"
+            image.write_bytes(bytes([index]))
+            cache.store(_scanned_target(image))
+
+        assert cache.trim() == 2
+        assert len(cache) == 2
+        assert cache.fill(FileTarget(str(tmp_path / "IMG_0003.JPG"))).from_cache
+        assert not cache.fill(FileTarget(str(tmp_path / "IMG_0000.JPG"))).from_cache
+
+
+def test_cache_entries_without_hash(tmp_path: Path) -> None:
+    """Entries stored by a dry run should only be hits when no hash is required."""
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+
+    unhashed_target = _scanned_target(image)
+    unhashed_target.file_hash = None
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3", require_hash=False) as cache:
+        cache.store(unhashed_target)
+        assert cache.fill(FileTarget(str(image))).from_cache
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        assert not cache.fill(FileTarget(str(image))).from_cache
+
+
+def test_cache_hashes_of_other_algorithms(tmp_path: Path) -> None:
+    """Hashes stored with one algorithm should never be restored for another."""
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+
+    with sc.ScanCache(tmp_path / "cache.sqlite3") as cache:
+        cache.store(_scanned_target(image))
+
+    with sc.ScanCache(
+            tmp_path / "cache.sqlite3",
+            hash_algorithm=fl.HashAlgorithm.blake2b,
+    ) as cache:
+        assert not cache.fill(FileTarget(str(image))).from_cache
+
+    with sc.ScanCache(
+            tmp_path / "cache.sqlite3",
+            require_hash=False,
+            hash_algorithm=fl.HashAlgorithm.blake2b,
+    ) as cache:
+        restored = cache.fill(FileTarget(str(image)))
+
+        assert restored.from_cache
+        assert restored.file_hash is None
+        assert restored.datestamp == pendulum.datetime(2019, 2, 3, 14, 25, 1)
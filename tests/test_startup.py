@@ -0,0 +1,23 @@
+import subprocess
+import sys
+
+# Dependencies which should only be imported by the stages that need them.
+HEAVY_MODULES = ("rx", "cryptography", "exifread", "pendulum", "better_exceptions")
+
+CHECK_IMPORTS = f"""
+import sys
+import organiser.main
+print(",".join(sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules)))
+"""
+
+
+def test_cli_import_avoids_heavy_dependencies() -> None:
+    """Importing the CLI, e.g. for --help, shouldn't import any heavy dependency."""
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    assert result.stdout.strip() == ""
@@ -0,0 +1,181 @@
+import errno
+import os
+from pathlib import Path
+from typing import Iterator, List, Set
+
+import pytest
+
+from organiser import transfer
+
+
+@pytest.fixture(autouse=True)
+def clear_unsupported() -> Iterator[None]:
+    """Don't let primitives found unsupported in one test affect another."""
+    transfer._UNSUPPORTED.clear()
+    yield
+    transfer._UNSUPPORTED.clear()
+
+
+def _unsupported(*_: object) -> None:
+    raise OSError(errno.EOPNOTSUPP, "Not supported")
+
+
+def _copy(source: Path, destination: Path) -> transfer.TransferMethod:
+    file_descriptor = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    try:
+        return transfer.copy_into(str(source), file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+@pytest.mark.parametrize(
+    "unsupported, expected_methods",
+    [
+        (
+            ["reflink"],
+            {transfer.TransferMethod.copy_file_range, transfer.TransferMethod.sendfile},
+        ),
+        (["reflink", "copy_file_range"], {transfer.TransferMethod.sendfile}),
+        (
+            ["reflink", "copy_file_range", "sendfile"],
+            {transfer.TransferMethod.buffered},
+        ),
+    ],
+)
+def test_copy_into_falls_back(
+        unsupported: List[str],
+        expected_methods: Set[transfer.TransferMethod],
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Unsupported primitives should fall through to the next, producing an identical copy."""
+    methods = dict(transfer.COPY_METHODS)
+    for name in unsupported:
+        methods[transfer.TransferMethod(name)] = _unsupported
+    monkeypatch.setattr(transfer, "COPY_METHODS", methods)
+
+    contents = os.urandom(3 * 1024 * 1024 + 17)
+    source = tmp_path / "source.jpg"
+    source.write_bytes(contents)
+
+    method = _copy(source, tmp_path / "destination.jpg")
+
+    # copy_file_range may legitimately be unsupported by the file system under test.
+    assert method in expected_methods
+    assert (tmp_path / "destination.jpg").read_bytes() == contents
+
+
+def test_copy_into_remembers_unsupported(
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """A primitive found unsupported should not be attempted again between the same devices."""
+    attempts: List[int] = []
+
+    def reflink(*_: object) -> None:
+        attempts.append(1)
+        _unsupported()
+
+    methods = dict(transfer.COPY_METHODS)
+    methods[transfer.TransferMethod.reflink] = reflink
+    monkeypatch.setattr(transfer, "COPY_METHODS", methods)
+
+    for index in range(3):
+        source = tmp_path / f"source{index}.jpg"
+        source.write_bytes(b"image data")
+        _copy(source, tmp_path / f"destination{index}.jpg")
+
+        assert (tmp_path / f"destination{index}.jpg").read_bytes() == b"image data"
+
+    assert len(attempts) == 1
+
+
+def test_copy_into_raises_real_failures(
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Failures other than a primitive being unsupported should not be masked by a fallback."""
+    def failing(*_: object) -> None:
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    methods = dict(transfer.COPY_METHODS)
+    methods[transfer.TransferMethod.reflink] = failing
+    monkeypatch.setattr(transfer, "COPY_METHODS", methods)
+
+    source = tmp_path / "source.jpg"
+    source.write_bytes(b"image data")
+
+    with pytest.raises(OSError, match="No space"):
+        _copy(source, tmp_path / "destination.jpg")
+
+
+def test_copy_into_falls_back_when_nothing_is_copied(
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Copying nothing at all is a primitive silently unsupported, rather than a failure."""
+    methods = dict(transfer.COPY_METHODS)
+    methods[transfer.TransferMethod.reflink] = _unsupported
+    monkeypatch.setattr(transfer, "COPY_METHODS", methods)
+    monkeypatch.setattr(os, "copy_file_range", lambda *_: 0, raising=False)
+
+    source = tmp_path / "source.jpg"
+    source.write_bytes(b"image data")
+
+    assert _copy(source, tmp_path / "destination.jpg") == transfer.TransferMethod.sendfile
+    assert (tmp_path / "destination.jpg").read_bytes() == b"image data"
+
+
+def test_short_copies_raise(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Copying stopping part way through a file is a real failure."""
+    copied = iter([4, 0])
+    monkeypatch.setattr(os, "copy_file_range", lambda *_: next(copied), raising=False)
+
+    with pytest.raises(OSError) as raised:
+        transfer._copy_file_range(0, 1, 10)
+
+    assert raised.value.errno == errno.EIO
+
+
+def test_move_into_renames(tmp_path: Path) -> None:
+    """Moves within a file system should be a rename, over the placeholder."""
+    source = tmp_path / "source.jpg"
+    source.write_bytes(b"image data")
+    destination = tmp_path / "destination.jpg"
+
+    file_descriptor = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    try:
+        method = transfer.move_into(str(source), str(destination), file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+    assert method is transfer.TransferMethod.rename
+    assert not source.exists()
+    assert destination.read_bytes() == b"image data"
+
+
+def test_move_into_copies_across_devices(
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Moves between file systems should copy into the placeholder, then remove the source."""
+    def cross_device(*_: object) -> None:
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(transfer.os, "replace", cross_device)
+
+    source = tmp_path / "source.jpg"
+    source.write_bytes(b"image data")
+    os.utime(source, (1_000_000, 1_000_000))
+    destination = tmp_path / "destination.jpg"
+
+    file_descriptor = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    try:
+        method = transfer.move_into(str(source), str(destination), file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+    assert method is not transfer.TransferMethod.rename
+    assert not source.exists()
+    assert destination.read_bytes() == b"image data"
+    assert destination.stat().st_mtime == 1_000_000
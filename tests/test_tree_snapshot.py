@@ -0,0 +1,105 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from organiser import tree_snapshot as ts
+
+# Far enough in the past that directories aren't considered racily listed.
+OLD_MTIME = 1_500_000_000
+
+
+def _age(base_dir: Path) -> None:
+    """Backdate the modification time of every directory beneath base_dir."""
+    for directory, _, _ in os.walk(base_dir):
+        os.utime(directory, (OLD_MTIME, OLD_MTIME))
+
+
+def _walk(snapshot: ts.TreeSnapshot, base_dir: Path, **kwargs: object) -> List[str]:
+    return sorted(
+        os.path.relpath(target.file_path, base_dir)
+        for target in snapshot.walk(base_dir, **kwargs)  # type: ignore
+    )
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    """A small photo library, with directories old enough to trust."""
+    base_dir = tmp_path / "library"
+    for directory in ("2019/01", "2019/02", "2020/01"):
+        (base_dir / directory).mkdir(parents=True)
+        (base_dir / directory / "IMG_0001.JPG").write_bytes(directory.encode())
+
+    _age(base_dir)
+    return base_dir
+
+
+def test_unchanged_directories_are_reused(tree: Path, tmp_path: Path) -> None:
+    """A second walk of an unchanged tree shouldn't list anything, but yield the same files."""
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        first = _walk(snapshot, tree)
+        assert snapshot.listed == 6
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        targets = list(snapshot.walk(tree))
+        assert snapshot.listed == 0
+        assert snapshot.reused == 6
+
+    assert sorted(os.path.relpath(target.file_path, tree) for target in targets) == first
+    for target in targets:
+        assert target.file_stat is not None
+        assert target.file_stat.st_mtime_ns == os.stat(target.file_path).st_mtime_ns
+        assert target.file_stat.st_size == os.stat(target.file_path).st_size
+
+
+def test_changed_directories_are_relisted(tree: Path, tmp_path: Path) -> None:
+    """Only directories with added or removed entries should be listed again."""
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        _walk(snapshot, tree)
+
+    (tree / "2019" / "02" / "IMG_0002.JPG").write_bytes(b"new")
+    shutil.rmtree(tree / "2020" / "01")
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        found = _walk(snapshot, tree)
+
+        # 2019/02 and 2020 changed, the deleted 2020/01 is pruned.
+        assert snapshot.listed == 2
+        assert snapshot.reused == 3
+
+    assert found == [
+        os.path.join("2019", "01", "IMG_0001.JPG"),
+        os.path.join("2019", "02", "IMG_0001.JPG"),
+        os.path.join("2019", "02", "IMG_0002.JPG"),
+    ]
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        assert snapshot._connection.execute("SELECT COUNT(*) FROM directories").fetchone()[0] == 5
+
+
+def test_recently_modified_directories_are_relisted(tree: Path, tmp_path: Path) -> None:
+    """Directories modified just before being listed may yet change unnoticed, so aren't trusted."""
+    (tree / "2019" / "01" / "IMG_0002.JPG").write_bytes(b"new")
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        _walk(snapshot, tree)
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        _walk(snapshot, tree)
+        assert snapshot.listed == 1
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"full_scan": True}, {"extensions": frozenset({"jpg"})}],
+)
+def test_full_scans(kwargs: Dict[str, object], tree: Path, tmp_path: Path) -> None:
+    """A full scan, or a change of filters, should list every directory."""
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        expected = _walk(snapshot, tree)
+
+    with ts.TreeSnapshot(tmp_path / "snapshot.sqlite3") as snapshot:
+        assert _walk(snapshot, tree, **kwargs) == expected
+        assert snapshot.listed == 6
@@ -0,0 +1,143 @@
+import os
+from pathlib import Path
+from threading import Event, Thread
+from typing import List
+
+import pytest
+
+from organiser import watch as wt
+from organiser.types import FileTarget
+
+
+class FakeClock:
+    """Manually advanced replacement for time.monotonic."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_debouncer_waits_for_quiet_period(tmp_path: Path) -> None:
+    """Closed files should only be ready once the quiet period has passed."""
+    clock = FakeClock()
+    debouncer = wt.Debouncer(quiet_period=2.0, clock=clock)
+
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image data")
+    debouncer.touch(str(image), closed=True)
+
+    clock.now = 1.0
+    assert debouncer.ready() == []
+
+    clock.now = 2.5
+    assert [target.file_path for target in debouncer.ready()] == [str(image)]
+    assert not debouncer
+
+
+def test_debouncer_waits_for_close(tmp_path: Path) -> None:
+    """Files still open for writing should never be ready, however long they are quiet."""
+    clock = FakeClock()
+    debouncer = wt.Debouncer(quiet_period=2.0, clock=clock)
+
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image")
+    debouncer.touch(str(image), closed=False)
+
+    clock.now = 100.0
+    assert debouncer.ready() == []
+
+    debouncer.touch(str(image), closed=True)
+    clock.now = 102.0
+    assert len(debouncer.ready()) == 1
+
+
+def test_debouncer_restarts_on_change(tmp_path: Path) -> None:
+    """Files which change without an event being seen should start a new quiet period."""
+    clock = FakeClock()
+    debouncer = wt.Debouncer(quiet_period=2.0, clock=clock)
+
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image")
+    debouncer.touch(str(image), closed=True)
+
+    image.write_bytes(b"image data, still arriving")
+    clock.now = 2.0
+    assert debouncer.ready() == []
+
+    clock.now = 4.0
+    assert len(debouncer.ready()) == 1
+
+
+def test_debouncer_drops_deleted_files(tmp_path: Path) -> None:
+    """Files removed before settling should be forgotten."""
+    clock = FakeClock()
+    debouncer = wt.Debouncer(quiet_period=2.0, clock=clock)
+
+    image = tmp_path / "IMG_0001.JPG"
+    image.write_bytes(b"image")
+    debouncer.touch(str(image), closed=True)
+    image.unlink()
+
+    clock.now = 2.0
+    assert debouncer.ready() == []
+    assert not debouncer
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watcher_finds_new_files(use_inotify: bool, tmp_path: Path) -> None:
+    """Existing files, and files added to new directories should both be yielded once."""
+    (tmp_path / "existing.jpg").write_bytes(b"existing")
+    (tmp_path / "ignored.txt").write_bytes(b"not an image")
+    (tmp_path / "@eaDir").mkdir()
+    (tmp_path / "@eaDir" / "thumbnail.jpg").write_bytes(b"thumbnail")
+
+    watcher = wt.Watcher(
+        tmp_path,
+        extensions=frozenset({"jpg"}),
+        quiet_period=0.05,
+        poll_interval=0.05,
+        use_inotify=use_inotify,
+    )
+    stop = Event()
+    found: List[FileTarget] = []
+
+    def consume() -> None:
+        for target in watcher.watch(stop):
+            found.append(target)
+            if len(found) == 1:
+                (tmp_path / "new" / "deeper").mkdir(parents=True)
+                (tmp_path / "new" / "deeper" / "added.jpg").write_bytes(b"added")
+            if len(found) >= 2:
+                stop.set()
+
+    thread = Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    stop.set()
+
+    assert [os.path.relpath(target.file_path, tmp_path) for target in found] == [
+        "existing.jpg",
+        os.path.join("new", "deeper", "added.jpg"),
+    ]
+    assert all(target.file_stat is not None for target in found)
+
+
+def test_watcher_ignores_placed_files(tmp_path: Path) -> None:
+    """Files we placed beneath the watched directory ourselves shouldn't be picked up."""
+    placed = tmp_path / "2019" / "02" / "IMG_0001.JPG"
+    placed.parent.mkdir(parents=True)
+    placed.write_bytes(b"placed")
+    (tmp_path / "IMG_0002.JPG").write_bytes(b"new")
+
+    watcher = wt.Watcher(tmp_path, quiet_period=0.05, use_inotify=False)
+    watcher.ignore(str(placed))
+
+    stop = Event()
+    found = []
+    for target in watcher.watch(stop):
+        found.append(os.path.relpath(target.file_path, tmp_path))
+        stop.set()
+
+    assert found == ["IMG_0002.JPG"]